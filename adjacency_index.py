@@ -0,0 +1,126 @@
+"""
+Like-Graph Adjacency Indexes
+
+CSR-style lookup tables over the "liked" interactions (rating above
+`EDGE_MIN_RATING`): product -> users who liked it, and user -> products they
+liked, each in interaction order. The collaborative steps of the hybrid
+recommender read a slice per lookup instead of masking the full log, and new
+interactions are appended to a small per-key overflow that is folded back
+into the CSR arrays once it grows past `MERGE_THRESHOLD` edges.
+"""
+import threading
+import numpy as np
+import pandas as pd
+
+# Edges below this are never needed by the recommender (it uses >= 4.0 and > 3.5)
+EDGE_MIN_RATING = 3.5
+MERGE_THRESHOLD = 50_000
+
+
+class AdjacencyIndex:
+    """
+    key -> neighbours with the rating on each edge. Rows for `keys[i]` are
+    `values[indptr[i]:indptr[i+1]]`; recent edges sit in `pending` until
+    merged. Readers take the whole state tuple at once, so a concurrent
+    merge never shows them a half-swapped index. `lock` is the one writers
+    hold around add(); lookups copy a key's pending edges under it.
+    """
+
+    def __init__(self, keys, values, ratings, lock=None):
+        self._state = self._build(keys, values, ratings)
+        self._pending_count = 0
+        self._lock = lock if lock is not None else threading.Lock()
+
+    @staticmethod
+    def _build(keys, values, ratings):
+        keys = np.asarray(keys, dtype=np.int64)
+        order = np.argsort(keys, kind='stable')  # stable keeps interaction order per key
+        sorted_keys = keys[order]
+        uniq, starts = np.unique(sorted_keys, return_index=True)
+        indptr = np.append(starts, len(sorted_keys)).astype(np.int64)
+        return (uniq, indptr,
+                np.asarray(values, dtype=np.int64)[order],
+                np.asarray(ratings, dtype=np.float32)[order],
+                {})
+
+    def add(self, keys, values, ratings):
+        pending = self._state[4]
+        for key, value, rating in zip(keys, values, ratings):
+            pending.setdefault(int(key), []).append((int(value), float(rating)))
+        self._pending_count += len(keys)
+        if self._pending_count >= MERGE_THRESHOLD:
+            self.merge()
+
+    def merge(self):
+        """Fold pending edges into the CSR arrays (after the existing ones)."""
+        keys, indptr, values, ratings, pending = self._state
+        if not pending:
+            return
+        row_keys = np.repeat(keys, np.diff(indptr))
+        new_keys = [k for k, edges in pending.items() for _ in edges]
+        new_values = [v for edges in pending.values() for v, _ in edges]
+        new_ratings = [r for edges in pending.values() for _, r in edges]
+        self._state = self._build(
+            np.concatenate([row_keys, np.asarray(new_keys, dtype=np.int64)]),
+            np.concatenate([values, np.asarray(new_values, dtype=np.int64)]),
+            np.concatenate([ratings, np.asarray(new_ratings, dtype=np.float32)]),
+        )
+        self._pending_count = 0
+
+    def lookup(self, key):
+        """(neighbours, ratings) of `key`, oldest edge first."""
+        keys, indptr, values, ratings, pending = self._state
+        pos = np.searchsorted(keys, key)
+        if pos < len(keys) and keys[pos] == key:
+            lo, hi = indptr[pos], indptr[pos + 1]
+            row_values, row_ratings = values[lo:hi], ratings[lo:hi]
+        else:
+            row_values = np.empty(0, dtype=np.int64)
+            row_ratings = np.empty(0, dtype=np.float32)
+        with self._lock:
+            # One copy, so an add() in between cannot give the two arrays different lengths
+            extra = list(pending.get(int(key), ()))
+        if extra:
+            row_values = np.concatenate([row_values, [v for v, _ in extra]]).astype(np.int64)
+            row_ratings = np.concatenate([row_ratings, [r for _, r in extra]]).astype(np.float32)
+        return row_values, row_ratings
+
+
+class LikeGraph:
+    """
+    Both directions of the like graph, kept in sync by `add()`.
+    """
+
+    def __init__(self, user_ids, product_idxs, ratings):
+        ratings = np.asarray(ratings, dtype=np.float32)
+        liked = ratings > EDGE_MIN_RATING
+        users = np.asarray(user_ids)[liked]
+        products = np.asarray(product_idxs)[liked]
+        self._lock = threading.Lock()
+        self.product_users = AdjacencyIndex(products, users, ratings[liked], self._lock)
+        self.user_products = AdjacencyIndex(users, products, ratings[liked], self._lock)
+
+    @classmethod
+    def from_log(cls, interaction_log):
+        cols = interaction_log.columns()
+        return cls(cols['user_id'], cols['product_index'], cols['rating'])
+
+    def add(self, user_ids, product_idxs, ratings):
+        """Incremental update, called as interactions are recorded."""
+        edges = [(u, p, r) for u, p, r in zip(user_ids, product_idxs, ratings) if r > EDGE_MIN_RATING]
+        if not edges:
+            return
+        users, products, rates = zip(*edges)
+        with self._lock:
+            self.product_users.add(products, users, rates)
+            self.user_products.add(users, products, rates)
+
+    def users_who_liked(self, product_idx, min_rating):
+        """Distinct users with rating >= min_rating on the product, first-seen order."""
+        users, ratings = self.product_users.lookup(product_idx)
+        return pd.unique(users[ratings >= min_rating])
+
+    def liked_by(self, user_id, min_rating, strict=False):
+        """Products the user rated >= min_rating (> if strict), in interaction order."""
+        products, ratings = self.user_products.lookup(user_id)
+        return products[ratings > min_rating] if strict else products[ratings >= min_rating]
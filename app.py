@@ -1,10 +1,14 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import pickle
 import time
 import os
-from sklearn.metrics.pairwise import linear_kernel
+from engine import Engine
+from facet_index import rating_label
+from product_cards import CardRenderer, page_bounds, PAGE_SIZE
+from metrics import METRICS, span, count, trace
+from user_store import VIEW, CART_ADD, CART_CLEAR, HISTORY_CAP
+from orders import new_order_id
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(
@@ -136,100 +140,90 @@ st.markdown(f"""
 """, unsafe_allow_html=True)
 
 # --- LOAD DATA ---
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_FILE = os.path.join(BASE_DIR, 'shop_sense_data.pkl')
-USERS_FILE = os.path.join(BASE_DIR, 'users_db.json')
+# Data, recommender and user-store settings are read by engine.py (SHOPSENSE_* env vars)
+# Product listing: 'pages' (prev/next) or 'scroll' (load more)
+LISTING_MODE = os.environ.get('SHOPSENSE_LISTING', 'pages')
+# Latency metrics: Prometheus text written to a file and/or served on a port;
+# the sidebar debug panel (internal timings) only with SHOPSENSE_DEBUG=1
+METRICS_FILE = os.environ.get('SHOPSENSE_METRICS_FILE')
+METRICS_PORT = os.environ.get('SHOPSENSE_METRICS_PORT')
+DEBUG_PANEL = os.environ.get('SHOPSENSE_DEBUG') == '1'
+TRENDING_ITEMS = 10
+PRODUCT_RECS = 5   # "You might also like" on the product page
+HOME_RECS = 10     # "Recommended For You" on the home page
+
+@st.cache_resource
+def start_metrics_exporter():
+    # Once per process; the registry itself is shared by every session
+    return METRICS.start_exporter(METRICS_FILE, METRICS_PORT)
+
+if METRICS_FILE or METRICS_PORT:
+    start_metrics_exporter()
 
 @st.cache_resource
 def load_resources():
+    """
+    Lazy artifact store: each component (and each index derived from them)
+    is loaded/built on first access, with memory-mapped arrays shared
+    across server processes. One engine (and user-store connection pool)
+    is shared by every session in this process.
+    """
     try:
-        with open(DATA_FILE, 'rb') as f:
-            data = pickle.load(f)
-        return data
+        with span('app.load_resources'):
+            return Engine.open()
     except FileNotFoundError:
         return None
 
-data_pack = load_resources()
+engine = load_resources()
 
-if data_pack:
-    df = data_pack['dataframe']
-    tfidf_matrix = data_pack['tfidf_matrix']
-    knn_model = data_pack['knn_model']
-    user_item_matrix = data_pack['user_item_matrix']
-    interactions_df = data_pack['interactions']
-    
-    # Ensure numerical types
-    for col in ['ratings', 'no_of_ratings', 'discount_price', 'actual_price']:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-        
+if engine:
+    df = engine.df
 else:
     st.warning("⏳ Data generation in progress or file missing...")
     st.stop()
 
 # --- USER AUTH & DB ---
-import json
-
-def load_users():
-    if not os.path.exists(USERS_FILE):
-        return {}
-    with open(USERS_FILE, 'r') as f:
-        try: return json.load(f)
-        except: return {}
-
-def save_users(users):
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f)
+user_store = engine.users
 
 def register_user(username):
-    users = load_users()
-    if username in users:
+    # Sequential ID past every known user, so it maps to a fresh matrix row
+    new_id = engine.register(username)
+    if new_id is None:
         return False, "Username already exists"
-    
-    # Assign a new loose ID for matrix ops
-    new_id = np.random.randint(2000, 100000) 
-    users[username] = {
-        'id': new_id, 
-        'history': [],
-        'cart': []
-    }
-    save_users(users)
     return True, new_id
 
 def authenticate_user(username):
-    users = load_users()
-    if username in users:
+    u_data = user_store.get(username)
+    if u_data is not None:
         # Return ID, History, Cart
-        u_data = users[username]
         return True, u_data['id'], u_data.get('history', []), u_data.get('cart', [])
     return False, None, [], []
 
-def update_user_db():
+def queue_user_event(kind, payload=None):
     """
-    Persist current session state (History, Cart) to the JSON DB.
+    Note a history/cart change of the logged-in user; everything queued in
+    one rerun is written by save_user_events() in a single append.
     """
     if st.session_state.user_id and st.session_state.user_id != "Guest":
-        users = load_users()
-        if st.session_state.user_id in users:
-            users[st.session_state.user_id]['history'] = st.session_state.history
-            users[st.session_state.user_id]['cart'] = st.session_state.cart
-            save_users(users)
+        st.session_state.pending_events.append((kind, payload))
+
+def save_user_events():
+    events = st.session_state.get('pending_events')
+    if events and st.session_state.user_id and st.session_state.user_id != "Guest":
+        with span('app.save_user'):
+            user_store.append(st.session_state.user_id, events)
+    st.session_state.pending_events = []
 
 def record_interaction(user_id, product_idx, rating):
     """
-    Real-time interaction recording + Persistence
+    Real-time interaction recording (orders go through engine.place_order)
     """
-    global interactions_df
-    new_row = {'user_id': user_id, 'product_index': product_idx, 'rating': rating}
-    interactions_df = pd.concat([interactions_df, pd.DataFrame([new_row])], ignore_index=True)
-    data_pack['interactions'] = interactions_df 
-    
-    # Also trigger DB Save for history/cart sync if needed
-    update_user_db() 
+    engine.record(user_id, [product_idx], rating)
 
 # --- STATE ---
 if 'page' not in st.session_state: st.session_state.page = 'login'
 if 'cart' not in st.session_state: st.session_state.cart = [] # List of dicts
+if 'pending_events' not in st.session_state: st.session_state.pending_events = [] # Unsaved (kind, payload)
 if 'user_id' not in st.session_state: st.session_state.user_id = None # Display Name
 if 'sim_id' not in st.session_state: st.session_state.sim_id = None # Numeric ID for Matrix
 if 'selected_product' not in st.session_state: st.session_state.selected_product = None
@@ -239,92 +233,60 @@ if 'selected_product' not in st.session_state: st.session_state.selected_product
 def get_cbf_recs(idx, n=6):
     try:
         if idx is None: return pd.DataFrame()
-        cosine_sim = linear_kernel(tfidf_matrix[idx:idx+1], tfidf_matrix).flatten()
-        sim_scores = sorted(list(enumerate(cosine_sim)), key=lambda x: x[1], reverse=True)[1:n+1]
-        indices = [i[0] for i in sim_scores]
+        with span('app.cbf_recs'):
+            indices = engine.item_recs(idx, n)
         return df.iloc[indices]
-    except: return pd.DataFrame()
+    except Exception:
+        count('fallback.cbf_recs')
+        return pd.DataFrame()
+
+def get_trending(n=10, category=None):
+    """Row positions of the most popular products (precomputed, time-decayed)."""
+    try:
+        with span('app.trending'):
+            return engine.trending(n, category)
+    except Exception:
+        count('fallback.trending')
+        return []
 
 def get_hybrid_recs(uid, history_items=None, n=12):
+    """
+    Cached across sessions per (user, recent view history: the last 20
+    items); record_interaction invalidates the entries of the acting user
+    and of liked items.
+    """
     try:
-        recs_idx = []
-        seen = set()
-        
-        if history_items:
-            last_viewed = history_items[-1]
-            try:
-                # A. Content-Based (Visual/Description Similarity)
-                cosine_sim = linear_kernel(tfidf_matrix[last_viewed:last_viewed+1], tfidf_matrix).flatten()
-                sim_scores = sorted(list(enumerate(cosine_sim)), key=lambda x: x[1], reverse=True)[1:4] 
-                for i_idx, score in sim_scores:
-                    if i_idx not in seen:
-                        recs_idx.append(i_idx)
-                        seen.add(i_idx)
-                        
-                # B. Real-Time Collaborative (Item-User-Item)
-                # "Find users who liked what I just viewed, and show me what else they liked."
-                peers = interactions_df[
-                    (interactions_df['product_index'] == last_viewed) & 
-                    (interactions_df['rating'] >= 4.0)
-                ]['user_id'].unique()
-                
-                # Limit to 5 peers for speed
-                for peer in peers[:5]:
-                    peer_likes = interactions_df[
-                        (interactions_df['user_id'] == peer) & 
-                        (interactions_df['rating'] >= 4.0)
-                    ]['product_index'].values
-                    
-                    for p_idx in peer_likes:
-                        if p_idx not in seen and p_idx != last_viewed:
-                            recs_idx.append(p_idx)
-                            seen.add(p_idx)
-                            if len(recs_idx) >= 8: break # Cap peer recs
-                    if len(recs_idx) >= 8: break
-            except: pass
-
-        # 2. Collaborative Filtering (Background Preferences)
-        if uid is not None:
-             try:
-                user_vec = user_item_matrix.getrow(uid)
-                dists, indices = knn_model.kneighbors(user_vec, n_neighbors=6)
-                sim_users = indices[0][1:]
-                for u in sim_users:
-                    liked = interactions_df[(interactions_df['user_id'] == u) & (interactions_df['rating'] > 3.5)]
-                    for p_idx in liked['product_index'].values:
-                        if p_idx not in seen and p_idx not in recs_idx:
-                            recs_idx.append(p_idx)
-                            seen.add(p_idx)
-                            if len(recs_idx) >= n: break
-                    if len(recs_idx) >= n: break
-             except: pass
-             
-        while len(recs_idx) < n:
-            rand_idx = np.random.randint(0, len(df))
-            if rand_idx not in seen and rand_idx not in recs_idx:
-                recs_idx.append(rand_idx)
-                
-        return df.iloc[recs_idx[:n]]
-    except: return pd.DataFrame()
+        with span('app.hybrid_recs'):
+            recs_idx = engine.user_recs(uid, history_items, n)
+        return df.iloc[recs_idx]
+    except Exception:
+        count('fallback.hybrid_recs')
+        return pd.DataFrame()
 
 # --- NAVIGATION ACTIONS ---
 def go_home():
     st.session_state.page = 'home'
     st.session_state.selected_product = None
     # Reset Filters
-    if 'cat_filter' in st.session_state: st.session_state.cat_filter = "All"
+    for key in FILTER_KEYS.values():
+        if key in st.session_state: st.session_state[key] = "All"
     if 'search_query' in st.session_state: st.session_state.search_query = ""
+    st.session_state.listing_page = 0
 
 def go_product(idx):
     st.session_state.page = 'product'
     st.session_state.selected_product = idx
     if 'history' not in st.session_state: st.session_state.history = []
     st.session_state.history.append(idx)
+    del st.session_state.history[:-HISTORY_CAP]
     
     # Record VIEW interaction & Persist History
     if st.session_state.sim_id:
         record_interaction(st.session_state.sim_id, idx, 1.0)
-        # record_interaction calls update_user_db() internally now, so redundant call removed
+    queue_user_event(VIEW, idx)
+    # Start on the product page's similar items and the refreshed home recs
+    # while this click's rerun is still on its way
+    engine.prefetch_view(st.session_state.sim_id, st.session_state.history, PRODUCT_RECS, HOME_RECS)
 
 def go_cart():
     st.session_state.page = 'cart'
@@ -348,7 +310,7 @@ def render_sidebar():
                 
             st.markdown("---")
             if st.button("Logout", use_container_width=True):
-                update_user_db() # Persist current state before clearing
+                save_user_events() # Persist this rerun's changes before clearing
                 st.session_state.history = []
                 st.session_state.cart = []
                 st.session_state.user_id = None
@@ -364,40 +326,65 @@ def render_sidebar():
 
 # --- VIEWS ---
 
+@st.cache_resource
+def get_card_renderer():
+    # Card fragments memoised per product, shared by every session
+    return CardRenderer(df, images=engine.images)
+
 def render_grid(products, title="", key_prefix="grid"):
+    """
+    products: catalogue row positions, or a slice of `df`.
+    """
     if title: st.subheader(title)
-    if products.empty:
+    if isinstance(products, pd.DataFrame):
+        rows = df.index.get_indexer(products.index)
+    else:
+        rows = np.asarray(products, dtype=np.int64)
+    if len(rows) == 0:
         st.info("No products found.")
         return
 
+    with span('app.render_cards'):
+        cards = get_card_renderer().cards(rows)
+    labels = df.index[rows]
     cols = st.columns(5)
-    for i, (idx, row) in enumerate(products.iterrows()):
+    for i, (idx, card) in enumerate(zip(labels, cards)):
         with cols[i % 5]:
-            img_src = row['image']
-            fallback = "https://via.placeholder.com/200"
-            price = f"RM {float(row['discount_price']):.2f}"
-            
-            r_val = min(max(float(row['ratings']), 0.0), 5.0)
-            
-            st.markdown(f"""
-            <div class="product-card">
-                <div class="product-img-container">
-                    <img src="{img_src}" class="product-img" onerror="this.onerror=null;this.src='{fallback}';">
-                </div>
-                <div class="card-content">
-                    <div class="product-title">{row['name']}</div>
-                    <div style="margin-top:auto">
-                        <div class="product-price"><span style="font-size:10px">RM</span>{price[3:]}</div>
-                        <div class="product-rating">
-                            <span style="color:#ffce3d;">★</span> {r_val:.1f}
-                        </div>
-                    </div>
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
+            st.markdown(card, unsafe_allow_html=True)
             
             if st.button("View", key=f"btn_{key_prefix}_{idx}", use_container_width=True):
-                go_product(idx)
+                go_product(int(idx))
+                st.rerun()
+
+def render_listing(rows, title="", key_prefix="list"):
+    """
+    Paginated listing over an index array: only the visible page(s) are
+    looked up and rendered.
+    """
+    page = st.session_state.get('listing_page', 0)
+    if LISTING_MODE == 'scroll':
+        stop = min((page + 1) * PAGE_SIZE, len(rows))
+        render_grid(rows[:stop], title, key_prefix=key_prefix)
+        if stop < len(rows):
+            if st.button(f"Load more ({len(rows) - stop} left)", key=f"{key_prefix}_more", use_container_width=True):
+                st.session_state.listing_page = page + 1
+                st.rerun()
+        return
+
+    start, stop, page = page_bounds(len(rows), page)
+    render_grid(rows[start:stop], title, key_prefix=key_prefix)
+    n_pages = max(-(-len(rows) // PAGE_SIZE), 1)
+    if n_pages > 1:
+        c1, c2, c3 = st.columns([1, 2, 1])
+        with c1:
+            if st.button("‹ Prev", key=f"{key_prefix}_prev", disabled=page == 0, use_container_width=True):
+                st.session_state.listing_page = page - 1
+                st.rerun()
+        with c2:
+            st.markdown(f"<div style='text-align:center; color:#757575; padding-top:8px'>Page {page + 1} of {n_pages} · {len(rows)} results</div>", unsafe_allow_html=True)
+        with c3:
+            if st.button("Next ›", key=f"{key_prefix}_next", disabled=page >= n_pages - 1, use_container_width=True):
+                st.session_state.listing_page = page + 1
                 st.rerun()
 
 def page_cart():
@@ -421,7 +408,7 @@ def page_cart():
              total += item['price']
              st.markdown(f"""
              <div style="padding:15px; background:white; border-radius:8px; margin-bottom:10px; display:flex; align-items:center; box-shadow:0 1px 2px rgba(0,0,0,0.05)">
-                <img src="{item['image']}" style="width:50px; height:50px; object-fit:contain; margin-right:15px; border-radius:4px;">
+                <img src="{engine.images.link(item['image'])}" onerror="this.onerror=null;this.src='{engine.images.placeholder}';" style="width:50px; height:50px; object-fit:contain; margin-right:15px; border-radius:4px;">
                 <div style="flex:1;"><b>{item['name']}</b> <br> <span style="color:#ee4d2d">RM {item['price']:.2f}</span></div>
                 <div>Qty: 1</div>
              </div>
@@ -439,17 +426,19 @@ def page_cart():
         
         st.selectbox("Payment Method", ["Credit Card", "Online Banking", "COD"])
         
+        # One order ID per checkout: a double click or rerun places it once
+        if not st.session_state.get('checkout_id'): st.session_state.checkout_id = new_order_id()
         if st.button("Place Order", type="primary", use_container_width=True):
-            # Record Purchase Interaction (Strong Signal)
-            if st.session_state.sim_id:
-                for item in st.session_state.cart:
-                    record_interaction(st.session_state.sim_id, item['idx'], 5.0)
+            # Purchase interactions (strong signal) are recorded by the order worker
+            order_id = st.session_state.checkout_id
+            with span('app.place_order'):
+                engine.place_order(order_id, st.session_state.sim_id,
+                                   [item['idx'] for item in st.session_state.cart])
             
-            st.success("Order Placed Successfully!")
-            st.balloons()
             st.session_state.cart = []
-            update_user_db() # Persist empty cart
-            time.sleep(2)
+            st.session_state.checkout_id = None
+            st.session_state.order_placed = order_id
+            queue_user_event(CART_CLEAR) # Persist empty cart
             go_home()
             st.rerun()
 
@@ -476,14 +465,15 @@ def page_product_detail():
     with col1:
         st.markdown(f"""
         <div style="padding:10px; background:white; border-radius:8px; display:flex; justify-content:center;">
-            <img src="{row['image']}" style="max-width:100%; max-height:350px; object-fit:contain;">
+            <img src="{engine.images.link(row['image'], 'large')}" onerror="this.onerror=null;this.src='{engine.images.placeholder}';" style="max-width:100%; max-height:350px; object-fit:contain;">
         </div>
         """, unsafe_allow_html=True)
     
     with col2:
         st.markdown(f"<h2 style='margin-bottom:10px'>{row['name']}</h2>", unsafe_allow_html=True)
         
-        price_val = float(row['discount_price'])
+        # Via str, as in Engine.products: float32 17.09 would be stored in the cart as 17.09000015258789
+        price_val = float(str(row['discount_price']))
         
         # Compact Rating & Price
         st.markdown(f"""
@@ -495,7 +485,7 @@ def page_product_detail():
         <div style='display:flex; align-items:center; gap:10px; font-size:14px; color:#555;'>
             <span>⭐ {float(row['ratings']):.1f}</span> • 
             <span>{int(row['no_of_ratings'])} ratings</span> • 
-            <span>{np.random.randint(50, 2000)} sold</span>
+            <span>{engine.sold(idx):,} sold</span>
         </div>
         <hr style='margin:15px 0'>
         """, unsafe_allow_html=True)
@@ -520,7 +510,7 @@ def page_product_detail():
                 # Record Cart Interaction & Persist Cart
                 if st.session_state.sim_id:
                     record_interaction(st.session_state.sim_id, idx, 3.5)
-                update_user_db() # Persist cart after adding item
+                queue_user_event(CART_ADD, item_data) # Persist cart after adding item
                 
                 st.toast("Added to Cart!")
                 time.sleep(0.5) # Short pause for toast visibility
@@ -530,7 +520,7 @@ def page_product_detail():
     st.write("")
     st.write("")
     st.markdown("##### You might also like")
-    recs = get_cbf_recs(idx, n=5)
+    recs = get_cbf_recs(idx, n=PRODUCT_RECS)
     if not recs.empty:
         render_grid(recs, "", key_prefix="sim")
 
@@ -593,52 +583,115 @@ def page_login():
             st.session_state.history = []
             st.rerun()
 
+FILTER_KEYS = {'main_category': 'main_cat_filter', 'category': 'cat_filter',
+               'price': 'price_filter', 'rating': 'rating_filter'}
+FILTER_LABELS = {'main_category': "Department", 'category': "Category",
+                 'price': "Price", 'rating': "Rating"}
+
+def render_filters(counts, selection):
+    """Sidebar facet selectboxes; options with no matching products are hidden."""
+    with st.sidebar:
+        st.markdown("### Filters")
+        for facet, key in FILTER_KEYS.items():
+            if facet not in counts:
+                continue
+            options = counts[facet]
+            shown = ["All"] + [v for v, n in options.items() if n or v == selection[facet]]
+            def label(value, options=options, facet=facet):
+                if value == "All":
+                    return "All"
+                name = rating_label(value) if facet == 'rating' else value
+                return f"{name} ({options.get(value, 0):,})"
+            st.selectbox(FILTER_LABELS[facet], shown, format_func=label, key=key)
+
 def page_home():
     render_sidebar()
     
+    # Confirmation of an order placed on the previous rerun
+    placed = st.session_state.pop('order_placed', None)
+    if placed:
+        st.success(f"Order #{placed[:8].upper()} Placed Successfully!")
+        st.balloons()
+    
     # Search Bar
     search = st.text_input("", placeholder="Search for products...", label_visibility="collapsed", key="search_query")
     
-    # Sidebar Filters
-    with st.sidebar:
-        st.markdown("### Filters")
-        if 'category' in df.columns:
-            cats = ["All"] + list(sorted(df['category'].unique()))
-            selected_cat = st.selectbox("Category", cats, index=0, key="cat_filter")
-        else:
-            selected_cat = "All"
-            
-    filtered = df.copy()
-    if search:
-        filtered = filtered[filtered['name'].str.contains(search, case=False)]
-    if selected_cat != "All":
-        filtered = filtered[filtered['category'] == selected_cat]
+    # Sidebar Filters: the widgets' current values (already in session state
+    # on this rerun) select the rows first, so each option can show how many
+    # results picking it would give
+    selection = {facet: None if st.session_state.get(key, "All") == "All" else st.session_state[key]
+                 for facet, key in FILTER_KEYS.items()}
+    # Ranked row positions from the search + facet indexes (no dataframe
+    # copy/scan), kept per session until the query or a filter changes so
+    # paging does not re-search
+    listing_key = (search, tuple(selection.items()))
+    if st.session_state.get('listing_key') != listing_key:
+        with span('app.search'):
+            st.session_state.listing_rows, st.session_state.facet_counts = engine.filtered_search(
+                search, selection)
+        st.session_state.listing_key = listing_key
+        st.session_state.listing_page = 0
+    render_filters(st.session_state.facet_counts, selection)
+    filtered = search or any(v is not None for v in selection.values())
+    result_rows = st.session_state.listing_rows
         
     # Recommendations
     history = st.session_state.get('history', [])
     
     # Initialize caching for stable buttons
     if 'home_recs' not in st.session_state: st.session_state.home_recs = pd.DataFrame()
-    if 'last_hist_len' not in st.session_state: st.session_state.last_hist_len = 0
+    if 'last_hist' not in st.session_state: st.session_state.last_hist = ()
     
-    # Update recs only if history changed or we have none
-    if len(history) != st.session_state.last_hist_len or st.session_state.home_recs.empty:
-         if not search and selected_cat == "All":
-             new_recs = get_hybrid_recs(st.session_state.sim_id, history_items=history, n=10)
+    # Update recs only if history changed or we have none (capped, so compare contents)
+    if tuple(history) != st.session_state.last_hist or st.session_state.home_recs.empty:
+         if not filtered:
+             new_recs = get_hybrid_recs(st.session_state.sim_id, history_items=history, n=HOME_RECS)
              st.session_state.home_recs = new_recs
-             st.session_state.last_hist_len = len(history)
+             st.session_state.last_hist = tuple(history)
 
-    if not search and selected_cat == "All":
+    if not filtered:
         recs = st.session_state.home_recs
         if not recs.empty:
              render_grid(recs, f"Recommended For You {'(Updated)' if history else ''}", key_prefix="rec")
              st.markdown("---")
-             
-    title = f"{selected_cat}" if selected_cat != "All" else "Daily Discover"
-    render_grid(filtered.head(40), title, key_prefix="main")
+
+    # Trending overall on the plain home page, within the category when one is picked
+    if not search and (not filtered or selection['category']):
+        trending = get_trending(TRENDING_ITEMS, selection['category'])
+        if trending:
+            render_grid(trending, f"🔥 Trending{' in ' + selection['category'] if selection['category'] else ' Now'}",
+                        key_prefix="trend")
+            st.markdown("---")
+
+    title = selection['category'] or selection['main_category'] or "Daily Discover"
+    render_listing(result_rows, title, key_prefix="main")
+
+def render_debug_panel(run_trace):
+    """Opt-in sidebar panel: this rerun's stage breakdown + process-wide percentiles."""
+    snap = METRICS.snapshot()
+    with st.sidebar:
+        with st.expander("⏱ Latency (debug)"):
+            st.caption(f"This rerun: {run_trace.elapsed * 1000:.1f} ms")
+            st.code('\n'.join(f"{'  ' * s['depth']}{s['stage']:<28} {s['ms']:8.2f} ms"
+                              for s in run_trace.breakdown()) or "(no spans)", language=None)
+            if snap['histograms']:
+                hist = pd.DataFrame.from_dict(snap['histograms'], orient='index')
+                hist[['p50', 'p95', 'p99']] *= 1000
+                st.dataframe(hist[['count', 'p50', 'p95', 'p99']].round(2).sort_index(), use_container_width=True)
+            fallbacks = {k: v for k, v in snap['counters'].items() if k.startswith('fallback.')}
+            st.caption("Silent fallbacks: " + (', '.join(f"{k[9:]}={v}" for k, v in sorted(fallbacks.items())) or "none"))
 
 # --- ROUTER ---
-if st.session_state.page == 'login': page_login()
-elif st.session_state.page == 'home': page_home()
-elif st.session_state.page == 'product': page_product_detail()
-elif st.session_state.page == 'cart': page_cart()
+with trace() as run_trace:
+    try:
+        with span(f"page.{st.session_state.page}"):
+            if st.session_state.page == 'login': page_login()
+            elif st.session_state.page == 'home': page_home()
+            elif st.session_state.page == 'product': page_product_detail()
+            elif st.session_state.page == 'cart': page_cart()
+    finally:
+        # One write per rerun, also when st.rerun() cut it short
+        save_user_events()
+
+if DEBUG_PANEL:
+    render_debug_panel(run_trace)
@@ -0,0 +1,361 @@
+"""
+ShopSense Artifact Store
+
+Versioned on-disk layout for the model data, replacing the monolithic
+`shop_sense_data.pkl`:
+
+    shop_sense_artifacts/
+        CURRENT                      -> name of the active build
+        build-20240101-120000/
+            manifest.json            format version, shapes, component list
+            catalog.feather          product dataframe (uncompressed Arrow, compact dtypes)
+            tfidf_matrix/            data.npy, indices.npy, indptr.npy
+            user_item_matrix/        data.npy, indices.npy, indptr.npy
+            interactions/            user_id.npy, product_index.npy, rating.npy
+            knn_model.json           NearestNeighbors params (refit on load)
+            similarity_topk/         indices.npy, scores.npy (optional)
+            embeddings.npy           float32 dense product vectors (optional, see embeddings.py)
+            extras/                  build-pipeline state (optional, see build_artifacts.py)
+
+Arrays are opened with `mmap_mode='r'`, so several server processes share
+the same physical pages through the OS page cache, and every component is
+loaded on first access only. Builds are immutable; publishing a new one is
+an atomic swap of `CURRENT`.
+
+    python artifacts.py --from-pickle shop_sense_data.pkl
+"""
+import os
+import json
+import time
+import pickle
+import shutil
+import argparse
+import threading
+from collections.abc import Mapping
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, issparse
+from sklearn.neighbors import NearestNeighbors
+
+from catalog import compact_catalog, arrow_types_mapper
+from similarity_index import matrix_fingerprint
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ARTIFACT_DIR = os.path.join(BASE_DIR, 'shop_sense_artifacts')
+DATA_FILE = os.path.join(BASE_DIR, 'shop_sense_data.pkl')
+
+FORMAT_VERSION = 1
+SPARSE_PARTS = ('data', 'indices', 'indptr')
+INTERACTION_COLUMNS = ('user_id', 'product_index', 'rating')
+
+
+class ArtifactError(Exception):
+    pass
+
+
+# --- SPARSE / ARRAY HELPERS ---
+def save_sparse(path, matrix):
+    os.makedirs(path, exist_ok=True)
+    matrix = matrix.tocsr()
+    for part in SPARSE_PARTS:
+        np.save(os.path.join(path, f"{part}.npy"), getattr(matrix, part))
+    return {'shape': list(matrix.shape), 'nnz': int(matrix.nnz)}
+
+
+def load_sparse(path, meta):
+    parts = [np.load(os.path.join(path, f"{part}.npy"), mmap_mode='r') for part in SPARSE_PARTS]
+    return csr_matrix(tuple(parts), shape=tuple(meta['shape']), copy=False)
+
+
+# --- LAZY STORE ---
+class ArtifactStore(Mapping):
+    """
+    Read-only mapping whose values are produced by loader callables on first
+    access and then cached. Derived components (indexes built from the raw
+    artifacts) are registered the same way, so nothing is built until a page
+    actually needs it.
+    """
+
+    def __init__(self, source=None):
+        self.source = source
+        self._loaders = {}
+        self._values = {}
+        self._lock = threading.RLock()
+
+    def register(self, name, loader):
+        """`loader(store)` produces the component; it may read other components."""
+        self._loaders[name] = loader
+
+    def __getitem__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+        if name not in self._loaders:
+            raise KeyError(name)
+        with self._lock:
+            if name not in self._values:
+                self._values[name] = self._loaders[name](self)
+            return self._values[name]
+
+    def __contains__(self, name):
+        # Mapping's default would load the component just to test for it
+        return name in self._loaders
+
+    def __iter__(self):
+        return iter(self._loaders)
+
+    def __len__(self):
+        return len(self._loaders)
+
+    def is_loaded(self, name):
+        return name in self._values
+
+
+def _unpickle(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def _read_catalog(path, compact=True):
+    # Arrow-backed strings stay in the memory-mapped file; older builds
+    # wrote object/float64 columns and are compacted on load
+    from pyarrow import feather
+    df = feather.read_table(path, memory_map=True).to_pandas(types_mapper=arrow_types_mapper())
+    return df if compact else compact_catalog(df)
+
+
+def _refit_knn(path, store):
+    with open(path) as f:
+        params = json.load(f)
+    return NearestNeighbors(**params).fit(store['user_item_matrix'])
+
+
+def open_build(build_dir):
+    """Lazy store over one build directory."""
+    manifest_path = os.path.join(build_dir, 'manifest.json')
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise ArtifactError(f"{build_dir}: unsupported format {manifest.get('format_version')}")
+
+    store = ArtifactStore(source=build_dir)
+    store.manifest = manifest
+    components = manifest['components']
+    join = lambda name: os.path.join(build_dir, name)
+
+    store.register('dataframe', lambda s: _read_catalog(
+        join('catalog.feather'), components['dataframe'].get('compact', False)))
+    for name in ('tfidf_matrix', 'user_item_matrix'):
+        store.register(name, lambda s, name=name: load_sparse(join(name), components[name]))
+    store.register('interactions', lambda s: pd.DataFrame(
+        {col: np.load(join(os.path.join('interactions', f"{col}.npy")), mmap_mode='r')
+         for col in INTERACTION_COLUMNS}, copy=False))
+
+    if 'knn_model' in components and components['knn_model'].get('kind') == 'params':
+        store.register('knn_model', lambda s: _refit_knn(join('knn_model.json'), s))
+    else:
+        store.register('knn_model', lambda s: _unpickle(join('knn_model.pkl')))
+
+    if 'similarity_topk' in components:
+        store.register('similarity_topk', lambda s: {
+            'indices': np.load(join('similarity_topk/indices.npy'), mmap_mode='r'),
+            'scores': np.load(join('similarity_topk/scores.npy'), mmap_mode='r'),
+            'fingerprint': components['similarity_topk']['fingerprint'],
+            # Older builds lack it, but only ever stored a table fresh against their matrix
+            'matrix_fingerprint': components['tfidf_matrix'].get(
+                'fingerprint', components['similarity_topk']['fingerprint']),
+        })
+
+    if 'embeddings' in components:
+        store.register('embeddings', lambda s: np.load(join('embeddings.npy'), mmap_mode='r'))
+
+    # Extra arrays kept for the build pipeline (term counts, row hashes, ...)
+    for name, meta in components.get('extras', {}).items():
+        path = join(os.path.join('extras', name))
+        if meta['kind'] == 'sparse':
+            store.register(name, lambda s, path=path, meta=meta: load_sparse(path, meta))
+        else:
+            store.register(name, lambda s, path=path: np.load(path + '.npy', mmap_mode='r'))
+    return store
+
+
+def open_pickle(path):
+    """
+    Lazy store over a legacy `shop_sense_data.pkl`: the pickle is read once,
+    on first access of any component.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    store = ArtifactStore(source=path)
+    cache = {}
+
+    def component(name):
+        def load(s):
+            if 'pack' not in cache:
+                cache['pack'] = _unpickle(path)
+                cache['pack']['dataframe'] = compact_catalog(cache['pack']['dataframe'])
+            return cache['pack'][name]
+        return load
+
+    for name in ('dataframe', 'tfidf_matrix', 'knn_model', 'user_item_matrix', 'interactions'):
+        store.register(name, component(name))
+    return store
+
+
+def current_build(root=ARTIFACT_DIR):
+    try:
+        with open(os.path.join(root, 'CURRENT')) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    build_dir = os.path.join(root, name)
+    return build_dir if os.path.isdir(build_dir) else None
+
+
+def open_artifacts(root=ARTIFACT_DIR, legacy_pickle=DATA_FILE):
+    """
+    The active build under `root`, else the legacy pickle. Raises
+    FileNotFoundError when neither exists.
+    """
+    build_dir = current_build(root)
+    if build_dir is not None:
+        return open_build(build_dir)
+    return open_pickle(legacy_pickle)
+
+
+# --- WRITING ---
+def write_build(data, root=ARTIFACT_DIR, similarity_index=None, publish=True,
+                extras=None, build_state=None, embeddings=None):
+    """
+    Write `data` (the data-pack dict) as a new immutable build and, if
+    `publish`, point CURRENT at it. `extras` maps names to arrays or sparse
+    matrices stored under extras/; `build_state` is free-form manifest
+    metadata for the next incremental build; `embeddings` is an optional
+    (vectors, explained_variance) pair from embeddings.fit_embeddings.
+    Returns the build directory.
+    """
+    name = time.strftime('build-%Y%m%d-%H%M%S')
+    build_dir = os.path.join(root, name)
+    suffix = 1
+    while os.path.exists(build_dir):
+        build_dir = os.path.join(root, f"{name}-{suffix}")
+        suffix += 1
+    tmp_dir = build_dir + '.tmp'
+    os.makedirs(tmp_dir)
+    components = {}
+
+    df = compact_catalog(data['dataframe'].reset_index(drop=True))
+    df.to_feather(os.path.join(tmp_dir, 'catalog.feather'), compression='uncompressed')
+    components['dataframe'] = {'rows': len(df), 'columns': list(df.columns), 'compact': True}
+
+    for name in ('tfidf_matrix', 'user_item_matrix'):
+        components[name] = save_sparse(os.path.join(tmp_dir, name), data[name])
+    # Readers check the top-K table against this instead of hashing the matrix
+    components['tfidf_matrix']['fingerprint'] = matrix_fingerprint(data['tfidf_matrix'].tocsr())
+
+    inter_dir = os.path.join(tmp_dir, 'interactions')
+    os.makedirs(inter_dir)
+    interactions = data['interactions']
+    for col in INTERACTION_COLUMNS:
+        np.save(os.path.join(inter_dir, f"{col}.npy"), interactions[col].to_numpy())
+    components['interactions'] = {'rows': len(interactions)}
+
+    # A brute-force NearestNeighbors only stores its training matrix, so it
+    # is refit from the memory-mapped user_item_matrix instead of duplicated
+    knn = data['knn_model']
+    try:
+        params = json.dumps(knn.get_params()) if type(knn) is NearestNeighbors else None
+    except TypeError:
+        params = None
+    if params is not None:
+        with open(os.path.join(tmp_dir, 'knn_model.json'), 'w') as f:
+            f.write(params)
+        components['knn_model'] = {'kind': 'params'}
+    else:
+        with open(os.path.join(tmp_dir, 'knn_model.pkl'), 'wb') as f:
+            pickle.dump(knn, f)
+        components['knn_model'] = {'kind': 'pickle'}
+
+    if similarity_index is not None and similarity_index.is_fresh:
+        topk_dir = os.path.join(tmp_dir, 'similarity_topk')
+        os.makedirs(topk_dir)
+        np.save(os.path.join(topk_dir, 'indices.npy'), similarity_index.indices)
+        np.save(os.path.join(topk_dir, 'scores.npy'), similarity_index.scores)
+        components['similarity_topk'] = {'k': similarity_index.k,
+                                         'fingerprint': similarity_index.fingerprint}
+
+    if embeddings is not None:
+        vectors, explained = embeddings
+        np.save(os.path.join(tmp_dir, 'embeddings.npy'), np.ascontiguousarray(vectors, dtype=np.float32))
+        components['embeddings'] = {'shape': list(vectors.shape), 'explained_variance': explained}
+
+    if extras:
+        extras_dir = os.path.join(tmp_dir, 'extras')
+        os.makedirs(extras_dir)
+        components['extras'] = {}
+        for name, value in extras.items():
+            if issparse(value):
+                meta = save_sparse(os.path.join(extras_dir, name), value)
+                meta['kind'] = 'sparse'
+            else:
+                np.save(os.path.join(extras_dir, f"{name}.npy"), value)
+                meta = {'kind': 'array', 'shape': list(value.shape)}
+            components['extras'][name] = meta
+
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+        json.dump({'format_version': FORMAT_VERSION, 'created': time.time(),
+                   'components': components, 'build_state': build_state or {}}, f, indent=2)
+    os.rename(tmp_dir, build_dir)
+    if publish:
+        publish_build(build_dir, root)
+    return build_dir
+
+
+def publish_build(build_dir, root=ARTIFACT_DIR):
+    """Atomically make `build_dir` the active build."""
+    tmp_path = os.path.join(root, 'CURRENT.tmp')
+    with open(tmp_path, 'w') as f:
+        f.write(os.path.basename(build_dir))
+    os.replace(tmp_path, os.path.join(root, 'CURRENT'))
+
+
+def prune_builds(root=ARTIFACT_DIR, keep=2):
+    """Delete all but the newest `keep` builds (never the active one)."""
+    active = current_build(root)
+    builds = sorted(d for d in os.listdir(root)
+                    if d.startswith('build-') and not d.endswith('.tmp'))
+    for name in builds[:-keep] if keep else builds:
+        path = os.path.join(root, name)
+        if path != active:
+            shutil.rmtree(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert or inspect ShopSense artifacts.")
+    parser.add_argument('--root', default=ARTIFACT_DIR)
+    parser.add_argument('--from-pickle', metavar='PKL', help="Write a build from a legacy data pack")
+    parser.add_argument('--topk', metavar='NPZ', help="Include a top-K similarity index (.npz)")
+    parser.add_argument('--keep', type=int, default=2, help="Builds to keep after publishing")
+    args = parser.parse_args()
+
+    if args.from_pickle:
+        from similarity_index import SimilarityIndex
+        with open(args.from_pickle, 'rb') as f:
+            data = pickle.load(f)
+        index = SimilarityIndex.load(data['tfidf_matrix'], args.topk) if args.topk else None
+        build_dir = write_build(data, args.root, similarity_index=index)
+        prune_builds(args.root, keep=args.keep)
+        print(f"Published {build_dir}")
+    else:
+        build_dir = current_build(args.root)
+        if build_dir is None:
+            print("No published build.")
+            return
+        with open(os.path.join(build_dir, 'manifest.json')) as f:
+            print(build_dir)
+            print(f.read())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,435 @@
+"""
+ShopSense Benchmark
+
+Reproducible load test for the hot paths, run outside Streamlit:
+
+1. generate: a synthetic catalogue + interaction log at a chosen scale
+   (seeded, chunked so multi-million-row datasets fit in memory), built
+   into an artifact build with build_artifacts.py and optionally also
+   written as a legacy `shop_sense_data.pkl`.
+2. trace: seeded session traces (login, home, search, view, add to cart,
+   order) as JSON lines, with Zipf-skewed product popularity.
+3. replay: runs the traces against the same recommender, search,
+   interaction-log and user-store calls the app makes, on a thread pool
+   like Streamlit's sessions, and writes throughput, per-operation latency
+   percentiles, per-stage metrics and peak memory as JSON.
+4. compare: diff two result files.
+
+    python benchmark.py generate --scale small --out bench/small
+    python benchmark.py trace --data bench/small --sessions 2000
+    python benchmark.py replay --data bench/small --threads 4 --out bench/small/results.json
+    python benchmark.py compare before.json after.json
+"""
+import os
+import sys
+import json
+import time
+import pickle
+import random
+import argparse
+import platform
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+from metrics import METRICS
+
+# products, users, interactions
+SCALES = {
+    'tiny': (10_000, 1_000, 100_000),
+    'small': (100_000, 10_000, 1_000_000),
+    'medium': (1_000_000, 100_000, 10_000_000),
+    'large': (5_000_000, 1_000_000, 10_000_000),
+}
+CHUNK_ROWS = 500_000
+ZIPF_S = 0.9  # popularity skew of products (and users)
+INTERACTION_RATINGS = ([1.0, 3.5, 4.0, 5.0], [0.6, 0.2, 0.1, 0.1])  # view, cart, rating, purchase
+
+CATALOG = {
+    'Electronics': {'Headphones': ['Headphones', 'Earbuds', 'Headset'],
+                    'Chargers': ['Charger', 'Power Bank', 'USB Cable'],
+                    'Phones': ['Smartphone', 'Phone Case', 'Screen Protector']},
+    'Fashion': {'Shirts': ['Shirt', 'T-Shirt', 'Polo'],
+                'Shoes': ['Running Shoes', 'Sneakers', 'Sandals'],
+                'Bags': ['Backpack', 'Wallet', 'Handbag']},
+    'Home': {'Kitchen': ['Frying Pan', 'Knife Set', 'Kettle'],
+             'Decor': ['Lamp', 'Cushion', 'Wall Clock']},
+    'Sports': {'Fitness': ['Yoga Mat', 'Dumbbell', 'Resistance Band'],
+               'Outdoor': ['Tent', 'Water Bottle', 'Hiking Boots']},
+}
+BRANDS = ['Vexo', 'Orbit', 'Kaya', 'Lumen', 'Nordik', 'Pace', 'Zenit', 'Aster']
+ADJECTIVES = ['Wireless', 'Premium', 'Classic', 'Ultra', 'Compact', 'Pro', 'Eco', 'Sport', 'Smart', 'Leather']
+
+OPS = ('login', 'home', 'search', 'view', 'cart', 'order')
+SESSION_STEPS = (4, 20)
+
+
+def log(msg):
+    print(f"[{time.strftime('%H:%M:%S')}] {msg}", file=sys.stderr, flush=True)
+
+
+# --- DATASET ---
+def _popularity(n, rng):
+    """Zipf weights over a random permutation of 0..n-1."""
+    weights = 1.0 / np.arange(1, n + 1) ** ZIPF_S
+    return (weights / weights.sum())[rng.permutation(n)]
+
+
+def product_chunk(start, stop, seed):
+    rng = np.random.default_rng([seed, start])
+    n = stop - start
+    subs = [(main, sub, nouns) for main, subs in CATALOG.items() for sub, nouns in subs.items()]
+    pick = rng.integers(len(subs), size=n)
+    main_cat = np.array([s[0] for s in subs], dtype=object)[pick]
+    sub_cat = np.array([s[1] for s in subs], dtype=object)[pick]
+    nouns = np.array([s[2][0] for s in subs], dtype=object)[pick]
+    alt = rng.integers(3, size=n)
+    for k in (1, 2):
+        mask = alt == k
+        nouns[mask] = np.array([s[2][k] for s in subs], dtype=object)[pick[mask]]
+    brands = np.array(BRANDS, dtype=object)[rng.integers(len(BRANDS), size=n)]
+    adjectives = np.array(ADJECTIVES, dtype=object)[rng.integers(len(ADJECTIVES), size=n)]
+    models = np.char.add('X', rng.integers(100, 999, size=n).astype(str)).astype(object)
+    name = brands + ' ' + adjectives + ' ' + nouns + ' ' + models
+    actual = np.round(np.exp(rng.normal(4.0, 1.0, size=n)), 2)
+    ids = np.arange(start, stop)
+    return pd.DataFrame({
+        'name': name,
+        'main_category': main_cat,
+        'sub_category': sub_cat,
+        'image': [f"https://picsum.photos/seed/{i}/200" for i in ids],
+        'link': [f"https://example.com/p/{i}" for i in ids],
+        'ratings': np.round(np.clip(rng.normal(4.0, 0.6, size=n), 1.0, 5.0), 1),
+        'no_of_ratings': rng.geometric(0.01, size=n),
+        'discount_price': np.round(actual * rng.uniform(0.5, 1.0, size=n), 2),
+        'actual_price': actual,
+    })
+
+
+def generate(out_dir, n_products, n_users, n_interactions, seed=0, workers=1, pickle_path=None):
+    """Write products.csv / interactions.csv under `out_dir` and build artifacts from them."""
+    os.makedirs(out_dir, exist_ok=True)
+    products_csv = os.path.join(out_dir, 'products.csv')
+    inter_csv = os.path.join(out_dir, 'interactions.csv')
+    started = time.time()
+
+    for i, start in enumerate(range(0, n_products, CHUNK_ROWS)):
+        product_chunk(start, min(start + CHUNK_ROWS, n_products), seed).to_csv(
+            products_csv, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+    log(f"{n_products} products -> {products_csv}")
+
+    rng = np.random.default_rng(seed)
+    product_p = _popularity(n_products, rng)
+    user_p = _popularity(n_users, rng)
+    for i, start in enumerate(range(0, n_interactions, CHUNK_ROWS)):
+        n = min(CHUNK_ROWS, n_interactions - start)
+        pd.DataFrame({
+            'user_id': rng.choice(n_users, size=n, p=user_p),
+            'product_index': rng.choice(n_products, size=n, p=product_p),
+            'rating': rng.choice(INTERACTION_RATINGS[0], size=n, p=INTERACTION_RATINGS[1]),
+        }).to_csv(inter_csv, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+    log(f"{n_interactions} interactions -> {inter_csv}")
+
+    from build_artifacts import build
+    t_build = time.time()
+    build_dir = build(products_csv, inter_csv, root=os.path.join(out_dir, 'shop_sense_artifacts'),
+                      workers=workers)
+    info = {'products': n_products, 'users': n_users, 'interactions': n_interactions, 'seed': seed,
+            'generate_s': round(t_build - started, 2), 'build_s': round(time.time() - t_build, 2),
+            'build_dir': build_dir}
+    if pickle_path:
+        write_pickle(build_dir, pickle_path)
+        info['pickle'] = pickle_path
+    with open(os.path.join(out_dir, 'dataset.json'), 'w') as f:
+        json.dump(info, f, indent=2)
+    return info
+
+
+def write_pickle(build_dir, path):
+    """The build as a legacy `shop_sense_data.pkl` data pack."""
+    from artifacts import open_build
+    store = open_build(build_dir)
+    inter = store['interactions']
+    pack = {
+        'dataframe': store['dataframe'],
+        'tfidf_matrix': store['tfidf_matrix'].copy(),
+        'knn_model': store['knn_model'],
+        'user_item_matrix': store['user_item_matrix'].copy(),
+        'interactions': pd.DataFrame({c: np.array(inter[c]) for c in inter.columns}),
+    }
+    with open(path, 'wb') as f:
+        pickle.dump(pack, f, protocol=pickle.HIGHEST_PROTOCOL)
+    log(f"Legacy data pack -> {path}")
+
+
+# --- TRACES ---
+def make_trace(data, n_sessions, seed=0, new_user_rate=0.1):
+    """
+    Seeded session traces: each session logs in, lands on home and then
+    browses (search / view / add to cart), sometimes ending with an order.
+    """
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    df = data['dataframe']
+    n_items, n_users = len(df), data['user_item_matrix'].shape[0]
+    popular = np_rng.choice(n_items, size=n_sessions * SESSION_STEPS[1], p=_popularity(n_items, np_rng))
+    names = df['name'].astype(str)
+    categories = sorted(df['category'].unique()) if 'category' in df.columns else []
+
+    events, cursor = [], 0
+    for s in range(n_sessions):
+        uid = rng.randrange(n_users) if rng.random() > new_user_rate else n_users + s
+        events += [{'s': s, 'op': 'login', 'user': uid}, {'s': s, 'op': 'home'}]
+        viewed, in_cart = None, False
+        for _ in range(rng.randint(*SESSION_STEPS)):
+            r = rng.random()
+            if r < 0.25:
+                words = names.iloc[int(popular[cursor % len(popular)])].split()
+                query = ' '.join(words[1:rng.randint(2, 3)]).lower()
+                if rng.random() < 0.3:
+                    query = query[:max(3, len(query) - rng.randint(1, 3))]  # typed prefix
+                cat = rng.choice(categories) if categories and rng.random() < 0.2 else None
+                events.append({'s': s, 'op': 'search', 'query': query, 'category': cat})
+            elif r < 0.75 or viewed is None:
+                viewed = int(popular[cursor % len(popular)])
+                events.append({'s': s, 'op': 'view', 'product': viewed})
+            elif r < 0.9:
+                events.append({'s': s, 'op': 'cart', 'product': viewed})
+                in_cart = True
+            else:
+                events.append({'s': s, 'op': 'home'})
+            cursor += 1
+        if in_cart and rng.random() < 0.5:
+            events.append({'s': s, 'op': 'order'})
+    return events
+
+
+def write_trace(events, path):
+    with open(path, 'w') as f:
+        for event in events:
+            f.write(json.dumps(event) + '\n')
+
+
+def read_trace(path):
+    sessions = {}
+    with open(path) as f:
+        for line in f:
+            event = json.loads(line)
+            sessions.setdefault(event['s'], []).append(event)
+    return list(sessions.values())
+
+
+# --- REPLAY ---
+class Session:
+    """The per-session state app.py keeps in st.session_state."""
+
+    def __init__(self):
+        self.username, self.uid, self.history, self.cart = None, None, [], []
+
+
+def replay_event(data, store, session, event, timings):
+    import recommender
+    from user_store import VIEW, CART_ADD, CART_CLEAR, HISTORY_CAP
+    op = event['op']
+    t0 = time.perf_counter()
+    if op == 'login':
+        session.username = f"bench_{event['user']}"
+        t = time.perf_counter()
+        record = store.get(session.username)
+        timings['user_store.get'].append(time.perf_counter() - t)
+        if record is None:
+            record = {'id': event['user'], 'history': [], 'cart': []}
+            store.create(session.username, record)
+        session.uid, session.history, session.cart = record['id'], record['history'], record['cart']
+    elif op == 'home':
+        recommender.cached_hybrid_recs(data, session.uid, session.history, 10)
+        data['search_index'].search('')
+    elif op == 'search':
+        data['search_index'].search(event['query'], category=event.get('category'))
+    elif op in ('view', 'cart', 'order'):
+        if op == 'view':
+            session.history = (session.history + [event['product']])[-HISTORY_CAP:]
+            recommender.record_interactions(data, session.uid, [event['product']], 1.0)
+            recommender.cached_content_recs(data, event['product'], 5)
+            change = (VIEW, event['product'])
+        elif op == 'cart':
+            session.cart.append({'idx': event['product']})
+            recommender.record_interactions(data, session.uid, [event['product']], 3.5)
+            change = (CART_ADD, {'idx': event['product']})
+        else:
+            if session.cart:
+                recommender.record_interactions(data, session.uid, [i['idx'] for i in session.cart], 5.0)
+            session.cart = []
+            change = (CART_CLEAR, None)
+        t = time.perf_counter()
+        store.append(session.username, [change])
+        timings['user_store.append'].append(time.perf_counter() - t)
+    timings[op].append(time.perf_counter() - t0)
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _summary(samples):
+    values = np.asarray(samples) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]) if len(values) else (0.0, 0.0, 0.0)
+    return {'count': len(values), 'mean_ms': round(float(values.mean()) if len(values) else 0.0, 4),
+            'p50_ms': round(float(p50), 4), 'p95_ms': round(float(p95), 4), 'p99_ms': round(float(p99), 4)}
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def replay(data_dir, sessions, threads=1, neighbour_backend='auto', rec_cache_mode='local'):
+    """Replay sessions (lists of events) concurrently; returns the results dict."""
+    from recommender import open_data
+    from user_store import SQLiteUserStore
+
+    run_dir = os.path.join(data_dir, f"replay-{os.getpid()}")
+    os.makedirs(run_dir, exist_ok=True)
+    rss_start = _peak_rss_mb()
+    t_load = time.perf_counter()
+    data = open_data(os.path.join(data_dir, 'shop_sense_artifacts'), os.path.join(data_dir, 'none.pkl'),
+                     neighbour_backend=neighbour_backend, rec_cache_mode=rec_cache_mode,
+                     log_dir=os.path.join(run_dir, 'interaction_log'))
+    for name in ('dataframe', 'similarity_index', 'search_index', 'like_graph', 'user_matrix',
+                 'popularity', 'session_profiles', 'rec_pipeline'):
+        data[name]
+    load_s = time.perf_counter() - t_load
+    store = SQLiteUserStore(os.path.join(run_dir, 'users.db'))
+    METRICS.reset()
+
+    def run_session(events):
+        timings = {op: [] for op in OPS + ('user_store.get', 'user_store.append')}
+        session = Session()
+        for event in events:
+            replay_event(data, store, session, event, timings)
+        return timings
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        per_session = list(pool.map(run_session, sessions))
+    wall = time.perf_counter() - started
+    store.close()
+
+    merged = {}
+    for timings in per_session:
+        for op, samples in timings.items():
+            merged.setdefault(op, []).extend(samples)
+    n_ops = sum(len(merged[op]) for op in OPS)
+    snap = METRICS.snapshot()
+    return {
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'config': {'threads': threads, 'sessions': len(sessions), 'neighbours': neighbour_backend,
+                   'rec_cache': rec_cache_mode},
+        'dataset': {'products': len(data['dataframe']), 'users': data['user_item_matrix'].shape[0]},
+        'load_s': round(load_s, 3),
+        'wall_s': round(wall, 3),
+        'events': n_ops,
+        'throughput_events_s': round(n_ops / wall, 1) if wall else None,
+        'peak_rss_mb': _peak_rss_mb(),
+        'rss_before_load_mb': rss_start,
+        'ops': {op: _summary(samples) for op, samples in merged.items() if samples},
+        'stages': {name: {k: round(v * 1000, 4) if k != 'count' else v for k, v in h.items()}
+                   for name, h in snap['histograms'].items()},
+        'counters': snap['counters'],
+    }
+
+
+def compare(before, after):
+    """Rows of (operation, metric, before, after, change %) for two result dicts."""
+    rows = []
+    for section in ('ops', 'stages'):
+        for op in sorted(set(before.get(section, {})) & set(after.get(section, {}))):
+            for metric in ('p50_ms', 'p95_ms', 'p99_ms') if section == 'ops' else ('p50', 'p95', 'p99'):
+                a, b = before[section][op].get(metric), after[section][op].get(metric)
+                if a is not None and b is not None:
+                    rows.append((op, metric, a, b, (b - a) / a * 100 if a else float('nan')))
+    for key in ('throughput_events_s', 'peak_rss_mb', 'load_s'):
+        a, b = before.get(key), after.get(key)
+        if a is not None and b is not None:
+            rows.append(('run', key, a, b, (b - a) / a * 100 if a else float('nan')))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ShopSense benchmark harness.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    gen = sub.add_parser('generate', help="Synthetic dataset + artifact build")
+    gen.add_argument('--out', required=True)
+    gen.add_argument('--scale', choices=sorted(SCALES), default='tiny')
+    gen.add_argument('--products', type=int)
+    gen.add_argument('--users', type=int)
+    gen.add_argument('--interactions', type=int)
+    gen.add_argument('--seed', type=int, default=0)
+    gen.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    gen.add_argument('--pickle', action='store_true', help="Also write shop_sense_data.pkl")
+
+    tr = sub.add_parser('trace', help="Generate session traces for a dataset")
+    tr.add_argument('--data', required=True)
+    tr.add_argument('--sessions', type=int, default=1000)
+    tr.add_argument('--seed', type=int, default=0)
+    tr.add_argument('--out', help="Trace file (default: <data>/trace.jsonl)")
+
+    rp = sub.add_parser('replay', help="Replay traces and report latencies")
+    rp.add_argument('--data', required=True)
+    rp.add_argument('--trace', help="Trace file (default: <data>/trace.jsonl)")
+    rp.add_argument('--threads', type=int, default=1)
+    rp.add_argument('--neighbours', default='auto')
+    rp.add_argument('--rec-cache', default='local')
+    rp.add_argument('--out', help="Results JSON (default: stdout)")
+
+    cmp_ = sub.add_parser('compare', help="Diff two result files")
+    cmp_.add_argument('before')
+    cmp_.add_argument('after')
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        products, users, interactions = SCALES[args.scale]
+        info = generate(args.out, args.products or products, args.users or users,
+                        args.interactions or interactions, seed=args.seed, workers=args.workers,
+                        pickle_path=os.path.join(args.out, 'shop_sense_data.pkl') if args.pickle else None)
+        print(json.dumps(info, indent=2))
+    elif args.command == 'trace':
+        from artifacts import open_artifacts
+        data = open_artifacts(os.path.join(args.data, 'shop_sense_artifacts'), os.path.join(args.data, 'none.pkl'))
+        events = make_trace(data, args.sessions, seed=args.seed)
+        path = args.out or os.path.join(args.data, 'trace.jsonl')
+        write_trace(events, path)
+        log(f"{len(events)} events in {args.sessions} sessions -> {path}")
+    elif args.command == 'replay':
+        sessions = read_trace(args.trace or os.path.join(args.data, 'trace.jsonl'))
+        results = replay(args.data, sessions, threads=args.threads, neighbour_backend=args.neighbours,
+                         rec_cache_mode=args.rec_cache)
+        text = json.dumps(results, indent=2)
+        if args.out:
+            with open(args.out, 'w') as f:
+                f.write(text)
+        else:
+            print(text)
+    else:
+        with open(args.before) as f:
+            before = json.load(f)
+        with open(args.after) as f:
+            after = json.load(f)
+        for op, metric, a, b, change in compare(before, after):
+            print(f"{op:24s} {metric:22s} {a:12.3f} -> {b:12.3f}  {change:+7.1f}%")
+
+
+if __name__ == '__main__':
+    main()
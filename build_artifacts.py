@@ -0,0 +1,264 @@
+"""
+Offline Artifact Build
+
+Produces the model data the app serves (catalogue, TF-IDF matrix, user-item
+matrix, user KNN model, top-K similar items) from the raw product catalogue
+and interaction CSVs, and publishes it as a new artifact build.
+
+Both inputs are streamed in chunks. Product text is vectorised with a
+stateless HashingVectorizer, so chunks are tokenised in parallel worker
+processes and an incremental build only re-tokenises rows whose text
+changed (detected by a per-row content hash kept in the previous build).
+Incremental builds keep the previous IDF weights, which leaves unchanged
+TF-IDF rows bit-identical and lets the top-K table be refreshed for the
+changed products only. The interaction CSV is treated as append-only:
+an incremental build reads just the rows added since the last build and
+folds them into the affected user rows.
+
+    python build_artifacts.py --products products.csv --interactions interactions.csv
+    python build_artifacts.py --products products.csv --interactions interactions.csv --incremental
+"""
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, diags, vstack
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.neighbors import NearestNeighbors
+from sklearn.preprocessing import normalize
+
+from artifacts import ARTIFACT_DIR, open_build, current_build, write_build, prune_builds
+from similarity_index import SimilarityIndex, DEFAULT_K
+from embeddings import fit_embeddings
+
+TEXT_FIELDS = ['name', 'category', 'main_category']
+N_FEATURES = 2 ** 18
+CHUNK_SIZE = 50_000
+KNN_PARAMS = {'metric': 'cosine', 'algorithm': 'brute', 'n_neighbors': 6}
+
+
+def log(msg):
+    print(f"[{time.strftime('%H:%M:%S')}] {msg}", flush=True)
+
+
+# --- PRODUCTS ---
+def _vectoriser():
+    return HashingVectorizer(n_features=N_FEATURES, alternate_sign=False, norm=None,
+                             stop_words='english')
+
+
+def _vectorise_chunk(texts):
+    """Raw term counts for a list of product texts (runs in a worker process)."""
+    return _vectoriser().transform(texts).tocsr()
+
+
+def product_text(chunk):
+    text = pd.Series('', index=chunk.index)
+    for col in TEXT_FIELDS:
+        if col in chunk.columns:
+            text = text + ' ' + chunk[col].fillna('').astype(str)
+    return text
+
+
+def read_catalog(path, chunksize=CHUNK_SIZE):
+    """
+    Stream the product CSV; returns the catalogue and a uint64 content hash
+    of each row's text.
+    """
+    chunks, hashes = [], []
+    for chunk in pd.read_csv(path, chunksize=chunksize, dtype=str, keep_default_na=False):
+        if 'category' not in chunk.columns and 'sub_category' in chunk.columns:
+            chunk = chunk.rename(columns={'sub_category': 'category'})
+        chunks.append(chunk)
+        hashes.append(pd.util.hash_pandas_object(product_text(chunk), index=False).to_numpy())
+    catalog = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=TEXT_FIELDS)
+    return catalog, (np.concatenate(hashes) if hashes else np.empty(0, dtype=np.uint64))
+
+
+def vectorise_rows(catalog, rows, workers, chunksize=CHUNK_SIZE):
+    """Term counts for the given catalogue rows, tokenised in parallel chunks."""
+    texts = product_text(catalog.iloc[rows]).tolist()
+    batches = [texts[i:i + chunksize] for i in range(0, len(texts), chunksize)]
+    if not batches:
+        return csr_matrix((0, N_FEATURES), dtype=np.float64)
+    if workers > 1 and len(batches) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_vectorise_chunk, batches))
+    else:
+        parts = [_vectorise_chunk(b) for b in batches]
+    return vstack(parts).tocsr()
+
+
+def replace_rows(base, rows, values, n_rows):
+    """`base` resized to n_rows with `rows` replaced by the rows of `values`."""
+    base = base.tocsr()
+    if base.shape[0] < n_rows:
+        base = vstack([base, csr_matrix((n_rows - base.shape[0], base.shape[1]))]).tocsr()
+    base = base[:n_rows]
+    keep = np.ones(n_rows)
+    keep[rows] = 0.0
+    scatter = csr_matrix((np.ones(len(rows)), (rows, np.arange(len(rows)))), shape=(n_rows, len(rows)))
+    return (diags(keep) @ base + scatter @ values).tocsr()
+
+
+def fit_idf(counts):
+    """Smoothed IDF, as sklearn's TfidfTransformer computes it."""
+    n_docs = counts.shape[0]
+    doc_freq = np.bincount(counts.indices, minlength=counts.shape[1])
+    return np.log((1.0 + n_docs) / (1.0 + doc_freq)) + 1.0
+
+
+def apply_idf(counts, idf):
+    return normalize(counts @ diags(idf), norm='l2', copy=False).tocsr()
+
+
+# --- INTERACTIONS ---
+def read_interactions(path, skip_rows=0, chunksize=CHUNK_SIZE):
+    """Stream the interaction CSV, skipping rows already absorbed by a previous build."""
+    chunks = []
+    reader = pd.read_csv(path, chunksize=chunksize, usecols=['user_id', 'product_index', 'rating'],
+                         skiprows=range(1, skip_rows + 1))
+    for chunk in reader:
+        chunks.append(chunk.astype({'user_id': np.int64, 'product_index': np.int32,
+                                    'rating': np.float32}))
+    if not chunks:
+        return pd.DataFrame({'user_id': np.empty(0, np.int64), 'product_index': np.empty(0, np.int32),
+                             'rating': np.empty(0, np.float32)})
+    return pd.concat(chunks, ignore_index=True)
+
+
+def user_item_from(interactions, shape):
+    """User x product matrix holding each user's strongest rating per product."""
+    frame = interactions.groupby(['user_id', 'product_index'], sort=False)['rating'].max().reset_index()
+    return csr_matrix((frame['rating'].to_numpy(dtype=np.float64),
+                       (frame['user_id'].to_numpy(), frame['product_index'].to_numpy())), shape=shape)
+
+
+def resized(matrix, shape):
+    """Copy of a CSR matrix padded/truncated to `shape`."""
+    matrix = csr_matrix(matrix, copy=True)
+    matrix.resize(shape)
+    return matrix
+
+
+# --- PIPELINE ---
+def build(products, interactions, root=ARTIFACT_DIR, incremental=False, workers=1,
+          k=DEFAULT_K, chunksize=CHUNK_SIZE, keep=2, embedding_dim=0):
+    started = time.time()
+    prev = None
+    if incremental:
+        prev_dir = current_build(root)
+        if prev_dir is not None:
+            prev = open_build(prev_dir)
+            if 'term_counts' not in prev:
+                log(f"{prev_dir} has no pipeline state, doing a full build")
+                prev = None
+            else:
+                log(f"Incremental build on top of {prev_dir}")
+
+    # 1. Catalogue + TF-IDF
+    catalog, hashes = read_catalog(products, chunksize)
+    n_items = len(catalog)
+    if prev is not None:
+        prev_hashes = np.asarray(prev['product_hashes'])
+        overlap = min(len(prev_hashes), n_items)
+        changed = np.flatnonzero(prev_hashes[:overlap] != hashes[:overlap])
+        changed = np.concatenate([changed, np.arange(overlap, n_items)])
+        log(f"{n_items} products, {len(changed)} new or changed")
+        counts = replace_rows(prev['term_counts'], changed,
+                              vectorise_rows(catalog, changed, workers, chunksize), n_items)
+        idf = np.asarray(prev['tfidf_idf'])
+    else:
+        changed = None
+        log(f"{n_items} products, vectorising with {workers} worker(s)")
+        counts = vectorise_rows(catalog, np.arange(n_items), workers, chunksize)
+        idf = fit_idf(counts)
+    tfidf_matrix = apply_idf(counts, idf)
+
+    # 2. Interactions + user-item matrix
+    skip = prev.manifest['build_state'].get('interaction_rows', 0) if prev is not None else 0
+    new_inter = read_interactions(interactions, skip_rows=skip, chunksize=chunksize)
+    # CSV rows read, dropped ones included, so the next run starts after them
+    rows_read = skip + len(new_inter)
+    unknown = new_inter['product_index'] >= n_items
+    if unknown.any():
+        log(f"Dropping {int(unknown.sum())} interactions with unknown product_index")
+        new_inter = new_inter[~unknown].reset_index(drop=True)
+    if prev is not None:
+        old_inter = prev['interactions']
+        inter = pd.concat([pd.DataFrame({c: np.asarray(old_inter[c]) for c in old_inter.columns}),
+                           new_inter], ignore_index=True)
+    else:
+        inter = new_inter
+    n_users = int(inter['user_id'].max()) + 1 if len(inter) else 1
+    shape = (n_users, n_items)
+    if prev is not None:
+        # Only rows of users with new interactions can change
+        old_uim = resized(prev['user_item_matrix'], shape)
+        user_item_matrix = old_uim.maximum(user_item_from(new_inter, shape)).tocsr()
+        log(f"{len(new_inter)} new interactions touching {new_inter['user_id'].nunique()} users")
+    else:
+        user_item_matrix = user_item_from(inter, shape)
+        log(f"{len(inter)} interactions from {inter['user_id'].nunique()} users")
+
+    knn_model = NearestNeighbors(**KNN_PARAMS).fit(user_item_matrix)
+
+    # 3. Top-K similar items
+    shrunk = prev is not None and len(prev['product_hashes']) > n_items
+    if prev is not None and 'similarity_topk' in prev and not shrunk:
+        topk = prev['similarity_topk']
+        index = SimilarityIndex(tfidf_matrix, np.array(topk['indices']), np.array(topk['scores']),
+                                topk['fingerprint'])
+        index.refresh(changed)
+    else:
+        index = SimilarityIndex.build(tfidf_matrix, k=k)
+    log(f"Top-{index.k} similarity index ready")
+
+    # 4. Dense embeddings (optional; refit in full, SVD over the sparse matrix is cheap)
+    embeddings = None
+    if embedding_dim:
+        embeddings = fit_embeddings(tfidf_matrix, embedding_dim)
+        log(f"{embeddings[0].shape[1]}-d embeddings, explained variance {embeddings[1]:.3f}")
+
+    data = {
+        'dataframe': catalog,
+        'tfidf_matrix': tfidf_matrix,
+        'knn_model': knn_model,
+        'user_item_matrix': user_item_matrix,
+        'interactions': inter,
+    }
+    build_dir = write_build(
+        data, root, similarity_index=index, embeddings=embeddings,
+        extras={'term_counts': counts, 'tfidf_idf': idf, 'product_hashes': hashes},
+        build_state={'interaction_rows': rows_read, 'incremental': prev is not None},
+    )
+    prune_builds(root, keep=keep)
+    log(f"Published {build_dir} in {time.time() - started:.1f}s")
+    return build_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and publish ShopSense artifacts.")
+    parser.add_argument('--products', required=True, help="Product catalogue CSV")
+    parser.add_argument('--interactions', required=True,
+                        help="Interaction CSV (user_id, product_index, rating), append-only")
+    parser.add_argument('--root', default=ARTIFACT_DIR)
+    parser.add_argument('--incremental', action='store_true',
+                        help="Reuse the active build; only process new/changed rows")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--k', type=int, default=DEFAULT_K, help="Similar items kept per product")
+    parser.add_argument('--keep', type=int, default=2, help="Builds to keep after publishing")
+    parser.add_argument('--embedding-dim', type=int, default=0,
+                        help="Also store dense SVD embeddings of this size (0 = none)")
+    args = parser.parse_args()
+
+    build(args.products, args.interactions, root=args.root, incremental=args.incremental,
+          workers=args.workers, k=args.k, chunksize=args.chunksize, keep=args.keep,
+          embedding_dim=args.embedding_dim)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Compact Catalog
+
+Dtype plan for the product dataframe, applied once when a build is
+written so every server process maps the same compact columns:
+
+- category / main_category: pandas categoricals (Arrow dictionary columns)
+- ratings, discount_price, actual_price: float32, no_of_ratings: int32,
+  coerced (invalid -> 0) at build time instead of at every app start
+- name, image, link and other text: Arrow-backed strings, read straight
+  out of the memory-mapped Feather file without building Python objects
+
+Per-column memory before/after for the active build (or a legacy pickle):
+
+    python catalog.py --report
+"""
+import argparse
+import numpy as np
+import pandas as pd
+
+CATEGORY_COLUMNS = ['category', 'main_category', 'sub_category']
+FLOAT_COLUMNS = ['ratings', 'discount_price', 'actual_price']
+INT_COLUMNS = ['no_of_ratings']
+
+
+def string_dtype():
+    return pd.StringDtype('pyarrow')
+
+
+def is_compact(df):
+    return all(isinstance(df[c].dtype, pd.CategoricalDtype) for c in CATEGORY_COLUMNS if c in df.columns) \
+        and all(df[c].dtype == np.float32 for c in FLOAT_COLUMNS if c in df.columns)
+
+
+def compact_catalog(df):
+    """Copy of `df` with the compact dtypes above."""
+    out = {}
+    for col in df.columns:
+        values = df[col]
+        if col in CATEGORY_COLUMNS:
+            out[col] = values.astype('category')
+        elif col in FLOAT_COLUMNS:
+            out[col] = pd.to_numeric(values, errors='coerce').fillna(0).astype(np.float32)
+        elif col in INT_COLUMNS:
+            numbers = pd.to_numeric(values, errors='coerce').fillna(0)
+            out[col] = numbers.clip(0, np.iinfo(np.int32).max).astype(np.int32)
+        elif values.dtype == object or pd.api.types.is_string_dtype(values.dtype):
+            out[col] = values.astype(string_dtype())
+        else:
+            out[col] = values
+    return pd.DataFrame(out, index=df.index)
+
+
+def expanded_catalog(df):
+    """The catalogue as the app used to hold it: object strings, float64 numbers."""
+    out = {}
+    for col in df.columns:
+        values = df[col]
+        if col in FLOAT_COLUMNS + INT_COLUMNS:
+            out[col] = pd.to_numeric(values, errors='coerce').fillna(0).astype(np.float64)
+        elif not pd.api.types.is_numeric_dtype(values.dtype):
+            out[col] = values.astype(object)
+        else:
+            out[col] = values
+    return pd.DataFrame(out, index=df.index)
+
+
+def arrow_types_mapper():
+    """pyarrow -> pandas mapping that keeps strings Arrow-backed (zero copy)."""
+    import pyarrow as pa
+    mapping = {pa.string(): string_dtype(), pa.large_string(): string_dtype()}
+    return mapping.get
+
+
+def memory_report(df):
+    """Bytes per column before (expanded) and after (compact), largest first."""
+    before = expanded_catalog(df).memory_usage(deep=True, index=False)
+    after = (df if is_compact(df) else compact_catalog(df)).memory_usage(deep=True, index=False)
+    report = pd.DataFrame({'before_bytes': before, 'after_bytes': after})
+    report['saved_pct'] = (100 * (1 - report['after_bytes'] / report['before_bytes'])).round(1)
+    report = report.sort_values('before_bytes', ascending=False)
+    report.loc['TOTAL'] = [report['before_bytes'].sum(), report['after_bytes'].sum(),
+                           round(100 * (1 - report['after_bytes'].sum() / report['before_bytes'].sum()), 1)]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact catalog tools.")
+    parser.add_argument('--report', action='store_true', help="Per-column memory before/after")
+    args = parser.parse_args()
+
+    if args.report:
+        from artifacts import open_artifacts
+        df = open_artifacts()['dataframe']
+        pd.set_option('display.width', 120)
+        print(f"{len(df)} products")
+        print(memory_report(df).to_string())
+
+
+if __name__ == '__main__':
+    main()
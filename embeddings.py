@@ -0,0 +1,124 @@
+"""
+Dense Product Embeddings
+
+Optional content-similarity mode: the TF-IDF rows are projected to a small
+dense space with TruncatedSVD at build time and L2-normalised, so cosine
+similarity is a plain dot product. The vectors are stored as one
+contiguous float32 (n_products, dim) array that every process memory-maps,
+and neighbours are scored with dense float32 matrix products (BLAS) over
+blocks of query rows instead of sparse products over the full vocabulary.
+
+`EmbeddingIndex` answers `neighbours` / `batch_neighbours` like
+SimilarityIndex, so the recommender can use either. Select it with
+SHOPSENSE_CONTENT=embedding (see engine.py) and build the vectors with
+`build_artifacts.py --embedding-dim 128`.
+
+Neighbour agreement with the exact TF-IDF scores, and query latency:
+
+    python embeddings.py --report --sample 500 --k 10
+"""
+import time
+import argparse
+import numpy as np
+from sklearn.decomposition import TruncatedSVD
+
+from similarity_index import _block_rows, _top_k_rows, batch_exact_neighbours
+
+DEFAULT_DIM = 128
+SVD_ITERATIONS = 5
+
+
+def fit_embeddings(tfidf_matrix, dim=DEFAULT_DIM, random_state=0):
+    """
+    (vectors, explained_variance): unit-length float32 rows, C-contiguous,
+    ready for np.save / mmap.
+    """
+    n_items, n_features = tfidf_matrix.shape
+    dim = max(1, min(dim, n_items - 1, n_features - 1))
+    svd = TruncatedSVD(n_components=dim, n_iter=SVD_ITERATIONS, random_state=random_state)
+    vectors = svd.fit_transform(tfidf_matrix).astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return np.ascontiguousarray(vectors), float(svd.explained_variance_ratio_.sum())
+
+
+class EmbeddingIndex:
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    def neighbours(self, idx, n):
+        return self.batch_neighbours([idx], n)[0].tolist()
+
+    def batch_neighbours(self, rows, n):
+        """The n most similar products for each of `rows`, an (len(rows), n) int32 array."""
+        rows = np.asarray(rows, dtype=np.int64)
+        n_items = self.vectors.shape[0]
+        out = np.empty((len(rows), max(min(n, n_items - 1), 0)), dtype=np.int32)
+        step = _block_rows(n_items)
+        for start in range(0, len(rows), step):
+            block = rows[start:start + step]
+            sims = self.vectors[block] @ self.vectors.T
+            out[start:start + step], _ = _top_k_rows(sims, block, n)
+        return out
+
+
+# --- QUALITY ---
+def quality_report(tfidf_matrix, vectors, sample=500, k=10, seed=0):
+    """
+    Recall@k of the embedding neighbours against the exact TF-IDF ones over
+    a random sample of products, plus per-product latency of both.
+    """
+    n_items = tfidf_matrix.shape[0]
+    rows = np.random.default_rng(seed).choice(n_items, size=min(sample, n_items), replace=False)
+
+    started = time.perf_counter()
+    exact = batch_exact_neighbours(tfidf_matrix, rows, k)
+    exact_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    approx = EmbeddingIndex(vectors).batch_neighbours(rows, k)
+    approx_s = time.perf_counter() - started
+
+    hits = np.array([len(np.intersect1d(a, b)) for a, b in zip(exact, approx)])
+    return {
+        'products': int(len(rows)),
+        'k': int(exact.shape[1]),
+        'dim': int(vectors.shape[1]),
+        'recall_at_k': float(hits.sum() / max(exact.size, 1)),
+        'top1_agreement': float(np.mean(exact[:, 0] == approx[:, 0])) if exact.size else 0.0,
+        'exact_ms_per_product': 1000 * exact_s / len(rows),
+        'embedding_ms_per_product': 1000 * approx_s / len(rows),
+        'tfidf_bytes': int(tfidf_matrix.data.nbytes + tfidf_matrix.indices.nbytes + tfidf_matrix.indptr.nbytes),
+        'embedding_bytes': int(vectors.nbytes),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dense product embedding tools.")
+    parser.add_argument('--report', action='store_true',
+                        help="Compare embedding neighbours with exact TF-IDF neighbours")
+    parser.add_argument('--sample', type=int, default=500)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--dim', type=int, default=DEFAULT_DIM,
+                        help="Dimensions to fit when the build has no embeddings")
+    args = parser.parse_args()
+
+    if args.report:
+        from artifacts import open_artifacts
+        data = open_artifacts()
+        if 'embeddings' in data:
+            vectors = data['embeddings']
+        else:
+            print(f"Build has no embeddings; fitting {args.dim} dimensions")
+            vectors, explained = fit_embeddings(data['tfidf_matrix'], args.dim)
+            print(f"explained variance: {explained:.3f}")
+        for key, value in quality_report(data['tfidf_matrix'], vectors, args.sample, args.k).items():
+            print(f"{key:<26} {value:.4f}" if isinstance(value, float) else f"{key:<26} {value}")
+
+
+if __name__ == '__main__':
+    main()
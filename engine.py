@@ -0,0 +1,218 @@
+"""
+ShopSense Engine
+
+The Streamlit-free core: one object owning the model data, the derived
+indexes and the user store, used by the Streamlit app, the HTTP server
+(server.py) and batch jobs alike.
+
+    from engine import Engine
+    engine = Engine.open()
+    engine.item_recs(12, n=6)
+    engine.user_recs(user_id=42, history=[12, 40], n=10)
+    engine.search("wireless head", category="Headphones")
+    engine.trending(n=10, category="Headphones")
+    engine.filtered_search("wireless head", {'price': "RM50-100", 'rating': 4.0})
+    engine.place_order('c0ffee', user_id=42, product_indices=[12, 40])  # ID per checkout
+
+Configuration comes from the SHOPSENSE_* environment variables below, so
+every front-end pointed at the same directory behaves the same way.
+"""
+import os
+import threading
+import pandas as pd
+
+from artifacts import ARTIFACT_DIR, DATA_FILE
+from user_store import open_user_store, USERS_DB, USERS_FILE
+from prefetch import Prefetcher, DEFAULT_WORKERS
+from orders import OrderQueue, ORDERS_DB
+from interaction_store import LOG_DIR
+from image_cache import ImageCache, IMAGE_DIR
+from popularity import PURCHASE_RATING
+from session_profile import history_signature
+import recommender
+
+# 'sqlite' (default) or 'json'; write-behind batches user-row updates in the background
+USER_STORE_BACKEND = os.environ.get('SHOPSENSE_USER_STORE', 'sqlite')
+USER_STORE_WRITE_BEHIND = os.environ.get('SHOPSENSE_USER_WRITE_BEHIND') == '1'
+# User-user neighbour engine: 'exact' (knn_model), 'lsh' or 'auto' (LSH for large user bases)
+NEIGHBOUR_BACKEND = os.environ.get('SHOPSENSE_NEIGHBOURS', 'auto')
+# Recommendation cache shared by all sessions: 'local', 'shared' (cross-process) or 'off'
+REC_CACHE_MODE = os.environ.get('SHOPSENSE_REC_CACHE', 'local')
+# Seconds between background rebuilds of the user-item matrix / neighbour index (0 = never)
+USER_REINDEX_INTERVAL = float(os.environ.get('SHOPSENSE_USER_REINDEX', recommender.REINDEX_INTERVAL))
+# Content similarity: 'tfidf' (top-K table) or 'embedding' (dense SVD vectors)
+CONTENT_MODE = os.environ.get('SHOPSENSE_CONTENT', 'tfidf')
+# Threads computing recs speculatively after a product view (0 = off)
+PREFETCH_WORKERS = int(os.environ.get('SHOPSENSE_PREFETCH_WORKERS', DEFAULT_WORKERS))
+# Ledger of placed orders, processed by a background worker ('' = process inline, no ledger)
+ORDERS_PATH = os.environ.get('SHOPSENSE_ORDERS_DB', ORDERS_DB)
+# Directory of the append-only interaction log (segments and compactions)
+LOG_PATH = os.environ.get('SHOPSENSE_LOG_DIR', LOG_DIR)
+# Threads running the hybrid candidate generators (0 = inline), and their deadline in seconds
+PIPELINE_WORKERS = int(os.environ.get('SHOPSENSE_PIPELINE_WORKERS', recommender.PIPELINE_WORKERS))
+RECS_DEADLINE = float(os.environ.get('SHOPSENSE_RECS_DEADLINE', recommender.PIPELINE_DEADLINE))
+# Image server of the thumbnail cache (image_cache.py --serve); unset = remote image URLs
+IMAGE_URL = os.environ.get('SHOPSENSE_IMAGE_URL')
+IMAGE_ROOT = os.environ.get('SHOPSENSE_IMAGE_DIR', IMAGE_DIR)
+
+NUMERIC_COLUMNS = ['ratings', 'no_of_ratings', 'discount_price', 'actual_price']
+PRODUCT_FIELDS = ['name', 'category', 'main_category', 'image', 'discount_price', 'actual_price', 'ratings']
+
+
+class Engine:
+    def __init__(self, data, users=None, prefetch_workers=PREFETCH_WORKERS, orders_db=ORDERS_PATH,
+                 image_url=IMAGE_URL, image_root=IMAGE_ROOT):
+        self.data = data
+        self.users = users
+        self.images = ImageCache(image_root, image_url)
+        self.prefetcher = Prefetcher(prefetch_workers) if prefetch_workers else None
+        self.orders = OrderQueue(self._process_order, orders_db).start() if orders_db else None
+        self._df = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, root=ARTIFACT_DIR, legacy_pickle=DATA_FILE, neighbour_backend=NEIGHBOUR_BACKEND,
+             rec_cache_mode=REC_CACHE_MODE, content_mode=CONTENT_MODE,
+             user_reindex_interval=USER_REINDEX_INTERVAL,
+             user_store_backend=USER_STORE_BACKEND, write_behind=USER_STORE_WRITE_BEHIND,
+             users_db=USERS_DB, users_json=USERS_FILE, prefetch_workers=PREFETCH_WORKERS,
+             pipeline_workers=PIPELINE_WORKERS, recs_deadline=RECS_DEADLINE, orders_db=ORDERS_PATH,
+             image_url=IMAGE_URL, image_root=IMAGE_ROOT, log_dir=LOG_PATH):
+        """Raises FileNotFoundError when there is no build and no legacy pickle."""
+        data = recommender.open_data(root, legacy_pickle, neighbour_backend=neighbour_backend,
+                                     rec_cache_mode=rec_cache_mode, content_mode=content_mode,
+                                     log_dir=log_dir, user_reindex_interval=user_reindex_interval,
+                                     pipeline_workers=pipeline_workers, recs_deadline=recs_deadline)
+        # Legacy accounts whose random ID falls inside the built matrix are re-numbered
+        users = open_user_store(user_store_backend, write_behind=write_behind,
+                                db_path=users_db, json_path=users_json,
+                                min_id=data['user_item_matrix'].shape[0])
+        return cls(data, users, prefetch_workers, orders_db, image_url, image_root)
+
+    @property
+    def df(self):
+        """The catalogue, numeric columns coerced once per process."""
+        if self._df is None:
+            with self._lock:
+                if self._df is None:
+                    df = self.data['dataframe']
+                    # Compact builds are coerced at build time already
+                    for col in NUMERIC_COLUMNS:
+                        if col in df.columns and not pd.api.types.is_numeric_dtype(df[col]):
+                            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+                    self._df = df
+        return self._df
+
+    # --- QUERIES (row positions) ---
+    def item_recs(self, idx, n=6):
+        return self._take(('item', int(idx), n), recommender.cached_content_recs, self.data, idx, n)
+
+    def item_recs_batch(self, indices, n=6):
+        return recommender.cached_batch_content_recs(self.data, indices, n)
+
+    def user_recs(self, user_id, history=None, n=12):
+        return self._take(self._user_key(user_id, history, n), recommender.cached_hybrid_recs,
+                          self.data, user_id, history, n)
+
+    def user_recs_batch(self, user_ids, histories=None, n=12):
+        return recommender.cached_batch_hybrid_recs(self.data, user_ids, histories, n)
+
+    def search(self, query, category=None, limit=None):
+        return self.data['search_index'].search(query, category=category, limit=limit)
+
+    def filtered_search(self, query, selection):
+        """(ranked rows matching `query` and every facet in `selection`, option counts)."""
+        base = self.data['search_index'].search(query) if query and query.strip() else None
+        return self.data['facet_index'].select(selection, base)
+
+    def trending(self, n=10, category=None):
+        return self.data['popularity'].top(n, category)
+
+    def sold(self, idx):
+        return self.data['popularity'].sold_count(idx)
+
+    def account(self, username):
+        """(user_id, history) of an account, or None."""
+        record = self.users.get(username) if self.users is not None else None
+        if record is None:
+            return None
+        return record['id'], record.get('history', [])
+
+    # --- PREFETCH ---
+    def prefetch_view(self, user_id, history, item_n=6, user_n=12):
+        """
+        After a view of `history[-1]`: start computing that product's similar
+        items and the user's updated recs, for the next item_recs/user_recs.
+        """
+        if self.prefetcher is None or not history:
+            return
+        idx = history[-1]
+        self.prefetcher.submit(('item', int(idx), item_n), recommender.cached_content_recs,
+                               self.data, idx, item_n)
+        self.prefetcher.submit(self._user_key(user_id, history, user_n), recommender.cached_hybrid_recs,
+                               self.data, user_id, list(history), user_n)
+
+    @staticmethod
+    def _user_key(user_id, history, n):
+        return ('user', user_id, history_signature(history), n)
+
+    def _take(self, key, fn, *args):
+        if self.prefetcher is None:
+            return fn(*args)
+        return self.prefetcher.take(key, fn, *args)
+
+    # --- WRITES ---
+    def register(self, username):
+        """New account with a sequential ID that has no matrix row yet; None if taken."""
+        return self.users.register(username, min_id=recommender.next_user_id(self.data))
+
+    def record(self, user_id, product_indices, rating):
+        recommender.record_interactions(self.data, user_id, product_indices, rating)
+        if self.prefetcher is not None:
+            # Speculative recs of this user were built from the state before
+            self.prefetcher.discard(lambda key: key[0] == 'user' and key[1] == user_id)
+
+    def place_order(self, order_id, user_id, product_indices):
+        """
+        Accept an order and return at once; its purchase interactions are
+        recorded by the order worker. False if `order_id` was placed before.
+        """
+        if self.orders is None:
+            self._process_order(user_id, product_indices)
+            return True
+        return self.orders.place(order_id, user_id, product_indices)
+
+    def _process_order(self, user_id, product_indices):
+        # Guests' orders are confirmed but leave no interactions
+        if user_id is not None and len(product_indices):
+            self.record(user_id, product_indices, PURCHASE_RATING)
+
+    # --- OUTPUT ---
+    def products(self, rows, fields=PRODUCT_FIELDS):
+        """JSON-ready product dicts for catalogue row positions."""
+        df = self.df
+        cols = [c for c in fields if c in df.columns]
+        frame = df.iloc[list(rows)][cols]
+        for col in frame.columns:
+            if frame[col].dtype == 'float32':
+                # float32 21.99 would serialise as 21.989999771118164
+                frame[col] = frame[col].astype(str).astype('float64')
+        records = frame.to_dict('records')
+        for row, record in zip(rows, records):
+            record['index'] = int(row)
+            if 'image' in record:
+                record['thumbnail'] = self.images.link(record['image'])
+        return records
+
+    def close(self):
+        if self.orders is not None:
+            self.orders.close()
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        if self.data.is_loaded('rec_pipeline'):
+            self.data['rec_pipeline'].close()
+        if self.data.is_loaded('user_matrix'):
+            self.data['user_matrix'].close()
+        if self.users is not None:
+            self.users.close()
+        self.images.close()
@@ -0,0 +1,157 @@
+"""
+Facet Index
+
+Precomputed filter structures for the home-page sidebar, built once at load
+time:
+
+- main_category / category: value -> sorted row positions, plus a code per
+  row for counting
+- price: fixed RM ranges over `discount_price` (one bucket code per row)
+- rating: "N stars & up" thresholds over `ratings` (sorted rows per threshold)
+
+`select()` narrows a result list (search ranking order is kept) to every
+active filter with sorted-array membership tests instead of dataframe
+masks, and returns per-option counts where each facet is counted under the
+*other* active filters, so the sidebar can show how many results picking
+that option would give.
+
+Option counts for the active build:
+
+    python facet_index.py
+    python facet_index.py --main-category "tv, audio & cameras" --price "RM100-250"
+"""
+import argparse
+import numpy as np
+import pandas as pd
+
+CATEGORY_FACETS = ['main_category', 'category']
+PRICE_EDGES = [25, 50, 100, 250, 500, 1000]  # RM
+RATING_THRESHOLDS = [4.5, 4.0, 3.5, 3.0]
+
+
+def price_labels(edges=PRICE_EDGES):
+    labels = [f"Under RM{edges[0]}"]
+    labels += [f"RM{lo}-{hi}" for lo, hi in zip(edges[:-1], edges[1:])]
+    labels.append(f"RM{edges[-1]}+")
+    return labels
+
+
+PRICE_LABELS = price_labels()
+
+
+def rating_label(threshold):
+    return f"{threshold:g}★ & up"
+
+
+def _member(rows, sorted_rows):
+    """Boolean mask: which of `rows` appear in the sorted array `sorted_rows`."""
+    if len(sorted_rows) == 0:
+        return np.zeros(len(rows), dtype=bool)
+    pos = np.searchsorted(sorted_rows, rows)
+    pos[pos == len(sorted_rows)] = 0
+    return sorted_rows[pos] == rows
+
+
+class FacetIndex:
+    def __init__(self, df):
+        self.n_rows = len(df)
+        self.values = {}  # facet -> sorted option values
+        self.codes = {}   # facet -> code per row (-1 = missing)
+        self.rows = {}    # facet -> {value: sorted row positions}
+        for facet in CATEGORY_FACETS:
+            if facet not in df.columns:
+                continue
+            codes, values = pd.factorize(df[facet], sort=True)
+            self._add(facet, codes, [str(v) for v in values])
+
+        if 'discount_price' in df.columns:
+            price = pd.to_numeric(df['discount_price'], errors='coerce').fillna(0).to_numpy()
+            self._add('price', np.searchsorted(PRICE_EDGES, price, side='right'), PRICE_LABELS)
+
+        self.ratings = None
+        if 'ratings' in df.columns:
+            self.ratings = pd.to_numeric(df['ratings'], errors='coerce').fillna(0).to_numpy(dtype=np.float32)
+            self.values['rating'] = list(RATING_THRESHOLDS)
+            self.rows['rating'] = {t: np.flatnonzero(self.ratings >= t).astype(np.int32)
+                                   for t in RATING_THRESHOLDS}
+        # Unfiltered counts, served as-is when nothing narrows the rows
+        self.totals = {facet: self.counts(facet) for facet in self.facets}
+
+    def _add(self, facet, codes, values):
+        codes = np.asarray(codes, dtype=np.int32)
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(values) + 1))
+        self.values[facet] = values
+        self.codes[facet] = codes
+        self.rows[facet] = {v: np.sort(order[bounds[i]:bounds[i + 1]]).astype(np.int32)
+                            for i, v in enumerate(values)}
+
+    @property
+    def facets(self):
+        return list(self.values)
+
+    def rows_for(self, facet, value):
+        return self.rows.get(facet, {}).get(value, np.empty(0, dtype=np.int32))
+
+    def counts(self, facet, rows=None):
+        """{option: number of `rows` (default: all rows) having it}."""
+        if facet == 'rating':
+            ratings = self.ratings if rows is None else self.ratings[rows]
+            return {t: int((ratings >= t).sum()) for t in self.values['rating']}
+        codes = self.codes[facet] if rows is None else self.codes[facet][rows]
+        totals = np.bincount(codes[codes >= 0], minlength=len(self.values[facet]))
+        return dict(zip(self.values[facet], totals.tolist()))
+
+    def select(self, selection, base_rows=None):
+        """
+        selection: {facet: option or None}. Returns (rows, counts): `base_rows`
+        (default: every row in catalogue order) restricted to all selected
+        options, and {facet: {option: count}} with each facet counted under
+        the other selections only.
+        """
+        active = {f: self.rows_for(f, v) for f, v in selection.items() if v is not None and f in self.values}
+        base = np.arange(self.n_rows, dtype=np.int32) if base_rows is None else np.asarray(base_rows)
+
+        # One membership mask per active facet, over the base rows
+        masks = {f: _member(base, rows) for f, rows in active.items()}
+        all_mask = np.ones(len(base), dtype=bool)
+        for mask in masks.values():
+            all_mask &= mask
+
+        counts = {}
+        for facet in self.facets:
+            others = np.ones(len(base), dtype=bool)
+            for f, mask in masks.items():
+                if f != facet:
+                    others &= mask
+            if base_rows is None and others.all():
+                counts[facet] = self.totals[facet]
+            else:
+                counts[facet] = self.counts(facet, base[others])
+        return base[all_mask], counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Facet option counts for the active build.")
+    parser.add_argument('--main-category')
+    parser.add_argument('--category')
+    parser.add_argument('--price', choices=PRICE_LABELS)
+    parser.add_argument('--min-rating', type=float, choices=RATING_THRESHOLDS)
+    args = parser.parse_args()
+
+    from artifacts import open_artifacts
+    index = FacetIndex(open_artifacts()['dataframe'])
+    selection = {'main_category': args.main_category, 'category': args.category,
+                 'price': args.price, 'rating': args.min_rating}
+    rows, counts = index.select(selection)
+    print(f"{len(rows)} of {index.n_rows} products match")
+    for facet, options in counts.items():
+        print(f"\n{facet}:")
+        for value, n in options.items():
+            if n:
+                label = rating_label(value) if facet == 'rating' else value
+                print(f"  {label:<40} {n:>8}")
+
+
+if __name__ == '__main__':
+    main()
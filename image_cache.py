@@ -0,0 +1,275 @@
+"""
+Product Image Cache
+
+Product cards used to hot-link every product's remote image, so a grid of
+40 cards meant 40+ fetches from third-party hosts on every page view. This
+module keeps the images local:
+
+- build: each distinct catalogue image is downloaded once and shrunk to a
+  card thumbnail and a product-page size (SIZES, longest side in px). The
+  JPEG bytes are stored content-addressed (objects/ab/<sha256>.jpg), so an
+  image shared by several products is stored once and a file never changes
+  after it is written. index.db maps (source URL, size) to the digest, and
+  re-running the build skips everything already cached.
+- serve: a small HTTP server for the objects and the bundled placeholder.
+  Objects never change, so they go out with a one-year `immutable`
+  Cache-Control and their digest as ETag; a browser fetches each thumbnail
+  once.
+- ImageCache.link(): the URL a page should use. That is the local
+  thumbnail when a server is configured (SHOPSENSE_IMAGE_URL, see
+  engine.py) and the image is cached, else the original URL. Broken images
+  fall back to the bundled placeholder (static/placeholder.svg), inlined
+  as a data URI when there is no server.
+
+    python image_cache.py --build --workers 16
+    python image_cache.py --serve --port 8766
+    SHOPSENSE_IMAGE_URL=http://127.0.0.1:8766 streamlit run app.py
+"""
+import io
+import os
+import re
+import base64
+import sqlite3
+import hashlib
+import argparse
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGE_DIR = os.path.join(BASE_DIR, 'image_cache')
+PLACEHOLDER_FILE = os.path.join(BASE_DIR, 'static', 'placeholder.svg')
+
+SIZES = {'thumb': 200, 'large': 480}  # longest side, px
+JPEG_QUALITY = 80
+BUILD_WORKERS = 16
+FETCH_TIMEOUT = 10               # seconds per download
+MAX_SOURCE_BYTES = 10 * 2 ** 20  # larger downloads are skipped
+CACHE_MAX_AGE = 365 * 24 * 3600  # objects are immutable
+USER_AGENT = 'ShopSense-ImageCache/1.0'
+
+OBJECT_PATH = re.compile(r'^/img/([0-9a-f]{64})\.jpg$')
+PLACEHOLDER_PATH = '/img/placeholder.svg'
+
+_placeholder_uri = None
+
+
+def placeholder_uri():
+    """The bundled placeholder as a data URI, for pages without an image server."""
+    global _placeholder_uri
+    if _placeholder_uri is None:
+        with open(PLACEHOLDER_FILE, 'rb') as f:
+            _placeholder_uri = 'data:image/svg+xml;base64,' + base64.b64encode(f.read()).decode('ascii')
+    return _placeholder_uri
+
+
+# --- THUMBNAILS ---
+def fetch(url, timeout=FETCH_TIMEOUT):
+    """Bytes of a remote image; ValueError for non-HTTP URLs or oversized files."""
+    if not re.match(r'^https?://', url or ''):
+        raise ValueError(f"not an http(s) URL: {url!r}")
+    request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        data = response.read(MAX_SOURCE_BYTES + 1)
+    if len(data) > MAX_SOURCE_BYTES:
+        raise ValueError(f"larger than {MAX_SOURCE_BYTES} bytes: {url}")
+    return data
+
+
+def make_thumbnails(data, sizes=SIZES, quality=JPEG_QUALITY):
+    """{size name: JPEG bytes}, each scaled down (never up) to fit its box."""
+    from PIL import Image, ImageOps
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    if image.mode in ('RGBA', 'LA', 'P'):
+        # Transparent product shots go on the white card background
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    image = image.convert('RGB')
+    out = {}
+    for name, px in sizes.items():
+        scaled = image.copy()
+        scaled.thumbnail((px, px), Image.LANCZOS)
+        buffer = io.BytesIO()
+        scaled.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+        out[name] = buffer.getvalue()
+    return out
+
+
+class ImageCache:
+    def __init__(self, root=IMAGE_DIR, base_url=None):
+        """base_url: where `serve` is reachable; links stay remote without it."""
+        self.root = root
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        # Opened on first use; pages without an image server never touch it
+        if self._conn is None:
+            os.makedirs(self.root, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.root, 'index.db'), timeout=30,
+                                   check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS thumbs ("
+                         " url TEXT NOT NULL, size TEXT NOT NULL, digest TEXT NOT NULL,"
+                         " PRIMARY KEY (url, size))")
+            self._conn = conn
+        return self._conn
+
+    # --- LOOKUP ---
+    def object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest + '.jpg')
+
+    def digest(self, url, size='thumb'):
+        with self._lock:
+            row = self._db().execute("SELECT digest FROM thumbs WHERE url = ? AND size = ?",
+                                     (url, size)).fetchone()
+        return row[0] if row else None
+
+    def link(self, url, size='thumb'):
+        """Local thumbnail URL if cached and served, else the original (or the placeholder)."""
+        if not url:
+            return self.placeholder
+        if self.base_url:
+            digest = self.digest(str(url), size)
+            if digest is not None:
+                return f"{self.base_url}/img/{digest}.jpg"
+        return url
+
+    @property
+    def placeholder(self):
+        return self.base_url + PLACEHOLDER_PATH if self.base_url else placeholder_uri()
+
+    # --- BUILD ---
+    def put(self, data):
+        """Store bytes under their SHA-256; the digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return digest
+
+    def add(self, url, thumbnails):
+        rows = [(url, size, self.put(data)) for size, data in thumbnails.items()]
+        with self._lock:
+            self._db().executemany("INSERT OR REPLACE INTO thumbs (url, size, digest) VALUES (?, ?, ?)", rows)
+
+    def cached_urls(self):
+        """Source URLs with every size cached."""
+        with self._lock:
+            rows = self._db().execute("SELECT url FROM thumbs GROUP BY url HAVING COUNT(*) >= ?",
+                                      (len(SIZES),)).fetchall()
+        return {url for (url,) in rows}
+
+    def build(self, urls, workers=BUILD_WORKERS, progress=None):
+        """
+        Download and thumbnail every URL not cached yet, `workers` at a time.
+        Returns (added, failed) counts; failures are retried on the next build.
+        """
+        todo = sorted(set(u for u in urls if u) - self.cached_urls())
+
+        def one(url):
+            try:
+                return url, make_thumbnails(fetch(url))
+            except Exception as e:
+                return url, e
+
+        added = failed = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for i, (url, result) in enumerate(pool.map(one, todo), 1):
+                if isinstance(result, Exception):
+                    failed += 1
+                else:
+                    self.add(url, result)
+                    added += 1
+                if progress and i % 1000 == 0:
+                    progress(i, len(todo))
+        return added, failed
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# --- SERVER ---
+def serve(cache, host='127.0.0.1', port=8766):
+    """
+    Serve /img/<digest>.jpg and /img/placeholder.svg with year-long,
+    immutable cache headers and ETags (304 on If-None-Match).
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split('?', 1)[0]
+            if path == PLACEHOLDER_PATH:
+                file_path, etag, content_type = PLACEHOLDER_FILE, '"placeholder"', 'image/svg+xml'
+            elif m := OBJECT_PATH.match(path):
+                file_path, etag, content_type = cache.object_path(m.group(1)), f'"{m.group(1)}"', 'image/jpeg'
+            else:
+                return self._reply(404, b'not found', 'text/plain')
+            if self.headers.get('If-None-Match') == etag:
+                return self._reply(304, b'', None, etag)
+            try:
+                with open(file_path, 'rb') as f:
+                    body = f.read()
+            except FileNotFoundError:
+                return self._reply(404, b'not found', 'text/plain')
+            self._reply(200, body, content_type, etag)
+
+        def _reply(self, status, body, content_type, etag=None):
+            self.send_response(status)
+            if etag:
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', f'public, max-age={CACHE_MAX_AGE}, immutable')
+            if content_type:
+                self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local product image thumbnails.")
+    parser.add_argument('--root', default=IMAGE_DIR)
+    parser.add_argument('--build', action='store_true', help="Fetch and thumbnail the catalogue's images")
+    parser.add_argument('--workers', type=int, default=BUILD_WORKERS)
+    parser.add_argument('--limit', type=int, help="Only the first N products (for a quick try)")
+    parser.add_argument('--serve', action='store_true', help="Serve the cached thumbnails over HTTP")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    args = parser.parse_args()
+
+    cache = ImageCache(args.root)
+    if args.build:
+        from artifacts import open_artifacts
+        images = open_artifacts()['dataframe']['image']
+        if args.limit:
+            images = images.iloc[:args.limit]
+        added, failed = cache.build(images.dropna().astype(str).tolist(), args.workers,
+                                    progress=lambda done, total: print(f"{done}/{total}", flush=True))
+        print(f"{added} image(s) added, {failed} failed, {len(cache.cached_urls())} cached in {args.root}")
+    if args.serve:
+        server = serve(cache, args.host, args.port)
+        print(f"Serving images on http://{args.host}:{args.port}/img/", flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+"""
+Append-Only Interaction Log
+
+In memory, interactions live in preallocated columnar NumPy buffers that grow
+by doubling, so recording an event is amortised O(1) instead of a full
+`pd.concat`. On disk, every event is appended as a fixed-width binary record
+to numbered segment files under `interaction_log/`, which are replayed on
+start-up on top of the interactions shipped in the data pack. `compact()`
+merges them into one `compacted-NNNNNN.bin` file covering every segment up
+to NNNNNN; its rename is the commit point, so a crash never double-counts.
+Processes sharing the directory (several app workers, or `--compact` run
+against a live app) serialise appends and compaction on an exclusive lock
+on `interaction_log/.lock`, and a writer rolls past any segment another
+process has compacted, so no append lands in a file about to be removed.
+
+    python interaction_store.py --compact
+"""
+import os
+import time
+import glob
+import argparse
+import threading
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; one process per log there
+    fcntl = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOG_DIR = os.path.join(BASE_DIR, 'interaction_log')
+
+RECORD_DTYPE = np.dtype([
+    ('user_id', '<i8'),
+    ('product_index', '<i4'),
+    ('rating', '<f4'),
+    ('ts', '<f8'),
+])
+SEGMENT_MAX_RECORDS = 1_000_000
+INITIAL_CAPACITY = 1024
+LOCK_FILE = '.lock'
+
+
+def _segment_path(log_dir, number):
+    return os.path.join(log_dir, f"seg-{number:06d}.bin")
+
+
+def _segment_number(path):
+    return int(os.path.basename(path).split('-')[1][:6])
+
+
+class InteractionLog:
+    """
+    Columnar interaction buffers backed by append-only segment files.
+    `frame()` exposes the same `user_id / product_index / rating` view the
+    recommender used to read from the pickled `interactions` dataframe.
+    """
+
+    def __init__(self, log_dir=LOG_DIR, durable=True):
+        self.log_dir = log_dir
+        self.durable = durable
+        self._lock = threading.Lock()
+        self._size = 0
+        self._cols = {name: np.empty(INITIAL_CAPACITY, dtype=RECORD_DTYPE[name])
+                      for name in RECORD_DTYPE.names}
+        self._frame = None
+        self._frame_size = -1
+        self._segment = None
+        self._segment_records = 0
+        self._lock_fd = None
+
+    # --- LOADING ---
+    @classmethod
+    def open(cls, log_dir=LOG_DIR, base=None, durable=True):
+        """
+        Load `base` (the pickled interactions dataframe) and replay every
+        on-disk segment written since on top of it.
+        """
+        log = cls(log_dir, durable)
+        if base is not None and len(base):
+            ts = base['ts'].to_numpy() if 'ts' in base.columns else np.zeros(len(base))
+            log._append_columns(base['user_id'].to_numpy(), base['product_index'].to_numpy(),
+                                base['rating'].to_numpy(), ts)
+
+        os.makedirs(log_dir, exist_ok=True)
+        with log._dir_lock():
+            log._remove_covered()
+            compacted = log._compacted()
+            segments = log._segments()
+            for path in ([compacted] if compacted else []) + segments:
+                records = log._read_segment(path)
+                log._append_columns(records['user_id'], records['product_index'],
+                                    records['rating'], records['ts'])
+        if segments:
+            log._segment = segments[-1]
+            log._segment_records = os.path.getsize(segments[-1]) // RECORD_DTYPE.itemsize
+        return log
+
+    @contextmanager
+    def _dir_lock(self):
+        """Exclusive lock on the log directory, held across processes."""
+        if fcntl is None:
+            yield
+            return
+        if self._lock_fd is None:
+            self._lock_fd = os.open(os.path.join(self.log_dir, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _compacted(self):
+        found = sorted(glob.glob(os.path.join(self.log_dir, 'compacted-*.bin')), key=_segment_number)
+        return found[-1] if found else None
+
+    def _segments(self):
+        """Live segments, i.e. those not already folded into the compacted file."""
+        compacted = self._compacted()
+        covered = _segment_number(compacted) if compacted else 0
+        found = glob.glob(os.path.join(self.log_dir, 'seg-*.bin'))
+        return sorted((p for p in found if _segment_number(p) > covered), key=_segment_number)
+
+    def _remove_covered(self):
+        """Finish an interrupted compaction: drop files the newest compacted file covers."""
+        compacted = self._compacted()
+        if compacted is None:
+            return
+        covered = _segment_number(compacted)
+        for path in glob.glob(os.path.join(self.log_dir, '*.bin')):
+            if path != compacted and _segment_number(path) <= covered:
+                os.remove(path)
+
+    @staticmethod
+    def _read_segment(path):
+        with open(path, 'rb') as f:
+            raw = f.read()
+        # Drop a torn trailing record left by a crash mid-write
+        usable = len(raw) - len(raw) % RECORD_DTYPE.itemsize
+        if usable != len(raw):
+            with open(path, 'r+b') as f:
+                f.truncate(usable)
+        return np.frombuffer(raw[:usable], dtype=RECORD_DTYPE)
+
+    # --- BUFFERS ---
+    def __len__(self):
+        return self._size
+
+    @property
+    def version(self):
+        """Monotonic version of the log; changes on every append."""
+        return self._size
+
+    def _reserve(self, extra):
+        needed = self._size + extra
+        capacity = len(self._cols['user_id'])
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name, col in self._cols.items():
+            grown = np.empty(capacity, dtype=col.dtype)
+            grown[:self._size] = col[:self._size]
+            self._cols[name] = grown
+
+    def _append_columns(self, user_ids, product_idxs, ratings, ts):
+        n = len(user_ids)
+        self._reserve(n)
+        end = self._size + n
+        self._cols['user_id'][self._size:end] = user_ids
+        self._cols['product_index'][self._size:end] = product_idxs
+        self._cols['rating'][self._size:end] = ratings
+        self._cols['ts'][self._size:end] = ts
+        self._size = end
+
+    # --- WRITES ---
+    def append(self, user_id, product_idx, rating):
+        self.extend([user_id], [product_idx], [rating])
+
+    def extend(self, user_ids, product_idxs, ratings):
+        """
+        Batched append: one buffer copy and one segment write for the batch.
+        """
+        n = len(product_idxs)
+        if n == 0:
+            return
+        records = np.empty(n, dtype=RECORD_DTYPE)
+        records['user_id'] = user_ids
+        records['product_index'] = product_idxs
+        records['rating'] = ratings
+        records['ts'] = time.time()
+
+        with self._lock:
+            self._write_records(records)
+            self._append_columns(records['user_id'], records['product_index'],
+                                 records['rating'], records['ts'])
+
+    def _write_records(self, records):
+        with self._dir_lock():
+            # Another process may have compacted since the last append; its
+            # compacted file covers (and removes) our segment, so roll past it
+            compacted = self._compacted()
+            covered = _segment_number(compacted) if compacted else 0
+            if (self._segment is None or self._segment_records >= SEGMENT_MAX_RECORDS
+                    or _segment_number(self._segment) <= covered):
+                segments = self._segments()
+                number = _segment_number(segments[-1]) + 1 if segments else covered + 1
+                self._segment = _segment_path(self.log_dir, number)
+                self._segment_records = 0
+            with open(self._segment, 'ab') as f:
+                f.write(records.tobytes())
+                f.flush()
+                if self.durable:
+                    os.fsync(f.fileno())
+        self._segment_records += len(records)
+
+    # --- READS ---
+    def columns(self):
+        """Read-only views of the live columns (no copy)."""
+        n = self._size
+        views = {}
+        for name, col in self._cols.items():
+            view = col[:n]
+            view.flags.writeable = False
+            views[name] = view
+        return views
+
+    def frame(self):
+        """
+        Dataframe view over the buffers, rebuilt only when the log changed.
+        """
+        if self._frame_size != self._size:
+            cols = self.columns()
+            self._frame = pd.DataFrame({
+                'user_id': cols['user_id'],
+                'product_index': cols['product_index'],
+                'rating': cols['rating'],
+                'ts': cols['ts'],
+            }, copy=False)
+            self._frame_size = self._size
+        return self._frame
+
+    # --- MAINTENANCE ---
+    def compact(self):
+        """
+        Merge the compacted file and every live segment into a new compacted
+        file, then start appending to a fresh segment.
+        """
+        with self._lock, self._dir_lock():
+            compacted = self._compacted()
+            segments = self._segments()
+            if not segments:
+                return
+            sources = ([compacted] if compacted else []) + segments
+            merged = np.concatenate([self._read_segment(p) for p in sources])
+            target = os.path.join(self.log_dir, f"compacted-{_segment_number(segments[-1]):06d}.bin")
+            tmp_path = target + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(merged.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, target)
+            self._remove_covered()
+            self._segment = None
+            self._segment_records = 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the on-disk interaction log.")
+    parser.add_argument('--log-dir', default=LOG_DIR)
+    parser.add_argument('--compact', action='store_true', help="Merge all segments into one")
+    args = parser.parse_args()
+
+    log = InteractionLog.open(args.log_dir)
+    before = len(log._segments())
+    if args.compact:
+        log.compact()
+    print(f"{len(log)} logged interactions, {before} live segment(s) -> {len(log._segments())}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""
+Latency Metrics
+
+Process-wide timing spans, counters and latency histograms.
+
+- `span(name)`: times a block into the histogram `name` (seconds) and, when
+  a trace is active on the current thread, appends it to that trace.
+- `count(name)`: monotonically increasing counters, used for the silent
+  fallbacks (swallowed exceptions) so they stop being invisible.
+- `trace()`: collects the spans of one request / Streamlit rerun, nested
+  spans indented by depth, for the sidebar debug panel. Work handed to a
+  pool thread joins the caller's trace via `current_trace()` on the caller
+  and `attach_trace(...)` on the worker.
+
+Histograms keep cumulative Prometheus buckets plus a window of recent
+samples for p50/p95/p99. `start_exporter()` writes the Prometheus text
+format to a file every few seconds and/or serves it over HTTP:
+
+    SHOPSENSE_METRICS_FILE=metrics.prom SHOPSENSE_METRICS_PORT=9108 streamlit run app.py
+    python metrics.py --file metrics.prom      # print percentiles from an exported file
+"""
+import os
+import re
+import time
+import argparse
+import threading
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+WINDOW = 2048  # recent samples kept per histogram for percentiles
+EXPORT_INTERVAL = 10  # seconds between metrics file writes
+PREFIX = 'shopsense'
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS, window=WINDOW):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.total = 0.0
+        self.n = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.total += value
+        self.n += 1
+        self.recent.append(value)
+
+    def percentiles(self, qs=(50, 95, 99)):
+        if not self.recent:
+            return {f"p{q}": 0.0 for q in qs}
+        values = np.percentile(np.fromiter(self.recent, dtype=np.float64), qs)
+        return {f"p{q}": float(v) for q, v in zip(qs, values)}
+
+
+class Trace:
+    def __init__(self):
+        self.spans = []  # (start, name, depth, seconds), in completion order
+        self.started = time.perf_counter()
+        self.elapsed = None
+
+    def breakdown(self):
+        """Spans in start order with their nesting depth, times in ms."""
+        return [{'stage': name, 'depth': depth, 'ms': secs * 1000}
+                for start, name, depth, secs in sorted(self.spans)]
+
+
+class Metrics:
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    # --- RECORDING ---
+    def observe(self, name, seconds):
+        with self._lock:
+            hist = self._histograms.get(name)
+            if hist is None:
+                hist = self._histograms[name] = Histogram()
+            hist.observe(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    @contextmanager
+    def span(self, name):
+        local = self._local
+        depth = getattr(local, 'depth', 0)
+        local.depth = depth + 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            local.depth = depth
+            self.observe(name, elapsed)
+            trace = getattr(local, 'trace', None)
+            if trace is not None:
+                trace.spans.append((start, name, depth, elapsed))
+
+    @contextmanager
+    def trace(self):
+        """Collect every span finished on this thread until the block exits."""
+        local = self._local
+        outer = getattr(local, 'trace', None)
+        local.trace = current = Trace()
+        try:
+            yield current
+        finally:
+            current.elapsed = time.perf_counter() - current.started
+            local.trace = outer
+
+    def current_trace(self):
+        """This thread's (trace, span depth), to hand to `attach_trace` on another thread."""
+        local = self._local
+        return getattr(local, 'trace', None), getattr(local, 'depth', 0)
+
+    @contextmanager
+    def attach_trace(self, context):
+        """Record this thread's spans into a `current_trace()` taken on another thread."""
+        local = self._local
+        saved = getattr(local, 'trace', None), getattr(local, 'depth', 0)
+        local.trace, local.depth = context
+        try:
+            yield
+        finally:
+            local.trace, local.depth = saved
+
+    # --- READING ---
+    def snapshot(self):
+        """{'counters': {...}, 'histograms': {name: {count, sum, p50, p95, p99}}}"""
+        with self._lock:
+            counters = dict(self._counters)
+            hists = {name: {'count': h.n, 'sum': h.total, **h.percentiles()}
+                     for name, h in self._histograms.items()}
+        return {'counters': counters, 'histograms': hists}
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            for name, value in sorted(self._counters.items()):
+                metric = f"{PREFIX}_{_metric_name(name)}_total"
+                lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+            for name, hist in sorted(self._histograms.items()):
+                metric = f"{PREFIX}_{_metric_name(name)}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, n in zip(hist.buckets + (float('inf'),), hist.counts):
+                    cumulative += n
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{metric}_bucket{{le="{le}"}} {cumulative}')
+                lines += [f"{metric}_sum {hist.total}", f"{metric}_count {hist.n}"]
+                for q, value in hist.percentiles().items():
+                    lines.append(f'{metric}_recent{{quantile="0.{q[1:]}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    # --- EXPORT ---
+    def start_exporter(self, path=None, port=None, interval=EXPORT_INTERVAL):
+        """Background file writer and/or `/metrics` HTTP endpoint (both daemon threads)."""
+        if path:
+            def write_loop():
+                while True:
+                    time.sleep(interval)
+                    try:
+                        self.write(path)
+                    except OSError:
+                        self.count('metrics.export_errors')
+            threading.Thread(target=write_loop, name='metrics-file', daemon=True).start()
+        if port:
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+            metrics = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = metrics.prometheus_text().encode()
+                    self.send_response(200 if self.path.startswith('/metrics') else 404)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass
+
+            server = ThreadingHTTPServer(('127.0.0.1', int(port)), Handler)
+            threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+            return server
+
+
+def _metric_name(name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+# One registry per process, shared by every module and session
+METRICS = Metrics()
+span = METRICS.span
+count = METRICS.count
+trace = METRICS.trace
+current_trace = METRICS.current_trace
+attach_trace = METRICS.attach_trace
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise an exported ShopSense metrics file.")
+    parser.add_argument('--file', required=True, help="Prometheus text written by the exporter")
+    args = parser.parse_args()
+
+    quantile = re.compile(r'^(\w+)_recent\{quantile="0\.(\d+)"\} (\S+)$')
+    counter = re.compile(r'^(\w+_total) (\S+)$')
+    rows = {}
+    with open(args.file) as f:
+        for line in f:
+            line = line.strip()
+            if m := quantile.match(line):
+                rows.setdefault(m.group(1), {})[f"p{m.group(2)}"] = float(m.group(3)) * 1000
+            elif m := counter.match(line):
+                print(f"{m.group(1):60s} {m.group(2)}")
+    for name, qs in sorted(rows.items()):
+        print(f"{name:60s} " + '  '.join(f"{q}={v:.2f}ms" for q, v in sorted(qs.items())))
+
+
+if __name__ == '__main__':
+    main()
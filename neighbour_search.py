@@ -0,0 +1,184 @@
+"""
+User Neighbour Search
+
+Pluggable nearest-neighbour layer for the user-user collaborative step.
+Every engine answers `kneighbors(user_vec, n_neighbors)` with the same
+(distances, indices) shape and cosine distances as sklearn's
+NearestNeighbors, so the recommender does not care which one it gets.
+
+- ExactSearch: wraps the pickled/refit sklearn `knn_model` (brute force).
+- LSHSearch: random-hyperplane (SimHash) LSH over the sparse user vectors.
+  Users are hashed into `n_tables` tables of `n_bits`-bit signatures using
+  a sparse random projection; a query collects the users sharing a bucket
+  in any table (optionally also the buckets one bit-flip away) and re-ranks
+  only those candidates exactly. More tables / probing raise recall, more
+  bits shrink buckets and lower latency.
+
+Recall-vs-exact benchmark against the current knn_model:
+
+    python neighbour_search.py --benchmark --queries 500
+"""
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.random_projection import SparseRandomProjection
+
+DEFAULT_TABLES = 8
+DEFAULT_BITS = 12
+MAX_CANDIDATES = 20_000
+HASH_CHUNK = 50_000
+# Below this many users brute force is already fast enough
+AUTO_LSH_MIN_USERS = 50_000
+
+
+class ExactSearch:
+    def __init__(self, knn_model):
+        self.knn_model = knn_model
+
+    def kneighbors(self, user_vec, n_neighbors):
+        return self.knn_model.kneighbors(user_vec, n_neighbors=n_neighbors)
+
+    def kneighbors_batch(self, user_rows, n_neighbors):
+        """Neighbour indices for every row of a user matrix, in one call."""
+        return list(self.knn_model.kneighbors(user_rows, n_neighbors=n_neighbors)[1])
+
+
+class LSHSearch:
+    def __init__(self, user_item_matrix, n_tables=DEFAULT_TABLES, n_bits=DEFAULT_BITS,
+                 multiprobe=True, max_candidates=MAX_CANDIDATES, random_state=0):
+        if n_bits > 62:
+            raise ValueError("n_bits must be <= 62")
+        self.matrix = user_item_matrix.tocsr()
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.multiprobe = multiprobe
+        self.max_candidates = max_candidates
+        self.norms = np.sqrt(np.asarray(self.matrix.multiply(self.matrix).sum(axis=1)).ravel())
+
+        self.projection = SparseRandomProjection(n_components=n_tables * n_bits, dense_output=True,
+                                                 random_state=random_state).fit(self.matrix)
+        self._weights = (np.uint64(1) << np.arange(n_bits, dtype=np.uint64))
+
+        n_users = self.matrix.shape[0]
+        keys = np.empty((n_users, n_tables), dtype=np.uint64)
+        for start in range(0, n_users, HASH_CHUNK):
+            keys[start:start + HASH_CHUNK] = self._signatures(self.matrix[start:start + HASH_CHUNK])
+
+        # Per table: users sorted by bucket key, searched with searchsorted
+        self._order = np.argsort(keys, axis=0, kind='stable')
+        self._sorted_keys = np.take_along_axis(keys, self._order, axis=0)
+
+    def _signatures(self, rows):
+        bits = self.projection.transform(rows) > 0
+        bits = bits.reshape(rows.shape[0], self.n_tables, self.n_bits)
+        return (bits.astype(np.uint64) * self._weights).sum(axis=2, dtype=np.uint64)
+
+    def _bucket(self, table, key):
+        col = self._sorted_keys[:, table]
+        lo = np.searchsorted(col, key, side='left')
+        hi = np.searchsorted(col, key, side='right')
+        return self._order[lo:hi, table]
+
+    def candidates(self, user_vec):
+        """Users sharing a bucket with the query; exact buckets before probes."""
+        keys = self._signatures(user_vec)[0]
+        found = [self._bucket(t, key) for t, key in enumerate(keys)]
+        if self.multiprobe:
+            found += [self._bucket(t, key ^ flip) for t, key in enumerate(keys) for flip in self._weights]
+        cand = pd.unique(np.concatenate(found))
+        return cand[:self.max_candidates]
+
+    def kneighbors(self, user_vec, n_neighbors):
+        cand = self.candidates(user_vec)
+        if len(cand) == 0:
+            return np.empty((1, 0)), np.empty((1, 0), dtype=np.int64)
+        q_norm = np.sqrt(user_vec.multiply(user_vec).sum())
+        dots = np.asarray((self.matrix[cand] @ user_vec.T).todense()).ravel()
+        denom = self.norms[cand] * q_norm
+        sims = np.divide(dots, denom, out=np.zeros_like(dots, dtype=np.float64), where=denom > 0)
+        dist = 1.0 - sims
+        n = min(n_neighbors, len(cand))
+        top = np.argpartition(dist, n - 1)[:n] if n < len(cand) else np.arange(len(cand))
+        top = top[np.lexsort((cand[top], dist[top]))]
+        return dist[top][None, :], cand[top][None, :]
+
+    def kneighbors_batch(self, user_rows, n_neighbors):
+        # Buckets differ per query, so there is nothing to share between rows
+        return [self.kneighbors(user_rows[i], n_neighbors)[1][0] for i in range(user_rows.shape[0])]
+
+
+def make_neighbour_search(backend, knn_model, user_item_matrix, **params):
+    """
+    backend: 'exact', 'lsh' or 'auto' (LSH once the user base is large
+    enough for brute force to hurt).
+    """
+    if backend == 'auto':
+        backend = 'lsh' if user_item_matrix.shape[0] >= AUTO_LSH_MIN_USERS else 'exact'
+    if backend == 'lsh':
+        return LSHSearch(user_item_matrix, **params)
+    return ExactSearch(knn_model)
+
+
+def rebuild_neighbour_search(backend, knn_model, user_item_matrix, **params):
+    """
+    `make_neighbour_search` over a new user-item matrix; the exact model is
+    refit with the parameters of `knn_model`.
+    """
+    if backend == 'auto':
+        backend = 'lsh' if user_item_matrix.shape[0] >= AUTO_LSH_MIN_USERS else 'exact'
+    if backend == 'lsh':
+        return LSHSearch(user_item_matrix, **params)
+    return ExactSearch(clone(knn_model).fit(user_item_matrix))
+
+
+# --- BENCHMARK ---
+def benchmark(knn_model, user_item_matrix, n_queries=200, n_neighbors=6, grid=None, seed=0):
+    """
+    Recall@n_neighbors and mean latency of LSH settings against the exact
+    model, over users sampled from the matrix (empty rows skipped).
+    """
+    matrix = user_item_matrix.tocsr()
+    active = np.flatnonzero(np.diff(matrix.indptr) > 0)
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(active, size=min(n_queries, len(active)), replace=False)
+
+    exact = ExactSearch(knn_model)
+    truth, t0 = [], time.perf_counter()
+    for u in queries:
+        truth.append(set(exact.kneighbors(matrix.getrow(u), n_neighbors)[1][0].tolist()))
+    results = [{'engine': 'exact', 'recall': 1.0,
+                'ms_per_query': 1000 * (time.perf_counter() - t0) / len(queries)}]
+
+    for params in grid or [{'n_tables': t, 'n_bits': b, 'multiprobe': p}
+                           for t in (4, 8, 16) for b in (8, 12, 16) for p in (False, True)]:
+        t_build = time.perf_counter()
+        engine = LSHSearch(matrix, random_state=seed, **params)
+        build_s = time.perf_counter() - t_build
+        hits, t0 = 0, time.perf_counter()
+        for u, want in zip(queries, truth):
+            got = engine.kneighbors(matrix.getrow(u), n_neighbors)[1][0].tolist()
+            hits += len(want.intersection(got))
+        results.append({'engine': 'lsh', **params, 'build_s': round(build_s, 3),
+                        'recall': hits / sum(len(t) for t in truth),
+                        'ms_per_query': 1000 * (time.perf_counter() - t0) / len(queries)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="User neighbour search tools.")
+    parser.add_argument('--benchmark', action='store_true', help="Recall/latency of LSH vs exact")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--neighbors', type=int, default=6)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        from artifacts import open_artifacts
+        data = open_artifacts()
+        for row in benchmark(data['knn_model'], data['user_item_matrix'], args.queries, args.neighbors):
+            print('  '.join(f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}" for k, v in row.items()))
+
+
+if __name__ == '__main__':
+    main()
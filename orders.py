@@ -0,0 +1,202 @@
+"""
+Order Processing
+
+Placing an order only writes one row to a small SQLite ledger and hands the
+order to a background worker; the page returns straight away. The worker
+does the slow part: one bulk interaction append for all the order's items
+and the downstream updates that come with it (like graph, user matrix,
+popularity, session profile, rec cache).
+
+- Idempotent: the order ID (one per checkout, `new_order_id()`) is the
+  ledger's primary key, so a double click, a rerun or a retry of the same
+  checkout is accepted once and ignored after that.
+- Durable: an order is 'pending' in the ledger until processed, and a
+  worker claims it ('processing') before it runs, so two processes sharing
+  the ledger never run it at the same time. Pending orders left by a
+  previous run are picked up again on start. A claim older than
+  STALE_CLAIM was orphaned by a crash and goes back to 'pending', as does a
+  failed order with tries left (MAX_ATTEMPTS); start() and the worker
+  check for both every RECOVER_INTERVAL. Processing is therefore
+  at-least-once: an order interrupted by a crash runs again.
+
+Counters: orders.placed, orders.duplicate, orders.failed, orders.recovered;
+span orders.process.
+
+    python orders.py                # ledger summary
+    python orders.py --pending      # orders not processed yet
+"""
+import os
+import json
+import time
+import uuid
+import queue
+import sqlite3
+import argparse
+import threading
+
+from metrics import span, count
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ORDERS_DB = os.path.join(BASE_DIR, 'orders.db')
+
+CLOSE_TIMEOUT = 10.0     # seconds close() waits for queued orders
+MAX_ATTEMPTS = 3         # tries per order before it stays 'failed'
+STALE_CLAIM = 60.0       # seconds after which a 'processing' order counts as orphaned
+RECOVER_INTERVAL = 30.0  # seconds between checks for orphaned and failed orders
+
+
+def new_order_id():
+    return uuid.uuid4().hex
+
+
+class OrderQueue:
+    def __init__(self, process, path=ORDERS_DB):
+        """process(user_id, product_indices): applies one order; runs on the worker thread."""
+        self.process = process
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS orders ("
+            " order_id TEXT PRIMARY KEY,"
+            " user_id INTEGER,"
+            " items TEXT NOT NULL,"
+            " status TEXT NOT NULL DEFAULT 'pending',"
+            " created REAL NOT NULL,"
+            " processed REAL,"
+            " claimed REAL,"
+            " attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(orders)")}
+        if 'attempts' not in columns:
+            # Ledgers created before crash recovery
+            self._conn.execute("ALTER TABLE orders ADD COLUMN claimed REAL")
+            self._conn.execute("ALTER TABLE orders ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._recovered_at = 0.0
+
+    def start(self):
+        """Start the worker, first re-queueing the unfinished orders of earlier runs."""
+        self._recover()
+        self._worker = threading.Thread(target=self._run, name='orders', daemon=True)
+        self._worker.start()
+        return self
+
+    # --- PLACING ---
+    def place(self, order_id, user_id, product_indices):
+        """Record and queue an order; False if this order ID was placed before."""
+        items = json.dumps([int(p) for p in product_indices])
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO orders (order_id, user_id, items, created) VALUES (?, ?, ?, ?)",
+                (str(order_id), int(user_id) if user_id is not None else None, items, time.time()))
+        if cur.rowcount == 0:
+            count('orders.duplicate')
+            return False
+        count('orders.placed')
+        self._queue.put(str(order_id))
+        return True
+
+    def status(self, order_id):
+        """'pending', 'processing', 'done', 'failed', or None for an unknown order."""
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM orders WHERE order_id = ?",
+                                     (str(order_id),)).fetchone()
+        return row[0] if row else None
+
+    def join(self):
+        """Block until every queued order has been processed."""
+        self._queue.join()
+
+    # --- WORKER ---
+    def _recover(self):
+        """Queue every pending order, after resetting orphaned claims and retryable failures."""
+        self._recovered_at = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE orders SET status = 'pending'"
+                " WHERE (status = 'processing' AND COALESCE(claimed, 0) < ?)"
+                " OR (status = 'failed' AND attempts < ?)",
+                (self._recovered_at - STALE_CLAIM, MAX_ATTEMPTS))
+            pending = self._conn.execute(
+                "SELECT order_id FROM orders WHERE status = 'pending' ORDER BY created").fetchall()
+        if cur.rowcount:
+            count('orders.recovered', cur.rowcount)
+        # Orders already queued are claimed once; the second pass finds them taken
+        for (order_id,) in pending:
+            self._queue.put(order_id)
+
+    def _claim(self, order_id):
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE orders SET status = 'processing', claimed = ?, attempts = attempts + 1"
+                " WHERE order_id = ? AND status = 'pending'",
+                (time.time(), order_id))
+            if cur.rowcount == 0:
+                return None  # done already, or claimed by another process
+            return self._conn.execute("SELECT user_id, items FROM orders WHERE order_id = ?",
+                                      (order_id,)).fetchone()
+
+    def _finish(self, order_id, status):
+        with self._lock:
+            self._conn.execute("UPDATE orders SET status = ?, processed = ? WHERE order_id = ?",
+                               (status, time.time(), order_id))
+
+    def _run(self):
+        while True:
+            try:
+                order_id = self._queue.get(timeout=RECOVER_INTERVAL)
+            except queue.Empty:
+                self._recover()
+                continue
+            try:
+                if order_id is None:
+                    return
+                if time.time() - self._recovered_at >= RECOVER_INTERVAL:
+                    self._recover()
+                order = self._claim(order_id)
+                if order is None:
+                    continue
+                user_id, items = order
+                try:
+                    with span('orders.process'):
+                        self.process(user_id, json.loads(items))
+                    self._finish(order_id, 'done')
+                except Exception:
+                    count('orders.failed')
+                    self._finish(order_id, 'failed')
+            finally:
+                self._queue.task_done()
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        """Process what is queued (up to `timeout`), then stop; the rest stays pending."""
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join(timeout)
+            if self._worker.is_alive():
+                return  # still busy; the daemon thread ends with the process
+        with self._lock:
+            self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the ShopSense order ledger.")
+    parser.add_argument('--db', default=ORDERS_DB)
+    parser.add_argument('--pending', action='store_true', help="List orders not processed yet")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    for status, n in conn.execute("SELECT status, COUNT(*) FROM orders GROUP BY status ORDER BY status"):
+        print(f"{status:<12} {n}")
+    if args.pending:
+        for order_id, user_id, items, created in conn.execute(
+                "SELECT order_id, user_id, items, created FROM orders"
+                " WHERE status IN ('pending', 'processing') ORDER BY created"):
+            print(f"{order_id}  user={user_id}  items={items}  "
+                  f"placed {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created))}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Popularity & Trending
+
+Time-decayed popularity of every product, from the same interactions the
+recommender logs (views 1.0, add-to-cart 3.5, orders 5.0):
+
+- Each event adds its weight (EVENT_WEIGHTS) to the product's score with
+  forward exponential decay (half-life HALF_LIFE): a score is stored as
+  sum(w * 2^((t - t0) / half_life)), so recording is O(1), older events
+  fade relative to newer ones, and no periodic pass over the catalogue is
+  needed. Scores are rescaled to a new t0 before the exponent can grow
+  large.
+- Orders are also counted per product (the "sold" figure).
+- Global and per-category top-N lists are precomputed and served as-is;
+  once they are older than REFRESH_INTERVAL and something changed, the next
+  read kicks off a rebuild in a background thread and keeps serving the
+  previous lists until it lands. Ties (e.g. a cold catalogue) fall back to
+  the number of ratings.
+
+Interactions shipped without timestamps count as happening at start-up.
+
+    python popularity.py --top 20
+    python popularity.py --top 10 --category Headphones
+"""
+import time
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+
+from metrics import span, count
+
+HALF_LIFE = 3 * 24 * 3600.0  # seconds
+REFRESH_INTERVAL = 30.0      # seconds a top-N list may lag behind new events
+TOP_N = 200
+TOP_N_PER_CATEGORY = 48
+PURCHASE_RATING = 5.0
+CART_RATING = 3.5
+EVENT_WEIGHTS = {'view': 1.0, 'cart': CART_RATING, 'purchase': PURCHASE_RATING}
+MAX_EXPONENT = 60.0  # rescale before 2**exponent loses precision
+
+
+def event_weights(ratings):
+    """Event weight per interaction rating (order / cart / view)."""
+    ratings = np.asarray(ratings, dtype=np.float32)
+    return np.select([ratings >= PURCHASE_RATING, ratings >= CART_RATING],
+                     [EVENT_WEIGHTS['purchase'], EVENT_WEIGHTS['cart']], EVENT_WEIGHTS['view'])
+
+
+class Popularity:
+    def __init__(self, categories, prior=None, half_life=HALF_LIFE, refresh_interval=REFRESH_INTERVAL,
+                 now=None):
+        """
+        categories: category label per catalogue row; prior: tie-break score
+        per row (e.g. number of ratings).
+        """
+        codes, values = pd.factorize(pd.Series(categories).astype(object), sort=True)
+        self.n_items = len(codes)
+        self.category_codes = codes.astype(np.int32)
+        self.category_names = [str(v) for v in values]
+        self._category_pos = {name: i for i, name in enumerate(self.category_names)}
+        self.prior = (np.zeros(self.n_items) if prior is None
+                      else pd.to_numeric(pd.Series(prior), errors='coerce').fillna(0).to_numpy(np.float64))
+        self.half_life = half_life
+        self.refresh_interval = refresh_interval
+
+        self._lock = threading.Lock()
+        self._t0 = time.time() if now is None else now
+        self.scores = np.zeros(self.n_items, dtype=np.float64)
+        self.sold = np.zeros(self.n_items, dtype=np.int64)
+        self._version = 0
+        self._tops = None  # (version, built_at, global top, {category code: top})
+        self._refreshing = False
+
+    @classmethod
+    def from_log(cls, interaction_log, df, **options):
+        cols = interaction_log.columns()
+        prior = df['no_of_ratings'] if 'no_of_ratings' in df.columns else None
+        categories = df['category'] if 'category' in df.columns else np.zeros(len(df))
+        pop = cls(categories, prior, **options)
+        ts = np.where(cols['ts'] > 0, cols['ts'], pop._t0)
+        pop.add(cols['product_index'], cols['rating'], ts)
+        pop.refresh()
+        return pop
+
+    # --- WRITES ---
+    def add(self, product_idxs, ratings, ts=None):
+        products = np.asarray(product_idxs, dtype=np.int64)
+        if len(products) == 0:
+            return
+        ratings = np.asarray(ratings, dtype=np.float32)
+        ts = np.full(len(products), time.time()) if ts is None else np.broadcast_to(ts, products.shape)
+        valid = (products >= 0) & (products < self.n_items)
+        products, ratings, ts = products[valid], ratings[valid], ts[valid]
+        with self._lock:
+            top = float(ts.max()) if len(ts) else self._t0
+            if (top - self._t0) / self.half_life > MAX_EXPONENT:
+                self._rescale(top)
+            growth = np.exp2((ts - self._t0) / self.half_life)
+            np.add.at(self.scores, products, event_weights(ratings) * growth)
+            np.add.at(self.sold, products[ratings >= PURCHASE_RATING], 1)
+            self._version += 1
+
+    def _rescale(self, t0):
+        self.scores *= np.exp2((self._t0 - t0) / self.half_life)
+        self._t0 = t0
+
+    # --- READS ---
+    def score(self, idx, now=None):
+        """Decayed score of one product as of `now` (for display/debugging)."""
+        now = time.time() if now is None else now
+        return float(self.scores[idx] * np.exp2((self._t0 - now) / self.half_life))
+
+    def sold_count(self, idx):
+        return int(self.sold[idx])
+
+    def top(self, n=TOP_N, category=None):
+        """Most popular products (row positions), optionally within one category."""
+        tops = self._current_tops()
+        if category is None:
+            return tops[2][:n]
+        code = self._category_pos.get(str(category))
+        if code is None:
+            return []
+        return tops[3].get(code, [])[:n]
+
+    def category_of(self, idx):
+        code = self.category_codes[idx]
+        return self.category_names[code] if code >= 0 else None
+
+    # --- TOP-N ---
+    def _current_tops(self):
+        tops = self._tops
+        if (tops[0] != self._version and time.time() - tops[1] >= self.refresh_interval
+                and not self._refreshing):
+            self._refreshing = True
+            threading.Thread(target=self._refresh_in_background, name='popularity-refresh',
+                             daemon=True).start()
+        return tops
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            count('fallback.popularity_refresh')
+        finally:
+            self._refreshing = False
+
+    def refresh(self):
+        """Rebuild the global and per-category top-N lists."""
+        with span('popularity.refresh'):
+            with self._lock:
+                version, scores = self._version, self.scores.copy()
+            order = np.lexsort((np.arange(self.n_items), -self.prior, -scores))
+            top_global = order[:TOP_N].tolist()
+
+            # Stable regroup by category keeps the score order inside each group
+            by_category = order[np.argsort(self.category_codes[order], kind='stable')]
+            codes = self.category_codes[by_category]
+            bounds = np.searchsorted(codes, np.arange(len(self.category_names) + 1))
+            per_category = {c: by_category[bounds[c]:min(bounds[c + 1], bounds[c] + TOP_N_PER_CATEGORY)].tolist()
+                            for c in range(len(self.category_names))}
+            self._tops = (version, time.time(), top_global, per_category)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Product popularity from the interaction log.")
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--category')
+    args = parser.parse_args()
+
+    from recommender import open_data
+    data = open_data()
+    pop, df = data['popularity'], data['dataframe']
+    for rank, idx in enumerate(pop.top(args.top, args.category), 1):
+        print(f"{rank:>3}. [{idx}] {str(df['name'].iloc[idx])[:60]:<60} "
+              f"score={pop.score(idx):.2f} sold={pop.sold_count(idx)}")
+
+
+if __name__ == '__main__':
+    main()
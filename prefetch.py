@@ -0,0 +1,63 @@
+"""
+Speculative Prefetch
+
+A small thread pool that computes results before a page asks for them,
+e.g. the similar items of a product the moment it is clicked, while the
+click's rerun is still on its way. Results are keyed; `take()` returns a
+finished result straight away, waits for one still running (instead of
+starting a second computation), or computes it inline if nothing was
+prefetched. Unclaimed results are dropped oldest first beyond
+`MAX_PENDING`, and callers discard keys whose inputs changed.
+
+Counters: prefetch.hit (ready), prefetch.wait (still running),
+prefetch.miss (computed inline), prefetch.error.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import count
+
+DEFAULT_WORKERS = 2
+MAX_PENDING = 1024
+
+
+class Prefetcher:
+    def __init__(self, workers=DEFAULT_WORKERS, max_pending=MAX_PENDING):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        self.max_pending = max_pending
+        self._futures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, *args):
+        """Start `fn(*args)` in the background unless `key` is already pending."""
+        with self._lock:
+            if key in self._futures:
+                return
+            self._futures[key] = self.executor.submit(fn, *args)
+            while len(self._futures) > self.max_pending:
+                _, stale = self._futures.popitem(last=False)
+                stale.cancel()
+
+    def take(self, key, fn, *args):
+        """The prefetched result for `key`, else `fn(*args)` computed now."""
+        with self._lock:
+            future = self._futures.pop(key, None)
+        if future is not None and not future.cancelled():
+            count('prefetch.hit' if future.done() else 'prefetch.wait')
+            try:
+                return future.result()
+            except Exception:
+                count('prefetch.error')
+        else:
+            count('prefetch.miss')
+        return fn(*args)
+
+    def discard(self, predicate):
+        """Drop pending results whose key matches, e.g. after the inputs changed."""
+        with self._lock:
+            for key in [k for k in self._futures if predicate(k)]:
+                self._futures.pop(key).cancel()
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,96 @@
+"""
+Product Cards
+
+HTML fragments for the product grid. The columns a card needs are pulled
+out of the catalogue once as numpy arrays (no per-row `iterrows`), and each
+product's rendered fragment is memoised in a bounded LRU shared by every
+session, so a rerun only formats cards it has not produced before.
+Image links go through the local thumbnail cache when one is given
+(image_cache.py) and are resolved on every render, outside the memoised
+fragment, so a thumbnail built after a card was first shown is picked up.
+Broken images fall back to the bundled placeholder.
+"""
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+from image_cache import placeholder_uri
+
+MAX_CACHED_CARDS = 50_000
+PAGE_SIZE = 40
+IMAGE_SLOT = '\0image\0'  # where the memoised fragment is split for the image link
+
+CARD_TEMPLATE = """
+            <div class="product-card">
+                <div class="product-img-container">
+                    <img src="{image}" class="product-img" onerror="this.onerror=null;this.src='{fallback}';">
+                </div>
+                <div class="card-content">
+                    <div class="product-title">{name}</div>
+                    <div style="margin-top:auto">
+                        <div class="product-price"><span style="font-size:10px">RM</span>{price:.2f}</div>
+                        <div class="product-rating">
+                            <span style="color:#ffce3d;">★</span> {rating:.1f}
+                        </div>
+                    </div>
+                </div>
+            </div>
+            """
+
+
+def _numeric(df, col):
+    if col not in df.columns:
+        return np.zeros(len(df))
+    return pd.to_numeric(df[col], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+
+
+class CardRenderer:
+    def __init__(self, df, max_cached=MAX_CACHED_CARDS, images=None):
+        """images: an ImageCache for local thumbnail links (None: the catalogue's URLs)."""
+        self.names = df['name'].to_numpy() if 'name' in df.columns else np.full(len(df), '')
+        self.images = df['image'].to_numpy() if 'image' in df.columns else np.full(len(df), '')
+        self.image_cache = images
+        self.fallback = images.placeholder if images is not None else placeholder_uri()
+        self.prices = _numeric(df, 'discount_price')
+        self.ratings = np.clip(_numeric(df, 'ratings'), 0.0, 5.0)
+        self.max_cached = max_cached
+        self._cache = OrderedDict()  # row position -> (html before the image link, html after)
+        self._lock = threading.Lock()
+
+    def _render(self, row):
+        html = CARD_TEMPLATE.format(image=IMAGE_SLOT, fallback=self.fallback, name=self.names[row],
+                                    price=self.prices[row], rating=self.ratings[row])
+        head, tail = html.split(IMAGE_SLOT)
+        return head, tail
+
+    def _image(self, row):
+        src = self.images[row]
+        return self.image_cache.link(src) if self.image_cache is not None else (src or self.fallback)
+
+    def card(self, row):
+        return self.cards([row])[0]
+
+    def cards(self, rows):
+        """HTML for each catalogue row position in `rows`."""
+        rows = [int(row) for row in rows]
+        parts = []
+        with self._lock:
+            for row in rows:
+                part = self._cache.get(row)
+                if part is None:
+                    part = self._cache[row] = self._render(row)
+                    if len(self._cache) > self.max_cached:
+                        self._cache.popitem(last=False)
+                else:
+                    self._cache.move_to_end(row)
+                parts.append(part)
+        return [head + self._image(row) + tail for row, (head, tail) in zip(rows, parts)]
+
+
+def page_bounds(n_rows, page, page_size=PAGE_SIZE):
+    """(start, stop, page) for a page number clamped to the result set."""
+    n_pages = max(-(-n_rows // page_size), 1)
+    page = min(max(page, 0), n_pages - 1)
+    start = page * page_size
+    return start, min(start + page_size, n_rows), page
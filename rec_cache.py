@@ -0,0 +1,219 @@
+"""
+Recommendation Cache
+
+Process-wide LRU + TTL cache for recommendation results (lists of catalogue
+row positions), shared by every Streamlit session instead of living in one
+session's state. Entries carry tags such as ('user', uid) or ('item', idx)
+so recording an interaction can drop exactly the entries it affects.
+
+- RecCache: in-process, thread-safe OrderedDict LRU.
+- SharedRecCache: same API over a local SQLite file, so several server
+  processes on one host share entries and invalidations.
+
+Both keep hit / miss / eviction / invalidation counters (`stats()`).
+"""
+import os
+import time
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SHARED_CACHE_FILE = os.path.join(BASE_DIR, 'rec_cache.db')
+
+MAX_ENTRIES = 20_000
+DEFAULT_TTL = 300  # seconds
+
+
+class RecCache:
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires, value, tags)
+        self._tags = {}  # tag -> set of keys
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    self._drop(key)
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return entry[1]
+
+    def put(self, key, value, tags=(), ttl=None):
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (expires, value, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self._counters['evictions'] += 1
+
+    def _drop(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def invalidate(self, *tags):
+        """Drop every entry carrying any of the given tags."""
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._drop(key)
+                    self._counters['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters, size=len(self._entries))
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+class SharedRecCache:
+    """
+    RecCache API backed by a WAL-mode SQLite file shared between processes.
+    Counters are per process.
+    """
+
+    def __init__(self, path=SHARED_CACHE_FILE, max_entries=MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+        self._counter_lock = threading.Lock()
+        conn = self._conn()
+        conn.executescript(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL, used REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS tags (tag TEXT NOT NULL, key TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS tags_by_tag ON tags (tag);"
+            "CREATE INDEX IF NOT EXISTS tags_by_key ON tags (key);"
+            "CREATE INDEX IF NOT EXISTS entries_by_used ON entries (used);"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")  # it is only a cache
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name, n=1):
+        with self._counter_lock:
+            self._counters[name] += n
+
+    def get(self, key):
+        conn, now = self._conn(), time.time()
+        row = conn.execute("SELECT value, expires FROM entries WHERE key = ?", (repr(key),)).fetchone()
+        if row is None or row[1] < now:
+            self._count('misses')
+            return None
+        conn.execute("UPDATE entries SET used = ? WHERE key = ?", (now, repr(key)))
+        self._count('hits')
+        return pickle.loads(row[0])
+
+    def put(self, key, value, tags=(), ttl=None):
+        conn, now, skey = self._conn(), time.time(), repr(key)
+        expires = now + (self.ttl if ttl is None else ttl)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                         (skey, pickle.dumps(value), expires, now))
+            conn.execute("DELETE FROM tags WHERE key = ?", (skey,))
+            conn.executemany("INSERT INTO tags VALUES (?, ?)", [(repr(t), skey) for t in tags])
+            over = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+            if over > 0:
+                victims = conn.execute("SELECT key FROM entries ORDER BY used LIMIT ?", (over,)).fetchall()
+                self._delete(conn, [k for (k,) in victims])
+                self._count('evictions', len(victims))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _delete(conn, keys):
+        conn.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k in keys])
+        conn.executemany("DELETE FROM tags WHERE key = ?", [(k,) for k in keys])
+
+    def invalidate(self, *tags):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            keys = set()
+            for tag in tags:
+                keys.update(k for (k,) in conn.execute("SELECT key FROM tags WHERE tag = ?", (repr(tag),)))
+            self._delete(conn, keys)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._count('invalidations', len(keys))
+
+    def clear(self):
+        self._conn().executescript("DELETE FROM entries; DELETE FROM tags;")
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def stats(self):
+        with self._counter_lock:
+            stats = dict(self._counters)
+        stats['size'] = len(self)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+class NullCache:
+    """Cache switched off: every lookup misses."""
+
+    def get(self, key):
+        return None
+
+    def put(self, key, value, tags=(), ttl=None):
+        pass
+
+    def invalidate(self, *tags):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0, 'size': 0, 'hit_rate': 0.0}
+
+
+def make_rec_cache(mode='local', **kwargs):
+    """mode: 'local' (per process), 'shared' (SQLite, cross-process) or 'off'."""
+    if mode == 'shared':
+        return SharedRecCache(**kwargs)
+    if mode == 'off':
+        return NullCache()
+    return RecCache(**kwargs)
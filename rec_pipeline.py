@@ -0,0 +1,133 @@
+"""
+Candidate Pipeline
+
+Hybrid recommendations are built in three stages:
+
+1. Generation: pluggable candidate generators (similar products, peers'
+   likes, nearest users' likes, trending products, ...) run side by side on
+   a shared thread pool. Each has its own time budget and the stage as a
+   whole has a deadline; a generator that raises or runs out of time is
+   counted (fallback.<name> / recs.timeout.<name>) and left out, so a slow
+   source thins the list instead of stalling the page. The request is then
+   marked `degraded`, and callers don't cache its result.
+2. Merge: the union of all candidate sets, with collaborative votes summed
+   per product (`Counter`), minus the items the user already has.
+3. Ranking: one pass over the merged candidates (recommender._rank).
+
+A generator subclasses `Generator` and implements `generate(data, request)`,
+returning (products, votes). Batch jobs call `generate_batch`, which lets
+each generator `prepare` the lookups of a whole chunk of requests in one
+call and then runs the generators inline, without budgets.
+"""
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import numpy as np
+
+from metrics import span, count, current_trace, attach_trace
+
+DEFAULT_WORKERS = 8
+DEFAULT_BUDGET = 0.05  # seconds per generator
+DEADLINE = 0.15        # seconds for the whole generation stage
+
+
+class RecRequest:
+    """One user's hybrid request: session profile, its seed items and prepared lookups."""
+
+    __slots__ = ('uid', 'profile', 'seeds', 'inputs', 'degraded')
+
+    def __init__(self, uid, profile, seeds):
+        self.uid = uid
+        self.profile = profile
+        self.seeds = seeds
+        self.inputs = {}  # generator name -> result of its batch `prepare`
+        self.degraded = False  # a generator timed out or raised and was left out
+
+
+class Generator:
+    name = 'generator'
+    requires = ()  # components loaded before the clock starts
+
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+
+    def prepare(self, data, requests):
+        """Batch mode: look up what many requests need in one call (optional)."""
+
+    def generate(self, data, request):
+        """(iterable of product rows, {product: collaborative votes})."""
+        raise NotImplementedError
+
+
+class CandidatePipeline:
+    def __init__(self, generators, workers=DEFAULT_WORKERS, deadline=DEADLINE):
+        """workers=0 runs the generators inline, one after another, without budgets."""
+        self.generators = list(generators)
+        self.deadline = deadline
+        self.executor = (ThreadPoolExecutor(max_workers=workers, thread_name_prefix='recs-gen')
+                         if workers else None)
+
+    def generate(self, data, request):
+        """Merged (candidates, votes) of one request, within the deadline."""
+        for gen in self.generators:
+            for name in gen.requires:
+                data[name]
+        if self.executor is None:
+            return merge(request, [self._run(gen, data, request) for gen in self.generators])
+
+        with span('recs.generate'):
+            started = time.perf_counter()
+            # Generator spans go into the caller's trace, not the pool thread's
+            context = current_trace()
+            futures = [(gen, self.executor.submit(self._run, gen, data, request, context))
+                       for gen in self.generators]
+            results = []
+            for gen, future in futures:
+                remaining = started + min(gen.budget, self.deadline) - time.perf_counter()
+                try:
+                    results.append(future.result(timeout=max(remaining, 0.0)))
+                except FutureTimeout:
+                    future.cancel()
+                    count(f'recs.timeout.{gen.name}')
+                    request.degraded = True
+        return merge(request, results)
+
+    def generate_batch(self, data, requests):
+        """`generate` for many requests; lookups are prepared per generator, then run inline."""
+        for gen in self.generators:
+            try:
+                with span(f'batch.{gen.name}'):
+                    gen.prepare(data, requests)
+            except Exception:
+                count(f'fallback.batch_{gen.name}')
+        return [merge(request, [self._run(gen, data, request) for gen in self.generators])
+                for request in requests]
+
+    @staticmethod
+    def _run(gen, data, request, context=None):
+        try:
+            with attach_trace(context or current_trace()), span(f'recs.{gen.name}'):
+                return gen.generate(data, request)
+        except Exception:
+            count(f'fallback.{gen.name}')
+            request.degraded = True
+            return None
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def merge(request, results):
+    """(candidate rows not in the profile as a sorted int64 array, summed votes)."""
+    candidates, votes = set(), Counter()
+    for result in results:
+        if result is None:
+            continue
+        products, gen_votes = result
+        candidates.update(products)
+        if gen_votes:
+            votes.update(gen_votes)
+            candidates.update(gen_votes)
+    candidates.difference_update(request.profile.items)
+    return np.fromiter(sorted(candidates), dtype=np.int64, count=len(candidates)), votes
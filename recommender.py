@@ -0,0 +1,480 @@
+"""
+Recommendation Engine
+
+The recommendation logic behind the Streamlit pages, importable without
+Streamlit, with single-call and batch entry points that return identical
+results:
+
+- content_rec_indices / batch_content_rec_indices: similar products, read
+  from the top-K table or scored as one sparse matrix-matrix product per
+  block of query rows.
+- hybrid_rec_indices / batch_hybrid_rec_indices: candidates from the
+  generators below, run in parallel under per-generator time budgets and
+  merged as sets (rec_pipeline.py), then ranked in one pass against the
+  user's time-decayed session profile (session_profile.py). The batch
+  version lets each generator look up the content neighbours or the user
+  neighbours of a whole chunk of users in one call, then assembles every
+  user's list exactly as the single call does.
+  User neighbours come from the online user-item matrix (user_matrix.py),
+  so a user's new interactions count straight away.
+
+Short hybrid lists are padded with trending products (popularity.py): the
+category of the profile's strongest item first, then the catalogue overall.
+
+Precompute recommendations for every account, or similar items for products:
+
+    python recommender.py --users --n 10 --out recs.csv
+    python recommender.py --items 12 40 97 --n 6
+"""
+import sys
+import argparse
+from collections import Counter
+import numpy as np
+import pandas as pd
+
+from artifacts import open_artifacts, ARTIFACT_DIR, DATA_FILE
+from similarity_index import SimilarityIndex, TOPK_FILE
+from embeddings import EmbeddingIndex, fit_embeddings
+from search_index import SearchIndex
+from facet_index import FacetIndex
+from interaction_store import InteractionLog, LOG_DIR
+from adjacency_index import LikeGraph, EDGE_MIN_RATING
+from neighbour_search import make_neighbour_search, rebuild_neighbour_search
+from user_matrix import UserMatrix, REINDEX_INTERVAL
+from rec_cache import make_rec_cache
+from popularity import Popularity
+from session_profile import SessionProfiles, history_signature
+from rec_pipeline import (CandidatePipeline, Generator, RecRequest, DEFAULT_WORKERS as PIPELINE_WORKERS,
+                          DEADLINE as PIPELINE_DEADLINE)
+from metrics import span, count
+
+CONTENT_SEEDS = 3         # strongest profile items whose similar products are candidates
+CONTENT_CANDIDATES = 10   # similar products per seed
+PEER_LIMIT = 5
+PEER_RECS_CAP = 8         # most recent likes per peer
+PEER_MIN_RATING = 4.0
+KNN_NEIGHBOURS = 6
+KNN_MIN_RATING = 3.5
+KNN_RECS_PER_USER = 20    # most recent likes per neighbour
+POPULAR_CANDIDATES = 20
+# Seconds each candidate generator may take before the ranking goes ahead without it
+GENERATOR_BUDGETS = {'content': 0.05, 'item_user_item': 0.05, 'knn': 0.1, 'popularity': 0.02}
+BLEND_WEIGHTS = {'content': 0.5, 'collab': 0.35, 'popularity': 0.15}
+BATCH_USERS = 1024  # users per neighbour lookup in batch mode
+CBF_CACHE_TTL = 3600   # content recs only change when the similarity index is rebuilt
+HYBRID_CACHE_TTL = 300
+
+
+# --- DATA ---
+def load_similarity_index(data):
+    # Top-K neighbour table from the artifact build, else the standalone .npz
+    # (exact fallback if missing/stale)
+    if 'similarity_topk' in data:
+        topk = data['similarity_topk']
+        return SimilarityIndex(data['tfidf_matrix'], topk['indices'], topk['scores'], topk['fingerprint'],
+                               topk['matrix_fingerprint'])
+    return SimilarityIndex.load(data['tfidf_matrix'], TOPK_FILE)
+
+
+def load_embedding_index(data):
+    # Memory-mapped vectors from the build, else fitted in memory on first use
+    if 'embeddings' in data:
+        return EmbeddingIndex(data['embeddings'])
+    count('recs.embeddings_fitted_on_load')
+    return EmbeddingIndex(fit_embeddings(data['tfidf_matrix'])[0])
+
+
+def load_user_matrix(data, neighbour_backend='auto', reindex_interval=REINDEX_INTERVAL):
+    """Online user-item matrix, caught up with the interactions logged since the build."""
+    users = UserMatrix(data['user_item_matrix'], data['user_neighbours'],
+                       lambda matrix: rebuild_neighbour_search(neighbour_backend, data['knn_model'], matrix),
+                       reindex_interval=reindex_interval)
+    cols = data['interaction_log'].columns()
+    shipped = len(data['interactions'])
+    users.add(cols['user_id'][shipped:], cols['product_index'][shipped:], cols['rating'][shipped:])
+    return users.start()
+
+
+def register_components(data, neighbour_backend='auto', rec_cache_mode='local', log_dir=LOG_DIR,
+                        user_reindex_interval=REINDEX_INTERVAL, content_mode='tfidf',
+                        pipeline_workers=PIPELINE_WORKERS, recs_deadline=PIPELINE_DEADLINE):
+    """
+    Register the derived indexes on a lazy artifact store; nothing is built
+    yet. content_mode: 'tfidf' (top-K table over TF-IDF cosine) or
+    'embedding' (dense SVD vectors, see embeddings.py). pipeline_workers /
+    recs_deadline: thread pool and time limit of the hybrid candidate
+    generators (rec_pipeline.py).
+    """
+    data.register('similarity_index',
+                  load_embedding_index if content_mode == 'embedding' else load_similarity_index)
+    # Inverted index for the home-page search box
+    data.register('search_index', lambda d: SearchIndex(d['dataframe']))
+    # Sidebar filters: category / price / rating rows and option counts
+    data.register('facet_index', lambda d: FacetIndex(d['dataframe']))
+    # Live interactions: shipped history + append-only on-disk log
+    data.register('interaction_log', lambda d: InteractionLog.open(log_dir, base=d['interactions']))
+    # product <-> user "liked" adjacency for the collaborative steps
+    data.register('like_graph', lambda d: LikeGraph.from_log(d['interaction_log']))
+    # Neighbour search for the user-user collaborative step
+    data.register('user_neighbours', lambda d: make_neighbour_search(
+        neighbour_backend, d['knn_model'], d['user_item_matrix']))
+    # Live user-item rows + ID -> row mapping, re-indexed in the background
+    data.register('user_matrix', lambda d: load_user_matrix(d, neighbour_backend, user_reindex_interval))
+    data.register('rec_cache', lambda d: make_rec_cache(rec_cache_mode))
+    # Time-decayed product popularity and trending lists
+    data.register('popularity', lambda d: Popularity.from_log(d['interaction_log'], d['dataframe']))
+    # Time-decayed per-user profile vectors for the hybrid ranking
+    data.register('session_profiles', lambda d: SessionProfiles(d['tfidf_matrix'], d['interaction_log']))
+    # Candidate generators of the hybrid recs, run in parallel under time budgets
+    data.register('rec_pipeline', lambda d: make_pipeline(pipeline_workers, recs_deadline))
+    return data
+
+
+def next_user_id(data):
+    """Lowest user ID that has no matrix row and no logged interaction."""
+    return data['user_matrix'].next_user_id()
+
+
+def open_data(root=ARTIFACT_DIR, legacy_pickle=DATA_FILE, **options):
+    """Active artifact build (or legacy pickle) with the derived components registered."""
+    return register_components(open_artifacts(root, legacy_pickle), **options)
+
+
+# --- CONTENT-BASED ---
+def content_rec_indices(data, idx, n=6):
+    return data['similarity_index'].neighbours(idx, n)
+
+
+def batch_content_rec_indices(data, product_indices, n=6):
+    """`content_rec_indices` for many products: an (len(product_indices), n) array."""
+    return data['similarity_index'].batch_neighbours(np.asarray(product_indices, dtype=np.int64), n)
+
+
+def cached_content_recs(data, idx, n=6):
+    """`content_rec_indices` through the shared recommendation cache."""
+    cache = data['rec_cache']
+    key = ('cbf', int(idx), n)
+    indices = cache.get(key)
+    if indices is None:
+        count('recs.cbf_cache_miss')
+        indices = content_rec_indices(data, idx, n)
+        cache.put(key, indices, ttl=CBF_CACHE_TTL)
+    return indices
+
+
+def cached_batch_content_recs(data, product_indices, n=6):
+    """`cached_content_recs` for many products; cache misses are scored in one batch."""
+    cache = data['rec_cache']
+    keys = [('cbf', int(idx), n) for idx in product_indices]
+    results = [cache.get(key) for key in keys]
+    missing = [i for i, r in enumerate(results) if r is None]
+    if missing:
+        count('recs.cbf_cache_miss', len(missing))
+        rows = batch_content_rec_indices(data, [keys[i][1] for i in missing], n)
+        for i, row in zip(missing, rows):
+            results[i] = row.tolist()
+            cache.put(keys[i], results[i], ttl=CBF_CACHE_TTL)
+    return results
+
+
+# --- CANDIDATE GENERATORS ---
+class ContentCandidates(Generator):
+    """Similar products of the profile's strongest items."""
+    name = 'content'
+    requires = ('similarity_index',)
+
+    def __init__(self, per_seed=CONTENT_CANDIDATES, budget=GENERATOR_BUDGETS['content']):
+        super().__init__(budget)
+        self.per_seed = per_seed
+
+    def prepare(self, data, requests):
+        # Every distinct seed of the chunk in one batch call
+        wanted = sorted({p for request in requests for p in request.seeds})
+        if not wanted:
+            return
+        rows = batch_content_rec_indices(data, wanted, self.per_seed).tolist()
+        content = dict(zip(wanted, rows))
+        for request in requests:
+            request.inputs[self.name] = content
+
+    def generate(self, data, request):
+        if not request.seeds:
+            return (), None
+        if self.name in request.inputs:
+            content = request.inputs[self.name]
+            return [p for seed in request.seeds for p in content[seed]], None
+        return batch_content_rec_indices(data, request.seeds, self.per_seed).ravel().tolist(), None
+
+
+class PeerCandidates(Generator):
+    """Item-user-item: what the users who liked the strongest profile item also liked."""
+    name = 'item_user_item'
+    requires = ('like_graph',)
+
+    def __init__(self, peers=PEER_LIMIT, per_peer=PEER_RECS_CAP, min_rating=PEER_MIN_RATING,
+                 budget=GENERATOR_BUDGETS['item_user_item']):
+        super().__init__(budget)
+        self.peers, self.per_peer, self.min_rating = peers, per_peer, min_rating
+
+    def generate(self, data, request):
+        if not request.seeds:
+            return (), None
+        like_graph = data['like_graph']
+        votes = Counter()
+        for peer in like_graph.users_who_liked(request.seeds[0], self.min_rating)[:self.peers]:
+            votes.update(like_graph.liked_by(peer, self.min_rating)[-self.per_peer:].tolist())
+        return (), votes
+
+
+class NeighbourCandidates(Generator):
+    """User-user: the recent likes of the user's nearest neighbours."""
+    name = 'knn'
+    requires = ('like_graph', 'user_matrix')
+
+    def __init__(self, neighbours=KNN_NEIGHBOURS, per_user=KNN_RECS_PER_USER, min_rating=KNN_MIN_RATING,
+                 budget=GENERATOR_BUDGETS['knn']):
+        super().__init__(budget)
+        self.neighbours, self.per_user, self.min_rating = neighbours, per_user, min_rating
+
+    def prepare(self, data, requests):
+        # Nearest neighbours of every known user of the chunk in one call
+        known = [u for u in dict.fromkeys(r.uid for r in requests) if _valid_user(data, u)]
+        if not known:
+            return
+        found = dict(zip(known, data['user_matrix'].neighbours(known, self.neighbours)))
+        for request in requests:
+            if request.uid in found:
+                request.inputs[self.name] = found[request.uid]
+
+    def generate(self, data, request):
+        if self.name in request.inputs:
+            sim_users = request.inputs[self.name]
+        elif _valid_user(data, request.uid):
+            sim_users = data['user_matrix'].neighbours([request.uid], self.neighbours)[0]
+        else:
+            return (), None
+        if sim_users is None:
+            return (), None
+        like_graph = data['like_graph']
+        votes = Counter()
+        for u in sim_users:
+            votes.update(like_graph.liked_by(u, self.min_rating, strict=True)[-self.per_user:].tolist())
+        return (), votes
+
+
+class PopularCandidates(Generator):
+    """Trending products: in the strongest profile item's category, and overall."""
+    name = 'popularity'
+    requires = ('popularity',)
+
+    def __init__(self, n=POPULAR_CANDIDATES, budget=GENERATOR_BUDGETS['popularity']):
+        super().__init__(budget)
+        self.n = n
+
+    def generate(self, data, request):
+        popularity = data['popularity']
+        products = list(popularity.top(self.n))
+        if request.seeds:
+            products += popularity.top(self.n, popularity.category_of(request.seeds[0]))
+        return products, None
+
+
+def make_pipeline(workers=PIPELINE_WORKERS, deadline=PIPELINE_DEADLINE):
+    """The hybrid recommender's generators; workers=0 runs them inline."""
+    return CandidatePipeline([ContentCandidates(), PeerCandidates(), NeighbourCandidates(),
+                              PopularCandidates()], workers=workers, deadline=deadline)
+
+
+# --- HYBRID ---
+def _fill_popular(popularity, recs_idx, seen, anchor, n):
+    """Pad with trending products: the anchor item's category first, then overall."""
+    pools = []
+    if anchor is not None and 0 <= anchor < popularity.n_items:
+        pools.append(popularity.top(category=popularity.category_of(anchor)))
+    pools += [popularity.top(), range(popularity.n_items)]
+    for pool in pools:
+        for p_idx in pool:
+            if p_idx not in seen:
+                recs_idx.append(p_idx)
+                seen.add(p_idx)
+                if len(recs_idx) >= n: return
+
+
+def _rank(data, profile, candidates, votes):
+    """
+    Blend, in one vectorised pass: cosine with the session profile (one
+    sparse product over all candidates), collaborative votes and decayed
+    popularity, each scaled to [0, 1]. Best first, ties by product index.
+    """
+    content = profile.score(data['tfidf_matrix'], candidates)
+    collab = np.fromiter((votes.get(p, 0) for p in candidates.tolist()), dtype=np.float64,
+                         count=len(candidates))
+    popular = data['popularity'].scores[candidates]
+    blended = BLEND_WEIGHTS['content'] * content
+    if collab.max(initial=0) > 0:
+        blended += BLEND_WEIGHTS['collab'] * collab / collab.max()
+    if popular.max(initial=0) > 0:
+        blended += BLEND_WEIGHTS['popularity'] * popular / popular.max()
+    return candidates[np.lexsort((candidates, -blended))]
+
+
+def _assemble(data, request, candidates, votes, n):
+    """One user's hybrid list: the merged candidates ranked, padded with trending products."""
+    with span('recs.rank'):
+        recs_idx = _rank(data, request.profile, candidates, votes)[:n].tolist()
+    if len(recs_idx) < n:
+        count('recs.popular_fill_items', n - len(recs_idx))
+        anchor = request.seeds[0] if request.seeds else None
+        with span('recs.popular_fill'):
+            _fill_popular(data['popularity'], recs_idx, set(request.profile.items) | set(recs_idx), anchor, n)
+    return [int(i) for i in recs_idx[:n]]
+
+
+def _valid_user(data, uid):
+    return data['user_matrix'].known(uid)
+
+
+def hybrid_rec_indices(data, uid, history_items=None, n=12):
+    """Hybrid recommendations for one user, as catalogue row positions."""
+    return _hybrid_recs(data, uid, history_items, n)[0]
+
+
+def _hybrid_recs(data, uid, history_items, n):
+    """(recs, degraded): degraded when a generator was left out of the candidates."""
+    profile = data['session_profiles'].get(uid, history_items)
+    request = RecRequest(uid, profile, profile.seeds(CONTENT_SEEDS))
+    candidates, votes = data['rec_pipeline'].generate(data, request)
+    return _assemble(data, request, candidates, votes, n), request.degraded
+
+
+def cached_hybrid_recs(data, uid, history_items=None, n=12):
+    """
+    `hybrid_rec_indices` cached per (user, recent history); record_interactions
+    invalidates the entries of the acting user and of liked items. A list
+    missing a timed-out or failed generator is served but not cached.
+    """
+    cache = data['rec_cache']
+    key, tags = _hybrid_key(uid, history_items, n)
+    recs_idx = cache.get(key)
+    if recs_idx is None:
+        count('recs.hybrid_cache_miss')
+        recs_idx, degraded = _hybrid_recs(data, uid, history_items, n)
+        _cache_hybrid(cache, key, tags, recs_idx, degraded)
+    return recs_idx
+
+
+def _cache_hybrid(cache, key, tags, recs_idx, degraded):
+    if degraded:
+        count('recs.degraded')
+    else:
+        cache.put(key, recs_idx, tags=tags, ttl=HYBRID_CACHE_TTL)
+
+
+def _hybrid_key(uid, history_items, n):
+    uid = int(uid) if uid is not None else None
+    recent = history_signature(history_items)
+    tags = [('user', uid)] if uid is not None else []
+    tags += [('item', p) for p in recent[-CONTENT_SEEDS:]]
+    return ('hybrid', uid, recent, n), tags
+
+
+def cached_batch_hybrid_recs(data, user_ids, histories=None, n=12):
+    """`cached_hybrid_recs` for many users; cache misses go through one batch call."""
+    cache = data['rec_cache']
+    user_ids = list(user_ids)
+    histories = list(histories) if histories is not None else [None] * len(user_ids)
+    entries = [_hybrid_key(uid, history, n) for uid, history in zip(user_ids, histories)]
+    results = [cache.get(key) for key, _ in entries]
+    missing = [i for i, r in enumerate(results) if r is None]
+    if missing:
+        count('recs.hybrid_cache_miss', len(missing))
+        fresh = _batch_hybrid_recs(data, [user_ids[i] for i in missing],
+                                   [histories[i] for i in missing], n)
+        for i, (recs_idx, degraded) in zip(missing, fresh):
+            results[i] = recs_idx
+            key, tags = entries[i]
+            _cache_hybrid(cache, key, tags, recs_idx, degraded)
+    return results
+
+
+def batch_hybrid_rec_indices(data, user_ids, histories=None, n=12, batch_size=BATCH_USERS):
+    """
+    `hybrid_rec_indices` for many users: `histories[i]` is the view history
+    of `user_ids[i]` (or None). Each generator looks up the content and user
+    neighbours of a chunk of `batch_size` users in one call; returns one
+    list per user.
+    """
+    return [recs_idx for recs_idx, _ in _batch_hybrid_recs(data, user_ids, histories, n, batch_size)]
+
+
+def _batch_hybrid_recs(data, user_ids, histories=None, n=12, batch_size=BATCH_USERS):
+    """(recs, degraded) per user, as `_hybrid_recs`."""
+    user_ids = list(user_ids)
+    histories = list(histories) if histories is not None else [None] * len(user_ids)
+    pipeline = data['rec_pipeline']
+    results = []
+    for start in range(0, len(user_ids), batch_size):
+        requests = []
+        for uid, history in zip(user_ids[start:start + batch_size], histories[start:start + batch_size]):
+            profile = data['session_profiles'].get(uid, history)
+            requests.append(RecRequest(uid, profile, profile.seeds(CONTENT_SEEDS)))
+        for request, (candidates, votes) in zip(requests, pipeline.generate_batch(data, requests)):
+            results.append((_assemble(data, request, candidates, votes, n), request.degraded))
+    return results
+
+
+# --- INTERACTIONS ---
+def record_interactions(data, user_id, product_indices, rating):
+    """
+    One log append for several products (e.g. every item of an order), kept
+    in the like graph and reflected in the cache straight away.
+    """
+    user_ids, ratings = [user_id] * len(product_indices), [rating] * len(product_indices)
+    with span('recs.record_interaction'):
+        # Before the log append: a profile rebuilt from the log must not see these twice
+        data['session_profiles'].add(user_id, product_indices, ratings)
+        data['interaction_log'].extend(user_ids, product_indices, ratings)
+        data['like_graph'].add(user_ids, product_indices, ratings)
+        data['user_matrix'].add(user_ids, product_indices, ratings)
+        data['popularity'].add(product_indices, ratings)
+        # Drop cached recs built from the user's state or from these items' fan base
+        tags = [('user', int(user_id))]
+        if rating > EDGE_MIN_RATING:
+            tags += [('item', int(p)) for p in product_indices]
+        data['rec_cache'].invalidate(*tags)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch ShopSense recommendations.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--users', nargs='*', metavar='USERNAME',
+                        help="Hybrid recs for these accounts (all accounts if none given)")
+    target.add_argument('--items', nargs='+', type=int, metavar='IDX',
+                        help="Similar products for these catalogue rows")
+    target.add_argument('--all-items', action='store_true', help="Similar products for every product")
+    parser.add_argument('--n', type=int, default=10)
+    parser.add_argument('--root', default=ARTIFACT_DIR)
+    parser.add_argument('--out', help="CSV output path (default: stdout)")
+    args = parser.parse_args()
+
+    data = open_data(args.root)
+    if args.users is not None:
+        from user_store import open_user_store
+        accounts = open_user_store().all_users()
+        names = args.users or sorted(accounts)
+        names = [name for name in names if name in accounts]
+        recs = batch_hybrid_rec_indices(data, [int(accounts[u]['id']) for u in names],
+                                        [accounts[u].get('history') for u in names], args.n)
+        keys, key_name = names, 'username'
+    else:
+        rows = np.arange(data['tfidf_matrix'].shape[0]) if args.all_items else np.asarray(args.items)
+        recs = batch_content_rec_indices(data, rows, args.n)
+        keys, key_name = rows.tolist(), 'product_index'
+
+    out = pd.DataFrame([{key_name: key, 'rank': rank, 'recommended_index': int(p)}
+                        for key, row in zip(keys, recs) for rank, p in enumerate(row, 1)])
+    out.to_csv(args.out or sys.stdout, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Product Search Index
+
+Tokenised inverted index over the catalogue text fields, built once at load
+time. Queries are stemmed (nltk Porter stemmer), the last word may be a
+prefix of a longer term (search-as-you-type), postings are intersected with
+the category filter and the matches are ranked with BM25. Results are row
+positions into the dataframe, so callers never copy or scan it.
+"""
+import re
+import bisect
+import numpy as np
+import pandas as pd
+from nltk.stem import PorterStemmer
+
+SEARCH_FIELDS = ['name', 'category', 'main_category']
+TOKEN_RE = r'[a-z0-9]+'
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# Cap on how many vocabulary terms one prefix may expand to (the most frequent ones)
+MAX_PREFIX_TERMS = 64
+
+
+class SearchIndex:
+    """
+    CSR-style inverted index: the postings of term t are
+    `post_docs[term_ptr[t]:term_ptr[t+1]]` (sorted row positions) with their
+    precomputed BM25 weights in `post_weights`.
+    """
+
+    def __init__(self, df, fields=SEARCH_FIELDS):
+        self.n_docs = len(df)
+        self._stemmer = PorterStemmer()
+        self._stem_cache = {}
+        fields = [c for c in fields if c in df.columns]
+
+        # 1. Tokenise every row (row position -> surface tokens)
+        text = pd.Series([''] * self.n_docs, dtype=object)
+        for col in fields:
+            text = text + ' ' + df[col].astype(str).str.lower().reset_index(drop=True)
+        tokens = text.str.findall(TOKEN_RE).explode().dropna()
+        docs = tokens.index.to_numpy(dtype=np.int64)
+
+        # 2. Stem each distinct surface token once
+        surface, surface_codes = np.unique(tokens.to_numpy(dtype=str), return_inverse=True)
+        stems = np.array([self._stem(t) for t in surface], dtype=object)
+        self.terms, surface_term = np.unique(stems.astype(str), return_inverse=True)
+        term_ids = surface_term[surface_codes]
+        self._term_lookup = {t: i for i, t in enumerate(self.terms)}
+        # Sorted surface vocabulary for prefix matching
+        self._surface = surface.tolist()
+        self._surface_term = surface_term
+
+        # 3. Postings with term frequencies, grouped by term then row
+        keys, tf = np.unique(term_ids * self.n_docs + docs, return_counts=True)
+        post_terms = keys // self.n_docs
+        self.post_docs = (keys % self.n_docs).astype(np.int32)
+        self.term_ptr = np.searchsorted(post_terms, np.arange(len(self.terms) + 1)).astype(np.int64)
+
+        # 4. BM25 weight per posting
+        doc_len = np.bincount(docs, minlength=self.n_docs).astype(np.float32)
+        avg_len = max(float(doc_len.mean()), 1.0) if self.n_docs else 1.0
+        df_t = np.diff(self.term_ptr).astype(np.float32)
+        idf = np.log(1.0 + (self.n_docs - df_t + 0.5) / (df_t + 0.5))
+        norm = K1 * (1.0 - B + B * doc_len[self.post_docs] / avg_len)
+        self.post_weights = (idf[post_terms] * tf * (K1 + 1.0) / (tf + norm)).astype(np.float32)
+
+        # 5. Category postings for the filter
+        self.category_rows = {}
+        if 'category' in df.columns:
+            codes, cats = pd.factorize(df['category'], sort=True)
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(cats) + 1))
+            for i, cat in enumerate(cats):
+                self.category_rows[cat] = order[bounds[i]:bounds[i + 1]].astype(np.int32)
+
+    def _stem(self, token):
+        stem = self._stem_cache.get(token)
+        if stem is None:
+            stem = self._stemmer.stem(token)
+            self._stem_cache[token] = stem
+        return stem
+
+    def _expand(self, token, prefix):
+        """
+        Vocabulary term ids a query token matches: its own stem, plus (for a
+        prefix) the stems of the indexed words starting with it, the
+        MAX_PREFIX_TERMS found in most products when there are more.
+        """
+        ids = set()
+        exact = self._term_lookup.get(self._stem(token))
+        if exact is not None:
+            ids.add(exact)
+        if prefix:
+            lo = bisect.bisect_left(self._surface, token)
+            hi = bisect.bisect_left(self._surface, token + '\uffff', lo)
+            candidates = np.unique(self._surface_term[lo:hi])
+            if len(candidates) > MAX_PREFIX_TERMS:
+                doc_freq = self.term_ptr[candidates + 1] - self.term_ptr[candidates]
+                candidates = candidates[np.lexsort((candidates, -doc_freq))[:MAX_PREFIX_TERMS]]
+            ids.update(candidates.tolist())
+        return ids
+
+    def _token_scores(self, term_ids):
+        """
+        Rows matching any of the given terms with their best BM25 weight.
+        """
+        if not term_ids:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        spans = [(self.term_ptr[t], self.term_ptr[t + 1]) for t in term_ids]
+        docs = np.concatenate([self.post_docs[a:b] for a, b in spans])
+        weights = np.concatenate([self.post_weights[a:b] for a, b in spans])
+        if len(spans) == 1:
+            return docs, weights
+        order = np.lexsort((-weights, docs))
+        docs, weights = docs[order], weights[order]
+        first = np.ones(len(docs), dtype=bool)
+        first[1:] = docs[1:] != docs[:-1]
+        return docs[first], weights[first]
+
+    def search(self, query, category=None, limit=None):
+        """
+        Ranked row positions matching every word of `query` (the last word
+        may be a prefix), restricted to `category` when given. With no query
+        the category rows (or the whole catalogue) come back in catalogue order.
+        """
+        words = re.findall(TOKEN_RE, (query or '').lower())
+        cat_rows = None
+        if category is not None:
+            cat_rows = self.category_rows.get(category, np.empty(0, dtype=np.int32))
+
+        if not words:
+            rows = cat_rows if cat_rows is not None else np.arange(self.n_docs, dtype=np.int32)
+            return rows[:limit] if limit is not None else rows
+
+        rows, scores = None, None
+        for i, word in enumerate(words):
+            docs, weights = self._token_scores(self._expand(word, prefix=(i == len(words) - 1)))
+            if rows is None:
+                rows, scores = docs, weights
+            else:
+                rows, a, b = np.intersect1d(rows, docs, assume_unique=True, return_indices=True)
+                scores = scores[a] + weights[b]
+            if cat_rows is not None:
+                rows, a, _ = np.intersect1d(rows, cat_rows, assume_unique=True, return_indices=True)
+                scores = scores[a]
+                cat_rows = None
+            if len(rows) == 0:
+                break
+
+        order = np.lexsort((rows, -scores))
+        ranked = rows[order]
+        return ranked[:limit] if limit is not None else ranked
@@ -0,0 +1,298 @@
+"""
+ShopSense Recommendation Server
+
+Serves the engine over HTTP so several front-ends share one warm model
+process. Stdlib asyncio only: the event loop parses requests and hands
+the work to a thread pool; concurrent recommendation requests arriving
+within a few milliseconds of each other are merged into one batch call
+(one sparse product / one neighbour lookup for the whole batch).
+
+    GET /recs/item?idx=12&n=6
+    GET /recs/user?user_id=42&history=12,40&n=10    (or ?username=alice)
+    GET /search?q=wireless+head&category=Headphones&limit=20&offset=0
+        &main_category=...&price=RM50-100&min_rating=4    (optional facets)
+    GET /trending?n=10&category=Headphones
+    GET /health
+    GET /metrics                                    (Prometheus text)
+
+Add `fields=index` for bare row positions instead of product records.
+
+    python server.py --port 8765 --workers 4
+"""
+import json
+import time
+import asyncio
+import argparse
+from functools import partial
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+from engine import Engine
+from metrics import METRICS, count
+
+MAX_BATCH = 64
+BATCH_WINDOW = 0.004  # seconds a request may wait for others to join its batch
+MAX_HEADER_BYTES = 16 * 1024
+DEFAULT_LIMIT = 40
+MAX_RESULTS = 100      # cap on n / limit; larger lists bypass the top-K tables
+MAX_OFFSET = 10_000
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class MicroBatcher:
+    """
+    Collects submitted items for up to `window` seconds (or `max_batch`
+    items) and runs `fn(items)` once on the executor; `fn` returns one
+    result per item.
+    """
+
+    def __init__(self, fn, executor, max_batch=MAX_BATCH, window=BATCH_WINDOW, name='batch'):
+        self.fn = fn
+        self.executor = executor
+        self.max_batch = max_batch
+        self.window = window
+        self.name = name
+        self._pending = []
+        self._timer = None
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        loop = asyncio.get_running_loop()
+        count(f"server.{self.name}es")
+        count(f"server.{self.name}_requests", len(batch))
+        try:
+            results = await loop.run_in_executor(self.executor, self.fn, [item for item, _ in batch])
+        except Exception as exc:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+def _grouped(fn, items):
+    """Run `fn(keys, n)` once per distinct n over (key, n) items, keeping input order."""
+    results = [None] * len(items)
+    by_n = {}
+    for i, (key, n) in enumerate(items):
+        by_n.setdefault(n, []).append(i)
+    for n, positions in by_n.items():
+        for i, result in zip(positions, fn([items[i][0] for i in positions], n)):
+            results[i] = result
+    return results
+
+
+class RecServer:
+    def __init__(self, engine, workers=4, max_batch=MAX_BATCH, window=BATCH_WINDOW):
+        self.engine = engine
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='rec-worker')
+        self.item_batcher = MicroBatcher(partial(_grouped, engine.item_recs_batch), self.executor,
+                                         max_batch, window, name='item_batch')
+        self.user_batcher = MicroBatcher(self._user_batch, self.executor, max_batch, window,
+                                         name='user_batch')
+
+    def _user_batch(self, items):
+        # items: ((user_id, history), n)
+        def run(keys, n):
+            return self.engine.user_recs_batch([k[0] for k in keys], [k[1] for k in keys], n)
+        return _grouped(run, [((uid, tuple(history)), n) for (uid, history), n in items])
+
+    # --- HANDLERS ---
+    async def recs_item(self, params):
+        idx = _int(params, 'idx', required=True)
+        if not 0 <= idx < len(self.engine.df):
+            raise HTTPError(404, f"unknown product {idx}")
+        return await self.item_batcher.submit((idx, _int(params, 'n', 6, lo=1, hi=MAX_RESULTS)))
+
+    async def recs_user(self, params):
+        if 'username' in params:
+            account = await self._in_pool(self.engine.account, params['username'])
+            if account is None:
+                raise HTTPError(404, "unknown username")
+            user_id, history = account
+        else:
+            user_id = _int(params, 'user_id', required=True)
+            history = [int(h) for h in params.get('history', '').split(',') if h.strip()]
+        n = _int(params, 'n', 12, lo=1, hi=MAX_RESULTS)
+        return await self.user_batcher.submit(((user_id, history), n))
+
+    async def search(self, params):
+        offset = _int(params, 'offset', 0, lo=0, hi=MAX_OFFSET)
+        limit = _int(params, 'limit', DEFAULT_LIMIT, lo=1, hi=MAX_RESULTS)
+        if any(params.get(f) for f in ('main_category', 'price', 'min_rating')):
+            selection = {'main_category': params.get('main_category') or None,
+                         'category': params.get('category') or None,
+                         'price': params.get('price') or None,
+                         'rating': _float(params, 'min_rating')}
+            rows, _ = await self._in_pool(self.engine.filtered_search, params.get('q', ''), selection)
+            return rows[offset:offset + limit]
+        rows = await self._in_pool(self.engine.search, params.get('q', ''), params.get('category') or None,
+                                   offset + limit)
+        return rows[offset:offset + limit]
+
+    async def trending(self, params):
+        n = _int(params, 'n', 10, lo=1, hi=MAX_RESULTS)
+        return self.engine.trending(n, params.get('category') or None)
+
+    async def _in_pool(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    ROUTES = {'/recs/item': 'recs_item', '/recs/user': 'recs_user', '/search': 'search',
+              '/trending': 'trending'}
+
+    async def dispatch(self, method, target):
+        url = urlsplit(target)
+        if url.path == '/health':
+            return 200, 'application/json', b'{"status": "ok"}'
+        if url.path == '/metrics':
+            return 200, 'text/plain; version=0.0.4', METRICS.prometheus_text().encode()
+        if url.path not in self.ROUTES:
+            raise HTTPError(404, "not found")
+        if method != 'GET':
+            raise HTTPError(405, "only GET is supported")
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        # Timed by hand: span() nesting is per thread, and coroutines interleave
+        started = time.perf_counter()
+        rows = await getattr(self, self.ROUTES[url.path])(params)
+        if params.get('fields') == 'index':
+            body = {'items': [int(r) for r in rows]}
+        else:
+            body = {'items': await self._in_pool(self.engine.products, list(rows))}
+        METRICS.observe(f"server{url.path.replace('/', '.')}", time.perf_counter() - started)
+        return 200, 'application/json', json.dumps(body).encode()
+
+    # --- HTTP ---
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._respond(writer, 431, 'text/plain', b'headers too large', False)
+                    break
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split(' ', 2)
+                except ValueError:
+                    await self._respond(writer, 400, 'text/plain', b'bad request', False)
+                    break
+                headers = {k.strip().lower(): v.strip() for k, _, v in
+                           (line.partition(':') for line in lines[1:] if line)}
+                length = int(headers.get('content-length') or 0)
+                if length:
+                    await reader.readexactly(length)  # bodies are not used
+                keep_alive = (headers.get('connection', '').lower() != 'close'
+                              and version.upper() == 'HTTP/1.1')
+                try:
+                    status, ctype, body = await self.dispatch(method.upper(), target)
+                except HTTPError as exc:
+                    status, ctype, body = exc.status, 'application/json', json.dumps(
+                        {'error': str(exc)}).encode()
+                except Exception as exc:
+                    count('server.errors')
+                    status, ctype, body = 500, 'application/json', json.dumps(
+                        {'error': type(exc).__name__}).encode()
+                await self._respond(writer, status, ctype, body, keep_alive)
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status, ctype, body, keep_alive):
+        reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                  431: 'Request Header Fields Too Large', 500: 'Internal Server Error'}.get(status, '')
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: {ctype}\r\n"
+                     f"Content-Length: {len(body)}\r\n"
+                     f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body)
+        await writer.drain()
+
+    async def serve(self, host='127.0.0.1', port=8765):
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_HEADER_BYTES)
+        async with server:
+            await server.serve_forever()
+
+
+def _int(params, name, default=None, required=False, lo=None, hi=None):
+    if name not in params:
+        if required:
+            raise HTTPError(400, f"missing '{name}'")
+        return default
+    try:
+        value = int(params[name])
+    except ValueError:
+        raise HTTPError(400, f"'{name}' must be an integer")
+    if lo is not None and value < lo:
+        raise HTTPError(400, f"'{name}' must be at least {lo}")
+    if hi is not None and value > hi:
+        raise HTTPError(400, f"'{name}' must be at most {hi}")
+    return value
+
+
+def _float(params, name, default=None):
+    if not params.get(name):
+        return default
+    try:
+        return float(params[name])
+    except ValueError:
+        raise HTTPError(400, f"'{name}' must be a number")
+
+
+def warm_up(engine):
+    """Load every component a request can touch before accepting traffic."""
+    for name in ('similarity_index', 'search_index', 'facet_index', 'like_graph', 'user_matrix',
+                 'popularity', 'session_profiles', 'rec_pipeline', 'rec_cache'):
+        engine.data[name]
+    engine.df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve ShopSense recommendations over HTTP.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=4, help="Worker threads")
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH)
+    parser.add_argument('--batch-window-ms', type=float, default=BATCH_WINDOW * 1000)
+    args = parser.parse_args()
+
+    engine = Engine.open()
+    warm_up(engine)
+    server = RecServer(engine, workers=args.workers, max_batch=args.max_batch,
+                       window=args.batch_window_ms / 1000)
+    print(f"Serving on http://{args.host}:{args.port}", flush=True)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+"""
+Precomputed Top-K Content Similarity Index
+
+Stores the K most similar products (by TF-IDF cosine) for every product so
+the product page and the content-based step of the hybrid recommender can
+answer with a row lookup instead of scoring the whole catalogue per request.
+
+Build / refresh offline:
+    python similarity_index.py                 # full build
+    python similarity_index.py --refresh 12 57 # re-score changed products only
+"""
+import os
+import zlib
+import argparse
+import pickle
+import numpy as np
+from sklearn.metrics.pairwise import linear_kernel
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_FILE = os.path.join(BASE_DIR, 'shop_sense_data.pkl')
+TOPK_FILE = os.path.join(BASE_DIR, 'shop_sense_topk.npz')
+
+DEFAULT_K = 20
+# Upper bound on dense similarity cells scored at once (~ 160MB of float64)
+MAX_BLOCK_CELLS = 20_000_000
+
+
+def matrix_fingerprint(tfidf_matrix):
+    """
+    Identity check for a CSR matrix, used to detect a stale index: row
+    lengths, terms and weights all count, so a re-vectorised or re-weighted
+    matrix with the same shape and nnz is still told apart. The arrays are
+    hashed in place, in their own dtype. Artifact builds record the result
+    in their manifest, so only the standalone .npz path hashes at load.
+    """
+    crc = 0
+    for part in (tfidf_matrix.indptr, tfidf_matrix.indices, tfidf_matrix.data):
+        crc = zlib.crc32(np.ascontiguousarray(part), crc)
+    return f"{tfidf_matrix.shape[0]}x{tfidf_matrix.shape[1]}:{tfidf_matrix.nnz}:{crc:08x}"
+
+
+def _block_rows(n_items):
+    return max(1, MAX_BLOCK_CELLS // max(n_items, 1))
+
+
+def _top_k_rows(sims, row_ids, k):
+    """
+    Top-k columns of each row of a dense similarity block, best first.
+    Ties are broken by lower product index, matching a stable descending sort.
+    """
+    n_rows, n_items = sims.shape
+    sims[np.arange(n_rows), row_ids] = -np.inf  # never recommend the item itself
+    k = min(k, n_items - 1)
+    if k <= 0:
+        return np.empty((n_rows, 0), dtype=np.int32), np.empty((n_rows, 0), dtype=np.float32)
+
+    part = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    part_scores = np.take_along_axis(sims, part, axis=1)
+    order = np.lexsort((part, -part_scores), axis=1)
+    top = np.take_along_axis(part, order, axis=1)
+    return top.astype(np.int32), np.take_along_axis(part_scores, order, axis=1).astype(np.float32)
+
+
+def exact_neighbours(tfidf_matrix, idx, n):
+    """
+    Fallback path: score one product against the catalogue and keep the best n
+    with argpartition (O(N)) rather than a full sort.
+    """
+    return batch_exact_neighbours(tfidf_matrix, [idx], n)[0].tolist()
+
+
+def batch_exact_neighbours(tfidf_matrix, rows, n):
+    """
+    The n most similar products for each of `rows`: one sparse
+    matrix-matrix product per block of rows, blocks sized to bound memory.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    n_items = tfidf_matrix.shape[0]
+    out = np.empty((len(rows), max(min(n, n_items - 1), 0)), dtype=np.int32)
+    step = _block_rows(n_items)
+    for start in range(0, len(rows), step):
+        block = rows[start:start + step]
+        sims = linear_kernel(tfidf_matrix[block], tfidf_matrix)
+        out[start:start + step], _ = _top_k_rows(sims, block, n)
+    return out
+
+
+class SimilarityIndex:
+    """
+    Top-K neighbour table: `indices[i]` holds the K most similar products to
+    product i (best first) and `scores[i]` their cosine similarities.
+    """
+
+    def __init__(self, tfidf_matrix, indices=None, scores=None, fingerprint=None,
+                 known_fingerprint=None):
+        """known_fingerprint: that of tfidf_matrix, if recorded (saves hashing it)."""
+        self.tfidf_matrix = tfidf_matrix
+        self.indices = indices
+        self.scores = scores
+        self.fingerprint = fingerprint
+        self.known_fingerprint = known_fingerprint
+        self._fresh = None
+
+    @property
+    def k(self):
+        return 0 if self.indices is None else self.indices.shape[1]
+
+    @property
+    def is_fresh(self):
+        # Checked once per matrix; refresh() resets it
+        if self._fresh is None:
+            self._fresh = (
+                self.indices is not None
+                and self.indices.shape[0] == self.tfidf_matrix.shape[0]
+                and self.fingerprint == (self.known_fingerprint or matrix_fingerprint(self.tfidf_matrix))
+            )
+        return self._fresh
+
+    # --- BUILD ---
+    @classmethod
+    def build(cls, tfidf_matrix, k=DEFAULT_K):
+        n_items = tfidf_matrix.shape[0]
+        k = min(k, max(n_items - 1, 0))
+        indices = np.empty((n_items, k), dtype=np.int32)
+        scores = np.empty((n_items, k), dtype=np.float32)
+
+        step = _block_rows(n_items)
+        for start in range(0, n_items, step):
+            end = min(start + step, n_items)
+            sims = linear_kernel(tfidf_matrix[start:end], tfidf_matrix)
+            indices[start:end], scores[start:end] = _top_k_rows(sims, np.arange(start, end), k)
+
+        return cls(tfidf_matrix, indices, scores, matrix_fingerprint(tfidf_matrix))
+
+    def refresh(self, changed, tfidf_matrix=None):
+        """
+        Incremental refresh after products were added or re-vectorised.
+        Re-scores the changed rows, merges them into the lists of every other
+        product they now rank for, and re-scores only the lists that held a
+        changed product, without rebuilding the whole table.
+        """
+        if tfidf_matrix is not None:
+            self.tfidf_matrix = tfidf_matrix
+        self.known_fingerprint = None
+        self._fresh = None
+        if self.indices is None:
+            fresh = self.build(self.tfidf_matrix)
+            self.indices, self.scores, self.fingerprint = fresh.indices, fresh.scores, fresh.fingerprint
+            return
+
+        n_items = self.tfidf_matrix.shape[0]
+        k = self.k
+        if k == 0:
+            return
+        old_n = self.indices.shape[0]
+        changed = set(int(c) for c in changed) | set(range(old_n, n_items))
+        changed = np.array(sorted(changed), dtype=np.int64)
+        if len(changed) == 0:
+            self.fingerprint = matrix_fingerprint(self.tfidf_matrix)
+            return
+
+        # Grow the table for newly appended products
+        if n_items > old_n:
+            pad_i = np.zeros((n_items - old_n, k), dtype=np.int32)
+            pad_s = np.full((n_items - old_n, k), -np.inf, dtype=np.float32)
+            self.indices = np.vstack([self.indices, pad_i])
+            self.scores = np.vstack([self.scores, pad_s])
+
+        is_changed = np.zeros(n_items, dtype=bool)
+        is_changed[changed] = True
+        rescore = np.zeros(n_items, dtype=bool)
+        step = _block_rows(n_items)
+        for start in range(0, len(changed), step):
+            rows = changed[start:start + step]
+            sims = linear_kernel(self.tfidf_matrix[rows], self.tfidf_matrix)
+
+            # 1. Changed products get a fresh top-K list
+            self.indices[rows], self.scores[rows] = _top_k_rows(sims.copy(), rows, k)
+
+            # 2. Everyone else: merge changed products into their lists
+            others = np.flatnonzero(~is_changed)
+            if len(others) == 0:
+                continue
+            # Lists that already contain a changed product hold a stale score
+            # for it; those rows are simply re-scored in full below.
+            stale = np.isin(self.indices[others], rows).any(axis=1)
+            rescore[others[stale]] = True
+
+            col = sims[:, others].T  # (others, len(rows))
+            touched = (col.max(axis=1) > self.scores[others, -1]) & ~stale & ~rescore[others]
+            if not touched.any():
+                continue
+            sel = others[touched]
+            c_idx = np.hstack([self.indices[sel], np.broadcast_to(rows, (len(sel), len(rows)))])
+            c_sc = np.hstack([self.scores[sel], col[touched].astype(np.float32)])
+            order = np.lexsort((c_idx, -c_sc), axis=1)[:, :k]
+            self.indices[sel] = np.take_along_axis(c_idx, order, axis=1)
+            self.scores[sel] = np.take_along_axis(c_sc, order, axis=1)
+
+        rescore = np.flatnonzero(rescore)
+        for start in range(0, len(rescore), step):
+            rows = rescore[start:start + step]
+            sims = linear_kernel(self.tfidf_matrix[rows], self.tfidf_matrix)
+            self.indices[rows], self.scores[rows] = _top_k_rows(sims, rows, k)
+
+        self.fingerprint = matrix_fingerprint(self.tfidf_matrix)
+
+    # --- QUERY ---
+    def neighbours(self, idx, n):
+        """
+        The n most similar products to `idx`, best first. O(n) from the table
+        when the index is fresh and deep enough, otherwise an exact fallback.
+        """
+        if self.is_fresh and n <= self.k:
+            return self.indices[idx, :n].tolist()
+        return exact_neighbours(self.tfidf_matrix, idx, n)
+
+    def batch_neighbours(self, rows, n):
+        """`neighbours()` for many products at once, as an (len(rows), n) array."""
+        if self.is_fresh and n <= self.k:
+            return np.asarray(self.indices[np.asarray(rows), :n])
+        return batch_exact_neighbours(self.tfidf_matrix, rows, n)
+
+    # --- PERSISTENCE ---
+    def save(self, path=TOPK_FILE):
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, indices=self.indices, scores=self.scores,
+                 fingerprint=np.array(self.fingerprint))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, tfidf_matrix, path=TOPK_FILE):
+        """
+        Load the table stored next to the data pack. A missing or unreadable
+        file yields an empty index that answers through the exact fallback.
+        """
+        try:
+            with np.load(path) as npz:
+                return cls(tfidf_matrix, npz['indices'], npz['scores'], str(npz['fingerprint']))
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            return cls(tfidf_matrix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the top-K similar-items index.")
+    parser.add_argument('--data', default=DATA_FILE, help="Path to shop_sense_data.pkl")
+    parser.add_argument('--out', default=TOPK_FILE, help="Output .npz path")
+    parser.add_argument('--k', type=int, default=DEFAULT_K, help="Neighbours kept per product")
+    parser.add_argument('--refresh', type=int, nargs='*', metavar='IDX',
+                        help="Only re-score these product indices (plus any new products)")
+    args = parser.parse_args()
+
+    with open(args.data, 'rb') as f:
+        tfidf_matrix = pickle.load(f)['tfidf_matrix'].tocsr()
+
+    if args.refresh is not None:
+        index = SimilarityIndex.load(tfidf_matrix, args.out)
+        index.refresh(args.refresh)
+    else:
+        index = SimilarityIndex.build(tfidf_matrix, k=args.k)
+    index.save(args.out)
+    print(f"Saved top-{index.k} index for {tfidf_matrix.shape[0]} products -> {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+"""
+Online User-Item Matrix
+
+The user-item matrix and the user neighbour index, kept current while the
+app runs instead of frozen at whatever the build shipped:
+
+- User IDs map to matrix rows. An ID inside the built matrix belongs to
+  the build's user of that row (builds index rows by user ID); any other ID
+  gets the next free row on its first interaction. New accounts get
+  sequential IDs from `next_user_id()`, and legacy accounts whose random ID
+  fell inside the matrix are re-numbered when user_store imports them, so
+  no account reads another user's row.
+- Every recorded interaction lands in a small per-row overlay (max rating
+  per product, as in the build), so a user's vector is current at once.
+- A background thread folds the overlay into a new CSR matrix and rebuilds
+  the neighbour index every `REINDEX_INTERVAL` seconds when something
+  changed, then swaps both in together. Requests keep reading the previous
+  snapshot (plus the overlay) meanwhile and never wait for a rebuild.
+
+Fold the interactions logged since the build into the matrix and time one
+rebuild:
+
+    python user_matrix.py --reindex
+"""
+import time
+import argparse
+import threading
+import numpy as np
+from scipy.sparse import csr_matrix, coo_matrix
+
+from metrics import span, count
+
+REINDEX_INTERVAL = 60.0  # seconds between background rebuilds
+REINDEX_MIN_CHANGES = 1  # overlay entries needed to trigger one
+
+
+class UserMatrix:
+    """
+    `build_search(matrix)` returns a neighbour search (see neighbour_search.py)
+    over a user-item matrix; `search` is the one already built for `matrix`.
+    """
+
+    def __init__(self, matrix, search, build_search, reindex_interval=REINDEX_INTERVAL,
+                 min_changes=REINDEX_MIN_CHANGES):
+        matrix = matrix.tocsr()
+        self.base_rows, self.n_items = matrix.shape
+        self.build_search = build_search
+        self.reindex_interval = reindex_interval
+        self.min_changes = min_changes
+        self._lock = threading.Lock()
+        self._reindex_lock = threading.Lock()
+        self._state = (matrix, search)
+        self._extra_rows = {}  # user id -> row, for IDs outside the built matrix
+        self._row_ids = []     # user id of row base_rows + i
+        self._overlay = {}     # row -> {product: rating} not yet in the matrix
+        self._changes = 0
+        self._next_id = self.base_rows
+        self._stop = threading.Event()
+        self._thread = None
+
+    # --- IDS ---
+    def row(self, user_id):
+        """Matrix row of a user, or None if they have never interacted."""
+        if user_id is None:
+            return None
+        user_id = int(user_id)
+        if 0 <= user_id < self.base_rows:
+            return user_id
+        return self._extra_rows.get(user_id)
+
+    def _row_for_update(self, user_id):
+        row = self.row(user_id)
+        if row is None:
+            row = self.base_rows + len(self._row_ids)
+            self._extra_rows[user_id] = row
+            self._row_ids.append(user_id)
+        return row
+
+    def user_ids(self, rows):
+        """User IDs of matrix rows."""
+        rows = np.asarray(rows, dtype=np.int64)
+        extra = rows >= self.base_rows
+        if not extra.any():
+            return rows
+        ids = rows.copy()
+        ids[extra] = np.asarray(self._row_ids, dtype=np.int64)[rows[extra] - self.base_rows]
+        return ids
+
+    def next_user_id(self):
+        """Smallest ID above the built matrix and every user seen since."""
+        return self._next_id
+
+    @property
+    def n_users(self):
+        return self.base_rows + len(self._row_ids)
+
+    # --- WRITES ---
+    def add(self, user_ids, product_idxs, ratings):
+        """Fold interactions into the overlay; visible to the next query."""
+        with self._lock:
+            for uid, product, rating in zip(user_ids, product_idxs, ratings):
+                uid, product, rating = int(uid), int(product), float(rating)
+                entries = self._overlay.setdefault(self._row_for_update(uid), {})
+                if rating > entries.get(product, -np.inf):
+                    entries[product] = rating
+                    self._changes += 1
+                self._next_id = max(self._next_id, uid + 1)
+
+    # --- READS ---
+    def known(self, user_id):
+        return self.row(user_id) is not None
+
+    def vectors(self, user_ids):
+        """Current (len(user_ids), n_items) CSR rows; unknown users get empty rows."""
+        with self._lock:
+            matrix, _ = self._state
+            rows = [self.row(uid) for uid in user_ids]
+            overlay = {r: dict(self._overlay[r]) for r in rows if r in self._overlay}
+        if not overlay and all(r is not None and r < matrix.shape[0] for r in rows):
+            return matrix[rows]
+
+        indptr, cols, vals = [0], [], []
+        for r in rows:
+            entries = {}
+            if r is not None and r < matrix.shape[0]:
+                lo, hi = matrix.indptr[r], matrix.indptr[r + 1]
+                entries = dict(zip(matrix.indices[lo:hi].tolist(), matrix.data[lo:hi].tolist()))
+            for product, rating in overlay.get(r, {}).items():
+                if rating > entries.get(product, -np.inf):
+                    entries[product] = rating
+            products = sorted(entries)
+            cols.extend(products)
+            vals.extend(entries[p] for p in products)
+            indptr.append(len(cols))
+        return csr_matrix((np.asarray(vals, dtype=matrix.dtype), np.asarray(cols, dtype=np.int32),
+                           np.asarray(indptr)), shape=(len(rows), self.n_items))
+
+    def neighbours(self, user_ids, n_neighbors):
+        """
+        Nearest other users of each user as a user-ID array (at most
+        n_neighbors - 1, the user themselves excluded), or None for users
+        without any interaction.
+        """
+        user_ids = list(user_ids)
+        vecs = self.vectors(user_ids)
+        active = np.flatnonzero(np.diff(vecs.indptr) > 0)
+        results = [None] * len(user_ids)
+        if len(active) == 0:
+            return results
+        _, search = self._state
+        found = search.kneighbors_batch(vecs[active], n_neighbors)
+        for i, rows in zip(active, found):
+            own = self.row(user_ids[i])
+            rows = np.asarray(rows)
+            rows = rows[rows != own] if own in rows else rows[:n_neighbors - 1]
+            results[i] = self.user_ids(rows[:n_neighbors - 1])
+        return results
+
+    def snapshot(self):
+        """The matrix the neighbour index was last built from."""
+        return self._state[0]
+
+    # --- REINDEX ---
+    def reindex(self, force=False):
+        """
+        Fold the overlay into a new matrix and rebuild the neighbour index,
+        then swap both in. Returns False when there was nothing to fold.
+        """
+        with self._reindex_lock:
+            with self._lock:
+                matrix, _ = self._state
+                if not force and self._changes < self.min_changes:
+                    return False
+                folded = {r: dict(entries) for r, entries in self._overlay.items()}
+                n_rows = self.n_users
+                self._changes = 0
+
+            with span('users.reindex'):
+                grown = csr_matrix(matrix, copy=True)
+                grown.resize((n_rows, self.n_items))
+                if folded:
+                    rows = [r for r, entries in folded.items() for _ in entries]
+                    cols = [p for entries in folded.values() for p in entries]
+                    vals = [v for entries in folded.values() for v in entries.values()]
+                    delta = coo_matrix((np.asarray(vals, dtype=matrix.dtype), (rows, cols)),
+                                       shape=(n_rows, self.n_items))
+                    grown = grown.maximum(delta.tocsr()).tocsr()
+                search = self.build_search(grown)
+
+            with self._lock:
+                self._state = (grown, search)
+                # Keep overlay entries that changed while the rebuild ran
+                for r, entries in folded.items():
+                    live = self._overlay.get(r)
+                    if live is None:
+                        continue
+                    for product, rating in entries.items():
+                        if live.get(product) == rating:
+                            del live[product]
+                    if not live:
+                        del self._overlay[r]
+            count('users.reindexes')
+            return True
+
+    def start(self):
+        """Rebuild in a background thread every `reindex_interval` seconds."""
+        if self._thread is None and self.reindex_interval:
+            self._thread = threading.Thread(target=self._reindex_loop, name='user-reindex', daemon=True)
+            self._thread.start()
+        return self
+
+    def _reindex_loop(self):
+        while not self._stop.wait(self.reindex_interval):
+            try:
+                self.reindex()
+            except Exception:
+                count('fallback.user_reindex')
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Online user-item matrix tools.")
+    parser.add_argument('--reindex', action='store_true',
+                        help="Fold logged interactions into the matrix and time one rebuild")
+    args = parser.parse_args()
+
+    if args.reindex:
+        from recommender import open_data
+        data = open_data(user_reindex_interval=0)
+        users = data['user_matrix']
+        started = time.perf_counter()
+        users.reindex(force=True)
+        print(f"{users.base_rows} built rows -> {users.snapshot().shape[0]} rows "
+              f"({users.snapshot().nnz} ratings), rebuilt in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
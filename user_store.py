@@ -0,0 +1,454 @@
+"""
+User Store
+
+Pluggable persistence for user accounts (numeric ID, view history, cart),
+replacing the read-modify-write of the whole `users_db.json` on every click.
+
+History and cart changes are events, (kind, payload) pairs: VIEW,
+CART_ADD and CART_CLEAR. `append` writes all the events of one page action
+(or one Streamlit rerun) in a single call, and a record is its last
+snapshot with the later events folded on top (`apply_events`). Only the
+HISTORY_CAP most recent views are kept, which is all the recommender
+reads.
+
+- SQLiteUserStore (default): one row per user, holding the snapshot, plus
+  an append-only `events` table, in a WAL-mode SQLite file. Appending
+  costs one INSERT per event, however long the user's history is. Once
+  SNAPSHOT_EVERY events pile up past a snapshot they are folded into the
+  user row, so a read replays a bounded number of events. `compact`
+  deletes the events the snapshots cover. A small connection pool is
+  shared by all sessions. An optional write-behind mode buffers events
+  per user and flushes them in one transaction from a background thread.
+- JSONUserStore: the original single-file format, now with a lock and an
+  atomic temp-file + rename on every save.
+
+Existing `users_db.json` files are imported into SQLite on first open.
+Their accounts have the old random IDs, and an ID inside the built
+user-item matrix is another user's row there. Those accounts are given a
+new ID above every legacy one as they are imported.
+
+    python user_store.py --migrate
+    python user_store.py --compact
+"""
+import os
+import json
+import queue
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+
+from metrics import count
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+USERS_FILE = os.path.join(BASE_DIR, 'users_db.json')
+USERS_DB = os.path.join(BASE_DIR, 'users.db')
+
+POOL_SIZE = 4
+FLUSH_INTERVAL = 0.5  # seconds between write-behind flushes
+
+FIELDS = ('history', 'cart')
+HISTORY_CAP = 50      # most recent views kept per user; recommendations read the last 20
+SNAPSHOT_EVERY = 64   # events past a snapshot before they are folded into the user row
+
+# Event kinds and their payloads
+VIEW = 'view'              # product row position
+CART_ADD = 'cart_add'      # cart item dict
+CART_CLEAR = 'cart_clear'  # None
+
+
+def _dumps(value):
+    # Product indices may arrive as numpy ints
+    return json.dumps(value, default=int)
+
+
+def apply_events(record, events, history_cap=HISTORY_CAP):
+    """A copy of `record` with the events folded into its history and cart."""
+    history, cart = list(record.get('history', [])), list(record.get('cart', []))
+    for kind, payload in events:
+        if kind == VIEW:
+            history.append(payload)
+        elif kind == CART_ADD:
+            cart.append(payload)
+        elif kind == CART_CLEAR:
+            cart = []
+    return {**record, 'history': history[-history_cap:], 'cart': cart}
+
+
+class UserStore:
+    """
+    Backend interface. Records are dicts: {'id': int, 'history': [...], 'cart': [...]}.
+    """
+
+    def get(self, username):
+        raise NotImplementedError
+
+    def create(self, username, record):
+        """Insert a new user; False if the name is taken."""
+        raise NotImplementedError
+
+    def register(self, username, min_id=0):
+        """
+        Create an empty account with the next free numeric ID (at least
+        `min_id`, above every existing account); the ID, or None if the name
+        is taken.
+        """
+        raise NotImplementedError
+
+    def update(self, username, **fields):
+        """Overwrite the given fields (history / cart) of one user."""
+        raise NotImplementedError
+
+    def append(self, username, events):
+        """Add (kind, payload) events to the user's history / cart in one write."""
+        raise NotImplementedError
+
+    def all_users(self):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class JSONUserStore(UserStore):
+    def __init__(self, path=USERS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r') as f:
+            try: return json.load(f)
+            except ValueError: return {}
+
+    def _save(self, users):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(_dumps(users))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def get(self, username):
+        with self._lock:
+            return self._load().get(username)
+
+    def create(self, username, record):
+        with self._lock:
+            users = self._load()
+            if username in users:
+                return False
+            users[username] = record
+            self._save(users)
+            return True
+
+    def register(self, username, min_id=0):
+        with self._lock:
+            users = self._load()
+            if username in users:
+                return None
+            new_id = max([min_id] + [int(u['id']) + 1 for u in users.values()])
+            users[username] = {'id': new_id, 'history': [], 'cart': []}
+            self._save(users)
+            return new_id
+
+    def update(self, username, **fields):
+        with self._lock:
+            users = self._load()
+            if username not in users:
+                return
+            users[username].update(fields)
+            self._save(users)
+
+    def append(self, username, events):
+        if not events:
+            return
+        with self._lock:
+            users = self._load()
+            if username not in users:
+                return
+            users[username] = apply_events(users[username], events)
+            self._save(users)
+
+    def all_users(self):
+        with self._lock:
+            return self._load()
+
+
+class SQLiteUserStore(UserStore):
+    def __init__(self, path=USERS_DB, pool_size=POOL_SIZE, write_behind=False,
+                 flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self._pool = queue.Queue()
+        for _ in range(pool_size):
+            self._pool.put(self._connect())
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                " username TEXT PRIMARY KEY,"
+                " id INTEGER NOT NULL,"
+                " history TEXT NOT NULL DEFAULT '[]',"
+                " cart TEXT NOT NULL DEFAULT '[]',"
+                " snapshot_seq INTEGER NOT NULL DEFAULT 0)"
+            )
+            if 'snapshot_seq' not in {row[1] for row in conn.execute("PRAGMA table_info(users)")}:
+                # DBs created before the event streams
+                conn.execute("ALTER TABLE users ADD COLUMN snapshot_seq INTEGER NOT NULL DEFAULT 0")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " username TEXT NOT NULL,"
+                " kind TEXT NOT NULL,"
+                " payload TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS events_user ON events (username, seq)")
+
+        # Write-behind: events per user not yet in the DB, flushed together
+        self.write_behind = write_behind
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = None
+        if write_behind:
+            self._flush_interval = flush_interval
+            self._flusher = threading.Thread(target=self._flush_loop, name='user-store-flush', daemon=True)
+            self._flusher.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    @contextmanager
+    def _transaction(self, mode="IMMEDIATE"):
+        with self._connection() as conn:
+            conn.execute(f"BEGIN {mode}")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    # --- READS ---
+    @staticmethod
+    def _replay(conn, username):
+        """(snapshot + later events, number of events past the snapshot); (None, 0) if unknown."""
+        row = conn.execute("SELECT id, history, cart, snapshot_seq FROM users WHERE username = ?",
+                           (username,)).fetchone()
+        if row is None:
+            return None, 0
+        events = [(kind, json.loads(payload)) for kind, payload in conn.execute(
+            "SELECT kind, payload FROM events WHERE username = ? AND seq > ? ORDER BY seq", (username, row[3]))]
+        record = {'id': row[0], 'history': json.loads(row[1]), 'cart': json.loads(row[2])}
+        return apply_events(record, events), len(events)
+
+    def get(self, username):
+        if not self.write_behind:
+            with self._transaction("DEFERRED") as conn:
+                return self._replay(conn, username)[0]
+        # Holding the flush lock, no events are half-way between buffer and DB
+        with self._flush_lock:
+            with self._pending_lock:
+                pending = list(self._pending.get(username, ()))
+            with self._transaction("DEFERRED") as conn:
+                record = self._replay(conn, username)[0]
+        return apply_events(record, pending) if record is not None and pending else record
+
+    def all_users(self):
+        with self._connection() as conn:
+            rows = conn.execute("SELECT username FROM users").fetchall()
+        return {name: self.get(name) for (name,) in rows}
+
+    # --- WRITES ---
+    def create(self, username, record):
+        try:
+            with self._transaction() as conn:
+                conn.execute("INSERT INTO users (username, id, history, cart) VALUES (?, ?, ?, ?)",
+                             (username, int(record['id']), _dumps(record.get('history', [])[-HISTORY_CAP:]),
+                              _dumps(record.get('cart', []))))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def register(self, username, min_id=0):
+        try:
+            # BEGIN IMMEDIATE serialises concurrent registrations across processes
+            with self._transaction() as conn:
+                (top,) = conn.execute("SELECT MAX(id) FROM users").fetchone()
+                new_id = max(min_id, top + 1 if top is not None else 0)
+                conn.execute("INSERT INTO users (username, id) VALUES (?, ?)", (username, new_id))
+            return new_id
+        except sqlite3.IntegrityError:
+            return None
+
+    def update(self, username, **fields):
+        """Overwrite history / cart with a new snapshot; earlier events are superseded."""
+        fields = {k: json.loads(_dumps(v)) for k, v in fields.items() if k in FIELDS}
+        if not fields:
+            return
+        with self._flush_lock:
+            with self._pending_lock:
+                self._pending.pop(username, None)
+            with self._transaction() as conn:
+                record = self._replay(conn, username)[0]
+                if record is not None:
+                    self._snapshot(conn, username, apply_events({**record, **fields}, ()))
+
+    def append(self, username, events):
+        # Round-trip through JSON so buffered payloads read back exactly as stored ones
+        events = [(kind, json.loads(_dumps(payload))) for kind, payload in events]
+        if not events:
+            return
+        if self.write_behind:
+            with self._pending_lock:
+                self._pending.setdefault(username, []).extend(events)
+            return
+        self._write({username: events})
+
+    def _write(self, streams):
+        """Append the events of several users in one transaction, snapshotting long streams."""
+        with self._transaction() as conn:
+            for username, events in streams.items():
+                row = conn.execute("SELECT snapshot_seq FROM users WHERE username = ?", (username,)).fetchone()
+                if row is None:
+                    continue
+                conn.executemany("INSERT INTO events (username, kind, payload) VALUES (?, ?, ?)",
+                                 [(username, kind, _dumps(payload)) for kind, payload in events])
+                (backlog,) = conn.execute("SELECT COUNT(*) FROM events WHERE username = ? AND seq > ?",
+                                          (username, row[0])).fetchone()
+                if backlog >= SNAPSHOT_EVERY:
+                    self._snapshot(conn, username, self._replay(conn, username)[0])
+
+    @staticmethod
+    def _snapshot(conn, username, record):
+        conn.execute("UPDATE users SET history = ?, cart = ?,"
+                     " snapshot_seq = COALESCE((SELECT MAX(seq) FROM events WHERE username = ?), snapshot_seq)"
+                     " WHERE username = ?",
+                     (_dumps(record['history']), _dumps(record['cart']), username, username))
+
+    def flush(self):
+        with self._flush_lock:
+            with self._pending_lock:
+                streams, self._pending = self._pending, {}
+            if not streams:
+                return
+            try:
+                self._write(streams)
+            except Exception:
+                # Back in front of anything buffered meanwhile, for the next flush
+                with self._pending_lock:
+                    for username, events in streams.items():
+                        self._pending[username] = events + self._pending.get(username, [])
+                raise
+
+    def _flush_loop(self):
+        while not self._stop.wait(self._flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                # The batch stays queued; the next tick retries it
+                count('fallback.user_store_flush')
+
+    def close(self):
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+
+    def compact(self):
+        """
+        Fold every user's pending events into a snapshot and delete the events
+        snapshots cover. Returns (users snapshotted, events deleted).
+        """
+        self.flush()
+        with self._transaction() as conn:
+            names = [name for (name,) in conn.execute(
+                "SELECT DISTINCT e.username FROM events e JOIN users u ON u.username = e.username"
+                " WHERE e.seq > u.snapshot_seq")]
+            for name in names:
+                self._snapshot(conn, name, self._replay(conn, name)[0])
+            # Events of deleted users go too (no snapshot: COALESCE falls back to their own seq)
+            deleted = conn.execute(
+                "DELETE FROM events WHERE seq <= COALESCE("
+                "(SELECT snapshot_seq FROM users WHERE users.username = events.username), seq)").rowcount
+        return len(names), deleted
+
+    # --- MIGRATION ---
+    def import_json(self, path=USERS_FILE, min_id=0):
+        """
+        Copy users from a legacy JSON DB (existing usernames are left alone).
+        IDs below `min_id`, the rows of the built user-item matrix, are
+        replaced by fresh ones above every legacy and existing ID. Returns
+        the number of users imported.
+        """
+        legacy = JSONUserStore(path).all_users()
+        imported = 0
+        with self._transaction() as conn:
+            (top,) = conn.execute("SELECT MAX(id) FROM users").fetchone()
+            next_id = max([min_id, top + 1 if top is not None else 0]
+                          + [int(record['id']) + 1 for record in legacy.values()])
+            for username, record in legacy.items():
+                user_id = int(record['id'])
+                if user_id < min_id:
+                    user_id, next_id = next_id, next_id + 1
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO users (username, id, history, cart) VALUES (?, ?, ?, ?)",
+                    (username, user_id, _dumps(record.get('history', [])[-HISTORY_CAP:]),
+                     _dumps(record.get('cart', []))))
+                imported += cur.rowcount
+        return imported
+
+
+def open_user_store(backend='sqlite', write_behind=False, db_path=USERS_DB, json_path=USERS_FILE,
+                    min_id=0):
+    """
+    Build the configured backend. A newly created SQLite DB imports any
+    legacy JSON users (the JSON file is left in place as a backup);
+    `min_id` is as in `import_json`.
+    """
+    if backend == 'json':
+        return JSONUserStore(json_path)
+    fresh = not os.path.exists(db_path)
+    store = SQLiteUserStore(db_path, write_behind=write_behind)
+    if fresh and os.path.exists(json_path):
+        store.import_json(json_path, min_id)
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the ShopSense user store.")
+    parser.add_argument('--db', default=USERS_DB)
+    parser.add_argument('--migrate', metavar='JSON', nargs='?', const=USERS_FILE,
+                        help="Import users from a legacy users_db.json")
+    parser.add_argument('--compact', action='store_true',
+                        help="Snapshot every user and delete the events the snapshots cover")
+    args = parser.parse_args()
+
+    store = SQLiteUserStore(args.db)
+    if args.migrate:
+        from artifacts import open_artifacts
+        min_id = open_artifacts()['user_item_matrix'].shape[0]
+        print(f"Imported {store.import_json(args.migrate, min_id)} user(s) from {args.migrate}")
+    if args.compact:
+        users, deleted = store.compact()
+        print(f"Snapshotted {users} user(s), deleted {deleted} event(s)")
+    print(f"{len(store.all_users())} user(s) in {args.db}")
+
+
+if __name__ == '__main__':
+    main()